@@ -14,7 +14,16 @@ setup(
 	
 	entry_points = {
         'console_scripts': [
-            'vaspcat = vaspcat.application:main'
+            'vaspcat = vaspcat.application:main',
+            'vaspcat-client = vaspcat.src.daemon:client',
+            'vaspcat-bench = vaspcat.src.bench:main'
+        ],
+        'vaspcat.formats': [
+            'cif = vaspcat.extend.posext:Cif',
+            'pdb = vaspcat.extend.posext:Pdb',
+            'xyz = vaspcat.extend.posext:Xyz',
+            'extxyz = vaspcat.extend.posext:Xyz',
+            'xdatcar = vaspcat.extend.posext:Xdatcar'
         ]
     }
 )
@@ -0,0 +1,207 @@
+import io
+import logging
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+from vaspcat.src import compress, dynamics, formats, poscar as _poscar, \
+    potcar as _potcar, profiler
+
+# Library interface for converting structures inside another Python
+# program.  Unlike application.main, nothing here looks at the working
+# directory, writes files, configures logging or exits: inputs are paths,
+# bytes or open streams, results are returned as objects and strings, and
+# errors are raised.
+#
+#    from vaspcat import api
+#
+#    structure = api.read('NaCl.cif', transforms=[('niggli', niggli.apply)])
+#    text = api.poscar(structure)
+#    api.potcar(structure, stream=buffer)
+#
+# Messages of the vaspcat loggers are dropped unless the calling program
+# configures logging itself.
+
+logging.getLogger('vaspcat').addHandler(logging.NullHandler())
+
+Structure = namedtuple('Structure', 'lat_vec atom_info frac_pos info')
+Structure.__doc__ = '''Parsed structure, the 4-tuple returned by parse().
+
+It can be passed anywhere the tuple is expected, e.g. to the transforms
+in vaspcat.extend or to poscar.Convert.write.
+'''
+
+
+def read(source, format=None, transforms=()) -> 'Structure':
+    '''Parses a structure from a path, bytes or a stream.
+
+    Args:
+        source: Path of the file, its content as bytes, or an open text
+                or binary stream.  Streams are read from their current
+                position and are not closed.
+        format: Registered format name, e.g. 'cif'.  If not given, it is
+                taken from the file extension of a path, or identified
+                from the content, see formats.match.
+        transforms: Sequence of (name, function) tuples applied after
+                    parsing, as for poscar.Convert.
+
+    Returns:
+        The first structure in the source.
+
+    Exceptions:
+        ValueError: Occurs when the format cannot be determined or is not
+                    registered, and for content the format cannot parse.
+        IOError: Occurs when a path cannot be read.
+    '''
+
+    stream, fmt = _open(source, format)
+
+    with _errors(fmt, stream), profiler.stage('read'):
+        data = fmt.read(stream)
+    return _build(fmt, data, transforms, stream)
+
+
+def frames(source, format=None, start=0, stop=None, step=1,
+           transforms=()) -> 'Iterator of Structure':
+    '''Parses the selected frames of a trajectory one at a time.
+
+    Args:
+        source, format, transforms: As for read.
+        start, stop, step: Frame selection, as for --frames.
+
+    Exceptions:
+        ValueError: Occurs as for read, and when the format does not hold
+                    several frames.
+    '''
+
+    stream, fmt = _open(source, format)
+    if not hasattr(fmt, 'frames'):
+        raise ValueError('{0} files hold a single structure; use read.'
+                         .format(fmt.__name__))
+
+    with _errors(fmt, stream):
+        for data in fmt.frames(stream, start, stop, step):
+            yield _build(fmt, data, transforms, stream)
+
+
+def poscar(structure, stream=None,
+           selective=dynamics.DEFAULT) -> 'POSCAR string, or None':
+    '''Renders the POSCAR of a structure.
+
+    Args:
+        structure: Structure, or any parse() 4-tuple.
+        stream: Optional text stream to write to.  If not given, the
+                POSCAR is returned as a string.
+        selective: Selective dynamics rules, see dynamics.py, or None to
+                   leave the block out.
+    '''
+
+    out = io.StringIO() if stream is None else stream
+    with profiler.stage('format'):
+        _poscar.Convert.render(out, structure, selective)
+
+    return out.getvalue() if stream is None else None
+
+
+def potcar(structure, stream=None) -> 'POTCAR string, or None':
+    '''Renders the POTCAR of a structure, in the POSCAR species order.
+
+    Args:
+        structure: Structure, or any parse() 4-tuple.
+        stream: Optional text stream to write to.  If not given, the
+                POTCAR is returned as a string.
+
+    Exceptions:
+        IOError: Occurs when potext has no POTCAR for a species.
+    '''
+
+    out = io.StringIO() if stream is None else stream
+    with profiler.stage('potcar'):
+        _potcar.write(out, [name for name, count in structure[1]])
+
+    return out.getvalue() if stream is None else None
+
+
+def convert(source, format=None, transforms=(),
+            selective=dynamics.DEFAULT) -> '(POSCAR, POTCAR) strings':
+    '''Reads a structure and renders both of its VASP input files.
+
+    Args:
+        source, format, transforms: As for read.
+        selective: As for poscar.
+    '''
+
+    structure = read(source, format, transforms)
+    return poscar(structure, selective=selective), potcar(structure)
+
+
+def _open(source, format) -> '(path or text stream, format class)':
+    if isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        if format is None:
+            format = compress.extension(path)
+            if format not in formats.registry():
+                format = formats.sniff(path)
+        return path, _load(format, path)
+
+    if hasattr(source, 'read'):
+        head = source.read(0)
+        if isinstance(head, bytes):
+            source = source.read()
+        elif format is None:
+            # Text streams are only peeked at when they can seek back,
+            # anything else is read into memory first.
+            if source.seekable():
+                pos = source.tell()
+                head = source.read(formats.SNIFF_SIZE)
+                source.seek(pos)
+            else:
+                source = io.StringIO(source.read())
+                head = source.getvalue()[:formats.SNIFF_SIZE]
+            format = formats.match(head.encode('utf-8', 'replace'))
+            return source, _load(format, 'stream')
+        else:
+            return source, _load(format, 'stream')
+
+    if isinstance(source, (bytes, bytearray)):
+        if format is None:
+            format = formats.match(bytes(source[:formats.SNIFF_SIZE]))
+        text = io.StringIO(bytes(source).decode('utf-8', 'replace'))
+        return text, _load(format, 'data')
+
+    raise TypeError('Cannot read structures from {0}.'
+                    .format(type(source).__name__))
+
+
+def _load(format, name) -> 'Format class':
+    if format is None:
+        raise ValueError('Cannot tell the format of {0}; pass format.'
+                         .format(name))
+    try:
+        return formats.load(format)
+    except KeyError:
+        raise ValueError('No format {0!r} is registered.'.format(format))
+
+
+def _build(fmt, data, transforms, source) -> 'Structure':
+    with _errors(fmt, source), profiler.stage('parse'):
+        structure = fmt.parse(data)
+
+    for name, transform in transforms:
+        with profiler.stage(name):
+            structure = transform(*structure)
+
+    return Structure(*structure)
+
+
+@contextmanager
+def _errors(fmt, source):
+    # The parsers index into what they read without checking it, so broken
+    # content shows up as lookup errors.  They are raised as the ValueError
+    # read promises, naming the file.
+    try:
+        yield
+    except (KeyError, IndexError, UnboundLocalError) as err:
+        name = source if isinstance(source, str) else 'the stream'
+        raise ValueError('Cannot parse {0} as a {1} file ({2}: {3}).'
+                         .format(name, fmt.__name__.lower(),
+                                 type(err).__name__, err)) from err
@@ -1,10 +1,452 @@
+import argparse
+import logging
 import os
-from vaspcat.src import poscar, potcar  
+import sqlite3
+import sys
+from functools import partial
+from vaspcat.extend import (findsym, fingerprint, niggli, order, primitive,
+                            slab, validate)
+from vaspcat.src import (cache, compress, daemon, duplicates, dynamics, log,
+                         poscar, potcar, profiler, sink)
 
-def main():
+logger = logging.getLogger(__name__)
+
+def main(argv=None):
+    args = parse_args(argv)
     directory = os.getcwd()
-    print('VaspCat')
-    atom_list = poscar.main(directory)
-    potcar.main(directory, atom_list)
-    print('Done!')
-    
+
+    # Batch runs only report warnings and errors unless asked otherwise,
+    # since a banner per structure floods the terminal on large batches.
+    level = logging.WARNING if args.batch else logging.INFO
+    level = {-1: logging.WARNING, 1: logging.DEBUG}.get(args.verbose, level)
+    event_file = log.setup(level, event_path=args.events)
+
+    if args.serve:
+        try:
+            daemon.serve(args.serve, workers=args.jobs)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.profile:
+        profiler.enable()
+
+    logger.info('VaspCat')
+    try:
+        ok = profiler.run(convert, directory, args, cprofile=args.cprofile)
+    finally:
+        if event_file:
+            event_file.close()
+
+    if args.profile:
+        profiler.save(args.profile)
+
+    if not ok:
+        sys.exit(1)
+    logger.info('Done!')
+
+
+def options(args) -> 'Dictionary of keyword arguments for Convert':
+    '''Returns the conversion options selected on the command line.'''
+
+    # Ordering works on the sites of the cif cell, so it comes first.
+    stages = []
+    if args.order:
+        stages.append(('order', partial(order.apply,
+                                        supercell=args.supercell,
+                                        limit=args.order_limit)))
+    if args.slab:
+        stages.append(('slab', partial(slab.apply, miller=args.slab,
+                                       layers=args.layers,
+                                       vacuum=args.vacuum,
+                                       termination=args.termination)))
+    if args.primitive:
+        stages.append(('primitive', primitive.apply))
+    if args.niggli:
+        stages.append(('niggli', niggli.apply))
+    if args.validate is not None:
+        stages.append(('validate', partial(validate.apply,
+                                           factor=args.validate)))
+    if args.symmetry:
+        stages.append(('symmetry', findsym.apply))
+
+    # The fingerprint is taken of the structure as it is written.
+    index = None
+    if args.duplicates:
+        stages.append(('fingerprint', fingerprint.apply))
+        try:
+            index = duplicates.Index(args.duplicates, args.fingerprints)
+        except (OSError, ValueError) as err:
+            raise ValueError('Cannot load {0} ({1})'.format(
+                args.fingerprints, err))
+
+    store = None
+    if args.cache:
+        store = cache.Cache(args.cache, int(args.cache_size*1024**2))
+        try:
+            store.check()
+        except (OSError, sqlite3.Error) as err:
+            raise ValueError('Cannot open the parse cache {0} ({1})'.format(
+                args.cache, err))
+
+    return {'transforms': stages, 'mapped': args.mmap,
+            'frames': args.frames, 'xdatcar': args.xdatcar,
+            'cache': store, 'selective': selective(args),
+            'duplicates': index}
+
+
+def selective(args) -> 'List of selective dynamics rules, or None':
+    '''Returns the dynamics.py rules selected on the command line.
+
+    Without any --fix option every atom is fixed, as in earlier versions.
+    '''
+
+    if args.no_selective:
+        return None
+
+    rules = []
+    if args.fix_below is not None:
+        rules.append(('below', args.fix_below))
+    if args.fix_species:
+        rules.append(('species',) + tuple(args.fix_species))
+    for x, y, z, r in args.fix_near:
+        rules.append(('near', (x, y, z), r))
+
+    return rules or dynamics.DEFAULT
+
+
+def convert(directory, args) -> 'True if every file was converted':
+    '''Generates POSCAR and POTCAR files from the files in directory.
+
+    Args:
+        directory: Folder which vaspcat is run from.
+        args: Command line options.  Without --batch, the first
+              convertable file is written to directory.  With --batch,
+              every convertable file is written to its own folder, named
+              after the file, in directory.  With --archive, the files
+              go into one archive instead, under the same names.  With
+              --duplicates, structures met before are skipped or linked.
+    '''
+
+    try:
+        opts = options(args)
+    except ValueError as err:
+        logger.error('%s', err)
+        return False
+
+    opts['sink'] = sink.Directory()
+    if args.archive:
+        try:
+            opts['sink'] = sink.open_sink(args.archive, directory)
+        except (ImportError, OSError, ValueError) as err:
+            logger.error('Cannot write %s (%s)', args.archive, err)
+            return False
+
+    try:
+        return convert_all(directory, args, opts)
+    finally:
+        opts['sink'].close()
+        if opts['duplicates'] is not None:
+            opts['duplicates'].close()
+        if opts['cache'] is not None:
+            opts['cache'].close()
+
+
+def convert_all(directory, args, opts) -> 'True if every file was converted':
+    '''Runs the conversions of convert with the options opts.'''
+
+    if not args.batch:
+        source = poscar.find(directory, poscar.supported())
+        return convert_file(directory, source, opts)
+
+    found = poscar.find_all(directory, poscar.supported(), args.sniff,
+                            args.recursive, args.include, args.exclude)
+    log.event('run_start', directory=directory)
+
+    # Discovery is lazy, so the number of files is only known at the end.
+    total = [0]
+
+    def jobs():
+        for path, ext in found:
+            total[0] += 1
+            yield (path, ext), output_dir(directory, path)
+
+    if args.pipeline:
+        # asyncio adds about 60 ms to the start of every run, so it is
+        # only imported when the pipeline is used.
+        from vaspcat.src import pipeline
+        failed = pipeline.run(jobs(), opts, workers=args.jobs)
+    else:
+        failed = 0
+        for source, outdir in jobs():
+            if not convert_file(outdir, source, opts):
+                failed += 1
+
+    logger.warning('Converted %d of %d files.', total[0] - failed, total[0])
+    if opts['duplicates'] is not None and opts['duplicates'].found:
+        logger.warning('%d of them were duplicates, and were %s.',
+                       opts['duplicates'].found,
+                       {'skip': 'skipped', 'link': 'linked'}[args.duplicates])
+    log.event('run_end', directory=directory, files=total[0],
+              failed=failed)
+    return failed == 0
+
+
+def output_dir(directory, path) -> 'Batch output folder for path':
+    '''Returns the folder in directory named after the input file.
+
+    Files found in sub-folders with --recursive keep their relative
+    location.  A compression suffix is dropped, so a.cif.gz is written
+    to a.  Files without an extension, found with --sniff, get a
+    '_vasp' suffix so the folder does not collide with the file itself.
+    '''
+
+    rel = compress.split(os.path.relpath(path, directory))[0]
+    name, ext = os.path.splitext(rel)
+    return os.path.join(directory, name if ext else name + '_vasp')
+
+
+def convert_file(outdir, source,
+                 options=None) -> 'True if the file was converted':
+    '''Writes the POSCAR and POTCAR files for one input file.
+
+    Args:
+        outdir: Folder the POSCAR and POTCAR files are saved in.
+        source: (path, extension) tuple of the file to convert.
+        options: Dictionary of keyword arguments for poscar.Convert.
+
+    Returns:
+        False if the conversion failed.  The error is logged and sent to
+        the event stream rather than raised, so a batch can continue.
+        Duplicates, see duplicates.py, count as converted.
+    '''
+
+    status, error, original, atom_list = 'ok', None, None, []
+
+    with log.Timer() as timer:
+        try:
+            atom_list = poscar.main(outdir, source, **(options or {}))
+            potcar.main(outdir, atom_list, (options or {}).get('sink'))
+        except duplicates.Duplicate as dup:
+            status, original = 'duplicate', dup.original
+            logger.info('Skipped %s, a duplicate of %s.', source[0],
+                        original)
+        except Exception as err:
+            status, error = 'error', '{0}: {1}'.format(type(err).__name__,
+                                                       err)
+            logger.error('Could not convert %s (%s)', source[0], error)
+            logger.debug('Traceback:', exc_info=True)
+
+    profiler.count_file()
+    log.event('file', path=source[0], format=source[1], output=outdir,
+              status=status, error=error, duplicate_of=original,
+              species=atom_list, wall=round(timer.wall, 6),
+              cpu=round(timer.cpu, 6))
+
+    return status != 'error'
+
+
+def frame_slice(text) -> '(start, stop, step) tuple':
+    '''Converts a START:STOP:STEP command line value to a tuple.'''
+
+    part = (text.split(':') + ['', ''])[:3]
+    try:
+        start, stop, step = [int(p) if p.strip() else None for p in part]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected START:STOP:STEP, got {0!r}'.format(text))
+
+    return start or 0, stop, step or 1
+
+
+def parse_args(argv) -> 'argparse.Namespace of command line options':
+    parser = argparse.ArgumentParser(
+        prog='vaspcat',
+        description='Generate VASP input files from crystal geometry files.'
+    )
+    parser.add_argument(
+        '--batch', action='store_true',
+        help='convert every supported file, each into its own folder'
+    )
+    parser.add_argument(
+        '--profile', nargs='?', const='-', metavar='FILE',
+        help='write per-stage wall time, CPU time and allocation counts '
+             'as JSON to FILE (stdout if omitted)'
+    )
+    parser.add_argument(
+        '--cprofile', metavar='FILE',
+        help='run the conversion under cProfile and dump stats to FILE'
+    )
+
+    parser.add_argument(
+        '--serve', nargs='?', const=daemon.DEFAULT_SOCKET, metavar='SOCKET',
+        help='keep running and convert the files sent by vaspcat-client '
+             'over the Unix socket SOCKET (default: {0})'
+             .format(daemon.DEFAULT_SOCKET.replace('%', '%%'))
+    )
+    parser.add_argument(
+        '--async', action='store_true', dest='pipeline',
+        help='with --batch, overlap file reads, parsing and writes'
+    )
+    parser.add_argument(
+        '--jobs', type=int, metavar='N',
+        help='number of parsing processes for --async and of conversion '
+             'processes for --serve (default: CPU count)'
+    )
+    parser.add_argument(
+        '-r', '--recursive', action='store_true',
+        help='with --batch, also convert files in sub-folders'
+    )
+    parser.add_argument(
+        '--include', action='append', default=[], metavar='GLOB',
+        help='with --batch, only convert files matching GLOB (repeatable)'
+    )
+    parser.add_argument(
+        '--exclude', action='append', default=[], metavar='GLOB',
+        help='with --batch, skip files and folders matching GLOB '
+             '(repeatable)'
+    )
+    parser.add_argument(
+        '--sniff', action='store_true',
+        help='with --batch, also convert files with unknown extensions '
+             'whose content matches a registered format'
+    )
+    parser.add_argument(
+        '--frames', type=frame_slice, default=(0, None, 1),
+        metavar='START:STOP:STEP',
+        help='frames to convert from trajectory files such as extended '
+             'xyz, e.g. ::100 for every 100th frame'
+    )
+    parser.add_argument(
+        '--xdatcar', action='store_true',
+        help='write the selected frames of a trajectory to one XDATCAR '
+             'file instead of one POSCAR_<frame> file per frame'
+    )
+    parser.add_argument(
+        '--archive', metavar='FILE',
+        help='write all output files into the archive FILE (.tar, .tar.gz, '
+             '.zip or, with h5py, .h5) instead of one folder per input, '
+             'with an index.json of the members'
+    )
+    parser.add_argument(
+        '--mmap', action='store_true',
+        help='read input files through memory maps, which keeps peak '
+             'memory down for very large cif and pdb files; compressed '
+             'files are streamed instead'
+    )
+    parser.add_argument(
+        '--cache', nargs='?', const=cache.DEFAULT_PATH, metavar='FILE',
+        help='reuse parsed structures of unchanged input files across '
+             'runs, stored in the SQLite database FILE (default: {0})'
+             .format(cache.DEFAULT_PATH.replace('%', '%%'))
+    )
+    parser.add_argument(
+        '--cache-size', type=float, default=cache.DEFAULT_SIZE/1024**2,
+        metavar='MB',
+        help='evict the least recently used cached structures beyond MB '
+             'megabytes (default: %(default)g)'
+    )
+    parser.add_argument(
+        '--primitive', action='store_true',
+        help='write the primitive cell of centered (A, B, C, I, F, R) '
+             'space groups instead of the conventional cell'
+    )
+    parser.add_argument(
+        '--niggli', action='store_true',
+        help='write the Niggli reduced cell instead of the input cell'
+    )
+    fix = parser.add_argument_group(
+        'selective dynamics',
+        'Atoms selected by any --fix option are fixed and all others can '
+        'relax.  Without them every atom is fixed.')
+    fix.add_argument(
+        '--fix-below', type=float, metavar='Z',
+        help='fix atoms with a fractional height below Z'
+    )
+    fix.add_argument(
+        '--fix-species', action='append', default=[], metavar='NAME',
+        help='fix atoms of species NAME (repeatable)'
+    )
+    fix.add_argument(
+        '--fix-near', nargs=4, type=float, action='append', default=[],
+        metavar=('X', 'Y', 'Z', 'R'),
+        help='fix atoms within R Angstrom of the fractional point X Y Z '
+             '(repeatable)'
+    )
+    fix.add_argument(
+        '--no-selective', action='store_true',
+        help='leave the Selective Dynamics block out of the POSCAR, so '
+             'every atom relaxes'
+    )
+    parser.add_argument(
+        '--order', action='store_true',
+        help='replace partially occupied cif sites by the ordered '
+             'supercell configuration with the lowest electrostatic '
+             'energy estimate'
+    )
+    parser.add_argument(
+        '--supercell', nargs=3, type=int, metavar=('NA', 'NB', 'NC'),
+        help='with --order, supercell to order in (default: the smallest '
+             'that fits the occupancies)'
+    )
+    parser.add_argument(
+        '--order-limit', type=int, default=order.LIMIT, metavar='N',
+        help='with --order, number of symmetry-distinct configurations '
+             'compared (default: %(default)d)'
+    )
+    parser.add_argument(
+        '--slab', nargs=3, type=int, metavar=('H', 'K', 'L'),
+        help='write a surface slab with Miller index (H K L) of the '
+             'input cell instead of the bulk'
+    )
+    parser.add_argument(
+        '--layers', type=int, default=1, metavar='N',
+        help='with --slab, number of surface cells stacked along the '
+             'normal (default: %(default)d)'
+    )
+    parser.add_argument(
+        '--vacuum', type=float, default=10.0, metavar='ANGSTROM',
+        help='with --slab, vacuum thickness (default: %(default)g)'
+    )
+    parser.add_argument(
+        '--termination', type=int, default=0, metavar='N',
+        help='with --slab, index of the surface termination; the number '
+             'of distinct terminations is reported (default: %(default)d)'
+    )
+    parser.add_argument(
+        '--validate', nargs='?', type=float, const=validate.FACTOR,
+        metavar='FACTOR',
+        help='fail the conversion when two atoms are closer than FACTOR '
+             'times the sum of their covalent radii (default: %(const)g)'
+    )
+    parser.add_argument(
+        '--symmetry', action='store_true',
+        help='detect the space group of the written cell and report it'
+    )
+    parser.add_argument(
+        '--duplicates', choices=duplicates.MODES,
+        help='with --batch, find structures that were already converted '
+             'from another file, in any cell setting, and skip them or '
+             'link their folder to the first one'
+    )
+    parser.add_argument(
+        '--fingerprints', metavar='FILE',
+        help='with --duplicates, keep the structure fingerprints in the '
+             'JSON file FILE, so duplicates of earlier runs are found too'
+    )
+
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument(
+        '-v', '--verbose', action='store_const', const=1, default=0,
+        help='report progress in detail'
+    )
+    verbosity.add_argument(
+        '-q', '--quiet', action='store_const', const=-1, dest='verbose',
+        help='only report warnings and errors'
+    )
+    parser.add_argument(
+        '--events', metavar='FILE',
+        help="append a JSON-lines stream of per-file status and timings "
+             "to FILE ('-' for stdout)"
+    )
+    return parser.parse_args(argv)
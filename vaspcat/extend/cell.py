@@ -0,0 +1,164 @@
+from math import acos, cos, sin, sqrt
+
+# Cell geometry shared by the parsers in posext.py and by any later stage
+# that needs lattice information.  Every function taking cell parameters
+# accepts a sequence of 6-tuples
+#
+#    [(a, b, c, alpha, beta, gamma), ...]
+#
+# with lengths in Angstrom and angles in radians, and returns one result per
+# cell, so a batch of structures can be handled with a single call.  Lattice
+# matrices are lists of three row vectors [a_vec, b_vec, c_vec] in the
+# standard orientation used by VASP converters: a along x, b in the xy-plane.
+
+
+def vectors(params) -> 'List of 3x3 lattice matrices':
+    '''Converts cell parameters to lattice vectors.
+
+    Args:
+        params: Sequence of (a, b, c, alpha, beta, gamma) tuples.
+
+    Returns:
+        A list of lattice matrices, each of the form
+        [[ax, 0, 0], [bx, by, 0], [cx, cy, cz]].
+    '''
+
+    out = []
+    for (a, b, c, alpha, beta, gamma), v in zip(params, volume(params)):
+        ca, cb, cg, sg = cos(alpha), cos(beta), cos(gamma), sin(gamma)
+        out.append([[a, 0.0, 0.0],
+                    [b*cg, b*sg, 0.0],
+                    [c*cb, c*(ca - cb*cg)/sg, v/(a*b*sg)]])
+
+    return out
+
+
+def volume(params) -> 'List of cell volumes':
+    '''Returns the unit cell volume for each set of cell parameters.'''
+
+    out = []
+    for a, b, c, alpha, beta, gamma in params:
+        ca, cb, cg = cos(alpha), cos(beta), cos(gamma)
+        out.append(a*b*c*sqrt(1 - ca**2 - cb**2 - cg**2 + 2*ca*cb*cg))
+
+    return out
+
+
+def metric(params) -> 'List of 3x3 metric tensors':
+    '''Returns the metric tensor G, with G[i][j] = a_i . a_j.'''
+
+    out = []
+    for a, b, c, alpha, beta, gamma in params:
+        ab, ac, bc = a*b*cos(gamma), a*c*cos(beta), b*c*cos(alpha)
+        out.append([[a*a, ab, ac],
+                    [ab, b*b, bc],
+                    [ac, bc, c*c]])
+
+    return out
+
+
+def inverse(params) -> 'List of inverse lattice matrices':
+    '''Returns the inverse of each lattice matrix.
+
+    Cartesian row vectors are converted to fractional coordinates by
+    right-multiplying with the inverse: frac = cart . inverse.
+    '''
+
+    return [inv(m) for m in vectors(params)]
+
+
+def reciprocal(params, twopi=False) -> 'List of reciprocal lattice matrices':
+    '''Returns the reciprocal lattice vectors as rows.
+
+    Args:
+        params: Sequence of (a, b, c, alpha, beta, gamma) tuples.
+        twopi: If True, use the physics convention a_i . b_j = 2*pi*d_ij
+               instead of the crystallographic a_i . b_j = d_ij.
+    '''
+
+    scale = 6.283185307179586 if twopi else 1.0
+    return [[[scale*x for x in row] for row in transpose(m)]
+            for m in inverse(params)]
+
+
+def parameters(matrices) -> 'List of (a, b, c, alpha, beta, gamma) tuples':
+    '''Converts lattice matrices back to cell parameters (radians).'''
+
+    out = []
+    for m in matrices:
+        a, b, c = (sqrt(dot(v, v)) for v in m)
+        out.append((a, b, c,
+                    acos(_clip(dot(m[1], m[2])/(b*c))),
+                    acos(_clip(dot(m[0], m[2])/(a*c))),
+                    acos(_clip(dot(m[0], m[1])/(a*b)))))
+
+    return out
+
+
+# Small 3x3 helpers.  They are public so that other stages (reduction,
+# slab construction, validation) share one implementation.
+
+def dot(u, v):
+    return u[0]*v[0] + u[1]*v[1] + u[2]*v[2]
+
+
+def cross(u, v):
+    return [u[1]*v[2] - u[2]*v[1],
+            u[2]*v[0] - u[0]*v[2],
+            u[0]*v[1] - u[1]*v[0]]
+
+
+def det(m):
+    return dot(m[0], cross(m[1], m[2]))
+
+
+def transpose(m):
+    return [list(col) for col in zip(*m)]
+
+
+def matmul(p, q):
+    '''Returns the matrix product p . q for row-major matrices.'''
+
+    qt = transpose(q)
+    return [[dot(row, col) for col in qt] for row in p]
+
+
+def inv(m):
+    '''Returns the inverse of a 3x3 matrix by the adjugate formula.'''
+
+    d = det(m)
+    adj = [cross(m[1], m[2]), cross(m[2], m[0]), cross(m[0], m[1])]
+    return [[x/d for x in row] for row in transpose(adj)]
+
+
+def to_frac(matrix, cart) -> 'List of fractional coordinate triples':
+    '''Converts Cartesian positions to fractional ones for one lattice.'''
+
+    m = inv(matrix)
+    return [[dot(r, col) for col in transpose(m)] for r in cart]
+
+
+def to_cart(matrix, frac) -> 'List of Cartesian coordinate triples':
+    '''Converts fractional positions to Cartesian ones for one lattice.'''
+
+    cols = transpose(matrix)
+    return [[dot(r, col) for col in cols] for r in frac]
+
+
+def wrap(frac) -> 'Fractional coordinate triple in [0, 1)':
+    '''Maps a fractional position back into the unit cell.
+
+    Coordinates are rounded to the 10 decimals written to the POSCAR, so
+    values such as 0.99999999999 end up as 0.0 rather than 1.0.
+    '''
+
+    out = []
+    for x in frac:
+        x = round(x % 1.0, 10)
+        out.append(0.0 if x == 1.0 else x)
+
+    return tuple(out)
+
+
+def _clip(x):
+    return max(-1.0, min(1.0, x))
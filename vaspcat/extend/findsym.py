@@ -0,0 +1,575 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from fractions import Fraction
+from functools import lru_cache
+from itertools import combinations, permutations, product
+from math import ceil, floor, gcd, sqrt
+from vaspcat.extend import cell, neighbor, niggli, symmetry
+
+logger = logging.getLogger(__name__)
+
+# Space group detection for structures that carry no symmetry information,
+# such as pdb input or cif files expanded to P1.  The search has two steps:
+#
+# 1. Lattice rotations.  An integer matrix W, acting on fractional column
+#    vectors, is a symmetry of the lattice if W^T G W = G for the metric
+#    tensor G.  Column i of W is the image of basis vector i, so it must
+#    have the length of that vector.  Its j-th entry is the projection of
+#    that image on the reciprocal vector b_j*, so it is bounded by
+#    |a_i| / h_j, with h_j the interplanar spacing of the planes spanned by
+#    the other two axes.  The integer vectors within that bound are
+#    screened by length once per basis vector, and only the surviving
+#    columns are combined and checked for angles and determinant.  For a
+#    reduced cell the bound is 1, and only 26 vectors are screened.
+#
+# 2. Translations.  For each rotation, the candidate translations are
+#    t = q - W p0, where p0 is one atom of the species with the fewest
+#    atoms and q runs over the atoms of that species.  A candidate is
+#    accepted if every atom is mapped onto an atom of the same species
+#    within the tolerance.  Images are matched with a cell list, see
+#    neighbor.py, so checking one candidate is O(N) instead of O(N^2).
+#
+# The operations found are compared with the tables in spacegroup.py to
+# name the group.  They match a table entry as they are when the cell is
+# in the standard setting and origin of a tabulated Hall symbol.
+# Otherwise the cell is standardized first: the rotation axes give the
+# conventional basis of the crystal system, e.g. the three four-fold axes
+# of a cubic group, or the six-fold axis and two shortest lattice vectors
+# perpendicular to it.  The operations are rewritten in that basis,
+#
+#    W' = T^-1 W T,   t' = T^-1 t,
+#
+# with the basis vectors as the columns of T, and completed by the
+# centering translations of the conventional cell.  Tabulated groups with
+# the same rotations are then tried with the origin shifted by p, which
+# turns t' into t' + (W' - I) p.  The shift is solved for from three
+# independent rows of W' - I, so a cell written with an arbitrary origin
+# is named too.  If no table entry matches, the operations are still
+# reported, and the Hall symbol is None.
+#
+# Results are cached by a fingerprint of the structure, so converting the
+# same structure again, or detecting before and after a transform that
+# leaves it unchanged, does not repeat the search.
+
+# Largest distance, in Angstrom, between an image and the atom it is
+# matched with.
+SYMPREC = 0.01
+
+CACHE_SIZE = 256
+_found = OrderedDict()
+
+IDENTITY = ((1, 0, 0), (0, 1, 0), (0, 0, 1))
+
+
+def apply(lat_vec, atom_info, frac_pos, info) -> '4-tuple like parse()':
+    '''Detects the symmetry of a structure and stores it in info.
+
+    The structure itself is unchanged.  info['symmetry'] is set to the
+    dictionary returned by detect, for the KPOINTS and INCAR stages and
+    for reporting.
+    '''
+
+    found = detect(lat_vec, atom_info, frac_pos)
+    logger.info('Found %d symmetry operations, space group %s.',
+                len(found['operations']), found['symbol'] or 'unknown')
+
+    return lat_vec, atom_info, frac_pos, dict(info, symmetry=found)
+
+
+def detect(lat_vec, atom_info, frac_pos,
+           tol=SYMPREC) -> 'Dictionary of symmetry information':
+    '''Finds the space group operations of a structure.
+
+    Args:
+        lat_vec, atom_info, frac_pos: Output of a posext parse().
+        tol: Matching tolerance in Angstrom.
+
+    Returns:
+        A dictionary with the keys
+
+        operations: List of (rotation, translation) tuples acting on
+                    fractional column vectors, x' = W x + t.  W is a
+                    tuple of integer row tuples and t a tuple of floats
+                    in [0, 1), snapped to multiples of 1/12 when close.
+        hall: Hall symbol as keyed in spacegroup.SymOpsHall, or None.
+        symbol: Hermann-Mauguin symbol of the Hall symbol, or None.
+        point_group: Number of distinct rotations.
+        lattice_points: Number of pure translations, including the
+                        identity.  Above 1, the cell is not primitive.
+    '''
+
+    key = fingerprint(lat_vec, atom_info, frac_pos, tol)
+    if key in _found:
+        _found.move_to_end(key)
+        return _found[key]
+
+    ops = operations(lat_vec, atom_info, frac_pos, tol)
+    hall = identify(ops) or standardize(ops, lat_vec, tol)
+
+    found = {'operations': ops, 'hall': hall, 'symbol': symbol(hall),
+             'point_group': len({rot for rot, trans in ops}),
+             'lattice_points': sum(1 for rot, trans in ops
+                                   if rot == IDENTITY)}
+
+    _found[key] = found
+    if len(_found) > CACHE_SIZE:
+        _found.popitem(last=False)
+
+    return found
+
+
+def fingerprint(lat_vec, atom_info, frac_pos, tol) -> 'Hex digest string':
+    '''Hashes a structure, rounded well below the tolerance.'''
+
+    digest = hashlib.sha256(repr((tol, list(atom_info))).encode())
+    for row in list(lat_vec) + list(frac_pos):
+        digest.update(repr(tuple(round(x, 6) for x in row)).encode())
+
+    return digest.hexdigest()
+
+
+def rotations(lat_vec, tol=SYMPREC) -> 'List of integer rotation matrices':
+    '''Returns the rotations W with W^T G W = G, see the module comment.'''
+
+    g = cell.matmul(lat_vec, cell.transpose(lat_vec))
+    length = [sqrt(g[i][i]) for i in range(3)]
+    bound = [int((max(length) + tol)/h)
+             for h in neighbor.CellList.heights(lat_vec)]
+
+    vectors = [v for v in product(*(range(-n, n + 1) for n in bound))
+               if any(v)]
+    columns = []
+    for i in range(3):
+        columns.append([v for v in vectors if abs(
+            sqrt(cell.dot(v, cell.matmul([v], g)[0])) - length[i]) <= tol])
+
+    def angle_ok(u, v, i, j):
+        gu = cell.matmul([u], g)[0]
+        return abs(cell.dot(gu, v) - g[i][j]) <= tol*(length[i] + length[j])
+
+    out = []
+    for u in columns[0]:
+        for v in columns[1]:
+            if not angle_ok(u, v, 0, 1):
+                continue
+            for w in columns[2]:
+                if not (angle_ok(u, w, 0, 2) and angle_ok(v, w, 1, 2)):
+                    continue
+                rot = tuple(zip(u, v, w))
+                if abs(cell.det(rot)) == 1:
+                    out.append(rot)
+
+    return out
+
+
+def operations(lat_vec, atom_info, frac_pos,
+               tol=SYMPREC) -> 'List of (rotation, translation) tuples':
+    '''Returns the space group operations of a structure, see detect.'''
+
+    species = [i for i, (name, count) in enumerate(atom_info)
+               for _ in range(count)]
+    if not frac_pos:
+        return [(IDENTITY, (0.0, 0.0, 0.0))]
+
+    grid = neighbor.CellList(lat_vec, frac_pos, tol)
+    pos = grid.frac_pos
+
+    # Candidate translations are taken from the rarest species.
+    start, ref = 0, None
+    for i, (name, count) in enumerate(atom_info):
+        if count and (ref is None or count < ref[2]):
+            ref = (i, start, count)
+        start += count
+    targets = pos[ref[1]:ref[1] + ref[2]]
+    p0 = targets[0]
+
+    def maps(rot, trans):
+        for n, p in enumerate(pos):
+            image = [cell.dot(row, p) + t for row, t in zip(rot, trans)]
+            if not any(species[m] == species[n]
+                       for m, r in grid.near(image)):
+                return False
+        return True
+
+    ops = []
+    for rot in rotations(lat_vec, tol):
+        wp0 = [cell.dot(row, p0) for row in rot]
+        for q in targets:
+            trans = snap([x - y for x, y in zip(q, wp0)], lat_vec, tol)
+            if maps(rot, trans):
+                ops.append((rot, trans))
+
+    return ops
+
+
+def snap(trans, lat_vec, tol) -> 'Translation tuple in [0, 1)':
+    '''Wraps a translation and rounds it to a multiple of 1/12 if close.'''
+
+    out = []
+    for x, vec in zip(cell.wrap(trans), lat_vec):
+        near = round(x*12)/12
+        if abs(x - near)*sqrt(cell.dot(vec, vec)) <= tol:
+            x = near % 1.0
+        out.append(x)
+
+    return tuple(out)
+
+
+@lru_cache(maxsize=None)
+def _tables() -> 'Dictionary of operation sets to Hall symbols':
+    # The 552 table entries only hold about 1100 distinct operations, so
+    # each is parsed once.  Parsing every entry separately took about a
+    # quarter of a second on the first structure identified.
+    from vaspcat.extend import spacegroup as sg
+
+    compiled = {}
+    tables = {}
+    for hall, ops in sg.SymOpsHall.items():
+        found = []
+        for op in map(tuple, ops):
+            if op not in compiled:
+                try:
+                    compiled[op] = symmetry.operation(op)
+                except ValueError:
+                    compiled[op] = None
+            if compiled[op] is not None:
+                found.append(compiled[op])
+        tables.setdefault(frozenset(found), hall)
+
+    return tables
+
+
+@lru_cache(maxsize=None)
+def _settings() -> 'Dictionary of rotation sets to (Hall, operations)':
+    settings = {}
+    for ops, hall in _tables().items():
+        rots = frozenset(rot for rot, trans in ops)
+        settings.setdefault(rots, []).append((hall, ops))
+
+    return settings
+
+
+def identify(ops) -> 'Hall symbol, or None':
+    '''Looks up the Hall symbol with exactly the operations ops.'''
+
+    exact = set()
+    for rot, trans in ops:
+        frac = tuple(Fraction(t).limit_denominator(12) for t in trans)
+        if any(abs(f - t) > 1e-9 for f, t in zip(frac, trans)):
+            return None
+        exact.add((rot, frac))
+
+    return _tables().get(frozenset(exact))
+
+
+def standardize(ops, lat_vec, tol=SYMPREC) -> 'Hall symbol, or None':
+    '''Names the group of ops in a conventional basis and origin.
+
+    Args:
+        ops: Output of operations.
+        lat_vec: List of three lattice vectors of the cell of ops.
+        tol: Matching tolerance in Angstrom.
+
+    Returns:
+        The Hall symbol of the first tabulated setting that the
+        operations match after a change of basis and origin, see the
+        module comment, or None.
+    '''
+
+    for basis in bases(ops, lat_vec, tol):
+        conv = convert(ops, basis)
+        if conv is None:
+            continue
+        rots = frozenset(rot for rot, trans in conv)
+        lengths = [sqrt(cell.dot(v, v))
+                   for v in cell.matmul(basis, lat_vec)]
+        for hall, group in _settings().get(rots, ()):
+            if shift(conv, group, lengths, tol):
+                return hall
+
+    return None
+
+
+# Order of a proper rotation by its trace.
+ORDER = {3: 1, -1: 2, 0: 3, 1: 4, 2: 6}
+
+
+def axis(rot) -> 'Shortest lattice vector along a rotation axis, or None':
+    '''Returns the integer direction [uvw] left fixed by a rotation.
+
+    The proper part of the rotation is used, so for a mirror this is
+    the normal of the plane.  The sign is chosen so that the first
+    nonzero entry is positive.
+    '''
+
+    if cell.det(rot) < 0:
+        rot = [[-x for x in row] for row in rot]
+    m = [[x - (i == j) for j, x in enumerate(row)]
+         for i, row in enumerate(rot)]
+
+    for u, v in combinations(m, 2):
+        w = cell.cross(u, v)
+        if any(w):
+            n = gcd(gcd(w[0], w[1]), w[2])
+            if next(x for x in w if x) < 0:
+                n = -n
+            return tuple(x//n for x in w)
+
+    return None
+
+
+def bases(ops, lat_vec, tol=SYMPREC) -> 'Iterator of integer 3x3 bases':
+    '''Yields candidate conventional bases for the operations.
+
+    Each basis is a list of three integer row vectors, the conventional
+    basis vectors in fractional coordinates of lat_vec, in right-handed
+    order.  The crystal system is read from the orders of the rotation
+    axes.  Settings that differ by the choice or order of equivalent
+    axes are all yielded, since the tables only hold some of them.
+    '''
+
+    axes = {}
+    for rot in {rot for rot, trans in ops}:
+        proper = rot if cell.det(rot) > 0 else [[-x for x in row]
+                                                  for row in rot]
+        order = ORDER.get(sum(proper[i][i] for i in range(3)), 1)
+        if order > 1:
+            axes.setdefault(order, set()).add(axis(rot))
+
+    def cart(v):
+        return [cell.dot(v, col) for col in zip(*lat_vec)]
+
+    def size(v):
+        c = cart(v)
+        return sqrt(cell.dot(c, c))
+
+    # Short lattice vectors, from small multiples of the reduced basis.
+    reduced, p = niggli.reduce(lat_vec)
+    p = [[int(round(x)) for x in row] for row in p]
+    lattice = sorted({tuple(cell.dot(c, col) for col in zip(*p))
+                      for c in product(range(-2, 3), repeat=3) if any(c)},
+                     key=size)
+
+    def plane(c):
+        cc = cart(c)
+        return [v for v in lattice
+                if abs(cell.dot(cart(v), cc)) <= tol*(size(v) + size(c))]
+
+    def shortest(vecs):
+        return [v for v in vecs if size(v) <= size(vecs[0]) + tol]
+
+    def handed(a, b, c):
+        if cell.det([a, b, c]) < 0:
+            c = tuple(-x for x in c)
+        return [list(a), list(b), list(c)]
+
+    if len(axes.get(3, ())) > 1:
+        for edges in permutations(sorted(axes.get(4) or axes[2])):
+            yield handed(*edges)
+    elif 6 in axes or 3 in axes:
+        c = next(iter(axes.get(6) or axes[3]))
+        short = shortest(plane(c))
+        for a, b in permutations(short, 2):
+            ab = cell.dot(cart(a), cart(b))
+            if abs(ab + size(a)**2/2) <= tol*size(a) and \
+                    cell.det([a, b, c]) > 0:
+                yield [list(a), list(b), list(c)]
+    elif 4 in axes:
+        c = next(iter(axes[4]))
+        short = shortest(plane(c))
+        for a, b in permutations(short, 2):
+            ab = cell.dot(cart(a), cart(b))
+            if abs(ab) <= tol*size(a) and cell.det([a, b, c]) > 0:
+                yield [list(a), list(b), list(c)]
+    elif len(axes.get(2, ())) > 1:
+        for edges in permutations(sorted(axes[2])):
+            yield handed(*edges)
+    elif 2 in axes:
+        b = next(iter(axes[2]))
+        flat = plane(b)
+        a = flat[0]
+        c = next(v for v in flat if any(cell.cross(cart(a), cart(v))))
+        for x, z in ((a, c), (c, a)):
+            for z in (z, tuple(-n for n in z)):
+                y = b if cell.det([x, b, z]) > 0 else [-n for n in b]
+                yield [list(x), list(y), list(z)]
+    else:
+        yield handed(*p)
+
+
+def convert(ops, basis) -> 'Set of (rotation, translation) tuples, or None':
+    '''Rewrites operations in a conventional basis, see the module comment.
+
+    Returns the operations with the centering translations of the new
+    cell added, or None if the rotations are not integer in that basis.
+    '''
+
+    t = cell.transpose([[Fraction(x) for x in row] for row in basis])
+    t_inv = cell.inv(t)
+    n = abs(int(cell.det(t)))
+
+    # Lattice points of the cell inside the conventional cell.
+    centering = {tuple(cell.dot(row, point) % 1 for row in t_inv)
+                 for point in product(range(n), repeat=3)}
+
+    out = set()
+    for rot, trans in ops:
+        w = cell.matmul(cell.matmul(t_inv, rot), t)
+        if any(x.denominator != 1 for row in w for x in row):
+            return None
+        w = tuple(tuple(int(x) for x in row) for row in w)
+        shifted = [cell.dot(row, trans) for row in t_inv]
+        for c in centering:
+            moved = [float(x + y) for x, y in zip(shifted, c)]
+            out.add((w, cell.wrap(moved)))
+
+    return out
+
+
+def shift(ops, group, lengths, tol=SYMPREC) -> 'True if ops match group':
+    '''Checks whether ops equal a tabulated group after an origin shift.
+
+    Args:
+        ops: Output of convert.
+        group: Frozen set of exact operations of a table entry.
+        lengths: Lengths of the conventional basis vectors, in Angstrom,
+                 which scale the tolerance.
+        tol: Matching tolerance in Angstrom.
+    '''
+
+    if len(ops) != len(group):
+        return False
+
+    table = {}
+    for rot, trans in group:
+        table.setdefault(rot, []).append(tuple(map(float, trans)))
+
+    # Three independent rows of W - I, each with the operation it came
+    # from.  Polar groups leave the origin free along the polar axis, so
+    # missing rows are filled with unit vectors and zero shift.
+    rows, used = [], []
+    for rot, trans in sorted(ops, key=lambda op: op[0] == IDENTITY):
+        for i in range(3):
+            row = [rot[i][j] - (i == j) for j in range(3)]
+            if _independent(rows, row):
+                rows.append(row)
+                used.append((rot, trans, i))
+    for i in range(3):
+        unit = [int(i == j) for j in range(3)]
+        if _independent(rows, unit):
+            rows.append(unit)
+            used.append((IDENTITY, (0, 0, 0), None))
+
+    a_inv = cell.inv(rows)
+
+    # The rows of one operation share the choice of target translation.
+    sources = []
+    for rot, trans, i in used:
+        if i is not None and (rot, trans) not in sources:
+            sources.append((rot, trans))
+
+    def maps(op, p):
+        rot, trans = op
+        moved = [x + cell.dot(row, p) - y
+                 for x, row, y in zip(trans, rot, p)]
+        return any(all(abs(x - y - round(x - y))*l <= tol
+                       for x, y, l in zip(moved, exact, lengths))
+                   for exact in table[rot])
+
+    # Pure translations do not move with the origin, so settings with
+    # another centering are rejected before any shift is tried.
+    ops = sorted(ops, key=lambda op: op[0] != IDENTITY)
+    if not all(maps(op, (0, 0, 0)) for op in ops if op[0] == IDENTITY):
+        return False
+
+    for targets in product(*(table[rot] for rot, trans in sources)):
+        pick = dict(zip(sources, targets))
+        d = [0.0 if i is None else
+             pick[rot, trans][i] - trans[i]
+             for rot, trans, i in used]
+        # A shift p in [0, 1) gives row . p between the sums of the
+        # negative and of the positive entries of the row, which bounds
+        # the integer k in row . p = d + k.
+        ranges = [range(floor(sum(x for x in row if x < 0) - y),
+                        ceil(sum(x for x in row if x > 0) - y) + 1)
+                  for row, y in zip(rows, d)]
+        for k in product(*ranges):
+            p = [cell.dot(row, [x + y for x, y in zip(d, k)])
+                 for row in a_inv]
+            if all(maps(op, p) for op in ops):
+                return True
+
+    return False
+
+
+def _independent(rows, row) -> 'True if row is not spanned by rows':
+    if len(rows) == 0:
+        return any(row)
+    if len(rows) == 1:
+        return any(cell.cross(rows[0], row))
+    if len(rows) == 2:
+        return cell.det([rows[0], rows[1], row]) != 0
+    return False
+
+
+def symbol(hall) -> 'Hermann-Mauguin symbol, or None':
+    if hall is None:
+        return None
+
+    from vaspcat.extend import spacegroup as sg
+    return next((hm for hm, h in sg.HM2Hall.items() if h == hall), None)
+
+
+def kpoint_rotations(ops) -> 'List of integer rotation matrices':
+    '''Returns the rotations acting on fractional k-point coordinates.
+
+    A rotation W of fractional positions acts on reciprocal coordinates
+    as (W^-1)^T.  Inversion is always added, since time reversal makes
+    k and -k equivalent without spin-orbit coupling.
+    '''
+
+    out = set()
+    for rot, trans in ops:
+        inv = cell.transpose(cell.inv(rot))
+        r = tuple(tuple(int(round(x)) for x in row) for row in inv)
+        out.add(r)
+        out.add(tuple(tuple(-x for x in row) for row in r))
+
+    return sorted(out)
+
+
+def irreducible(mesh, rotations) -> 'List of (k-point, weight) tuples':
+    '''Reduces a Gamma centered Monkhorst-Pack mesh by symmetry.
+
+    Args:
+        mesh: Number of divisions (n1, n2, n3) along each reciprocal
+              lattice vector.
+        rotations: Output of kpoint_rotations.  Rotations that do not
+                   map the mesh onto itself are ignored.
+
+    Returns:
+        One fractional k-point per orbit, with the number of mesh points
+        in the orbit as its weight.  The weights add up to n1*n2*n3.
+    '''
+
+    n = mesh
+    usable = []
+    for rot in rotations:
+        # k'_a = sum_b R_ab k_b, with k_b = i_b/n_b, must land on the mesh.
+        if all((rot[a][b]*n[a]) % n[b] == 0
+               for a in range(3) for b in range(3)):
+            usable.append([[rot[a][b]*n[a]//n[b] for b in range(3)]
+                           for a in range(3)])
+
+    seen, out = set(), []
+    for point in product(*(range(m) for m in n)):
+        if point in seen:
+            continue
+        orbit = {tuple(cell.dot(row, point) % m for row, m in zip(r, n))
+                 for r in usable}
+        orbit.add(point)
+        seen.update(orbit)
+        out.append((tuple(i/m for i, m in zip(point, n)), len(orbit)))
+
+    return out
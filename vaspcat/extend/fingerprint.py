@@ -0,0 +1,92 @@
+import hashlib
+from collections import Counter
+from functools import reduce
+from math import gcd
+from vaspcat.extend import neighbor
+
+# Fingerprints for finding the same structure in different files.  Database
+# pulls list one compound many times, in conventional and primitive cells,
+# other settings and origins, with atoms in another order, or with
+# coordinates that differ in the last digits.  None of that changes the
+# local environment of an atom, so the fingerprint is built from
+#
+# 1. the reduced composition, e.g. Cl1Na1, and
+# 2. for each atom, its species and the sorted list of (species, distance)
+#    of every neighbor within CUTOFF, distances rounded to TOL.
+#
+# The environments are counted, and the counts divided by their greatest
+# common divisor, so a cell holding four formula units gives the same
+# fingerprint as the primitive cell holding one.  The counted environments
+# are hashed to a fixed-length key, so duplicates are found with one
+# dictionary lookup per structure, see duplicates.py.
+#
+# Rounding makes structures that differ by much less than TOL compare
+# equal, but a distance lying right at the edge of a bin can still round
+# the other way.  Structures that differ by more than TOL, or beyond
+# CUTOFF only, are never merged.
+
+# Neighbor shell radius in Angstrom.
+CUTOFF = 4.0
+
+# Distance resolution in Angstrom.
+TOL = 0.01
+
+
+def apply(lat_vec, atom_info, frac_pos, info) -> '4-tuple like parse()':
+    '''Stores the fingerprint of a structure in info['fingerprint'].
+
+    The structure itself is unchanged.
+    '''
+
+    return lat_vec, atom_info, frac_pos, dict(
+        info, fingerprint=fingerprint(lat_vec, atom_info, frac_pos))
+
+
+def fingerprint(lat_vec, atom_info, frac_pos, cutoff=CUTOFF,
+                tol=TOL) -> 'Fingerprint string':
+    '''Returns the fingerprint of a structure, see the module comment.
+
+    Args:
+        lat_vec, atom_info, frac_pos: Output of a posext parse().
+        cutoff: Neighbor shell radius in Angstrom.
+        tol: Distance resolution in Angstrom.
+
+    Returns:
+        The reduced formula and a hash of the environments, e.g.
+        'Cl1Na1:5d41402abc4b2a76b9719d911017c592'.
+    '''
+
+    names = [name for name, count in atom_info for _ in range(count)]
+
+    counts = Counter(names)
+    unit = reduce(gcd, counts.values(), 0) or 1
+    formula = ''.join('{0}{1}'.format(name, counts[name]//unit)
+                      for name in sorted(counts))
+
+    found = Counter()
+    for i, shell in enumerate(environments(lat_vec, frac_pos, cutoff)):
+        found[names[i], tuple(sorted((names[j], int(round(r/tol)))
+                                     for j, r in shell))] += 1
+
+    unit = reduce(gcd, found.values(), 0) or 1
+    digest = hashlib.sha256()
+    for key in sorted(found):
+        digest.update(repr((key, found[key]//unit)).encode())
+
+    return '{0}:{1}'.format(formula, digest.hexdigest()[:32])
+
+
+def environments(lat_vec, frac_pos,
+                 cutoff=CUTOFF) -> 'List of [(index, distance), ...]':
+    '''Returns the neighbors within cutoff of every atom.
+
+    Neighbors are listed once per periodic image, so in a small cell an
+    atom can appear several times, including as a neighbor of itself.
+    The images come from the cell list of neighbor.py, which finds them
+    in O(1) per atom however thin the cell is.
+    '''
+
+    found = neighbor.CellList(lat_vec, frac_pos, cutoff)
+    return [[(j, r) for j, r, image in found.images(pos)
+             if j != i or any(image)]
+            for i, pos in enumerate(found.frac_pos)]
@@ -0,0 +1,157 @@
+from itertools import product
+from math import ceil, floor, sqrt
+from vaspcat.extend import cell
+
+# Binned neighbor search for periodic cells.  Fractional positions are
+# sorted into a grid of n_a x n_b x n_c bins, chosen so that every bin is
+# at least `cutoff` thick along each lattice direction.  All neighbors of a
+# position within the cutoff then lie in its own bin or in one of the 26
+# bins around it, so a query costs a constant number of bin lookups and
+# comparisons instead of one per atom.  Only occupied bins are stored, so a
+# small cutoff in a large cell does not allocate an empty grid.
+#
+# near and pairs use the minimum image convention, which finds every
+# neighbor as long as the cutoff is below half the smallest interplanar
+# spacing of the cell, see CellList.heights.  images lifts that limit: the
+# bins are unrolled into a periodic grid, a query looks as many bins out as
+# the cutoff reaches, and each bin it visits is one image of a stored bin.
+# Every image of every position within the cutoff is then found once,
+# however thin the cell, at a cost that still grows with the number of
+# neighbors rather than the number of atoms.
+
+
+class CellList(object):
+    '''Bins of fractional positions for fixed-cutoff neighbor queries.'''
+
+    def __init__(self, lat_vec, frac_pos, cutoff):
+        '''Sort the positions into bins.
+
+        Args:
+            lat_vec: List of three lattice vectors.
+            frac_pos: Sequence of fractional (x, y, z) positions.
+            cutoff: Largest distance, in Angstrom, that will be queried.
+        '''
+
+        self.lat_vec = lat_vec
+        self.frac_pos = [cell.wrap(pos) for pos in frac_pos]
+        self.cutoff = cutoff
+        heights = CellList.heights(lat_vec)
+        self.shape = tuple(max(1, int(h/cutoff)) if cutoff > 0 else 1
+                           for h in heights)
+
+        # Bins along each axis that the cutoff spans, for images.  It is 1
+        # unless the cell is thinner than the cutoff.
+        self.reach = [max(1, int(ceil(cutoff*n/h))) for n, h in
+                      zip(self.shape, heights)]
+
+        # Offsets to the neighboring bins along each axis.  With fewer
+        # than three bins some of them coincide, and are kept only once.
+        self.offsets = [sorted({d % n for d in (-1, 0, 1)})
+                        for n in self.shape]
+
+        self.bins = {}
+        for i, pos in enumerate(self.frac_pos):
+            self.bins.setdefault(self.index(pos), []).append(i)
+
+    @staticmethod
+    def heights(lat_vec) -> 'Interplanar spacings along a, b and c':
+        '''Returns the cell thickness perpendicular to each pair of axes.'''
+
+        a, b, c = lat_vec
+        v = abs(cell.det(lat_vec))
+        return [v/sqrt(cell.dot(n, n)) for n in
+                (cell.cross(b, c), cell.cross(c, a), cell.cross(a, b))]
+
+    def index(self, pos) -> 'Bin index tuple of a fractional position':
+        return tuple(int(floor(x*n)) % n for x, n in zip(pos, self.shape))
+
+    def distance(self, p, q) -> 'Minimum image distance in Angstrom':
+        d = [x - y for x, y in zip(p, q)]
+        d = [x - round(x) for x in d]
+        v = [cell.dot(d, col) for col in zip(*self.lat_vec)]
+        return sqrt(cell.dot(v, v))
+
+    def near(self, pos) -> 'List of (index, distance) tuples':
+        '''Returns the stored positions within the cutoff of pos.
+
+        Args:
+            pos: Fractional (x, y, z) position.  It need not be one of
+                 the stored positions, nor lie inside the unit cell.
+        '''
+
+        pos = cell.wrap(pos)
+        i, j, k = self.index(pos)
+        na, nb, nc = self.shape
+
+        out = []
+        for di in self.offsets[0]:
+            for dj in self.offsets[1]:
+                for dk in self.offsets[2]:
+                    key = ((i + di) % na, (j + dj) % nb, (k + dk) % nc)
+                    for n in self.bins.get(key, ()):
+                        r = self.distance(pos, self.frac_pos[n])
+                        if r <= self.cutoff:
+                            out.append((n, r))
+
+        return out
+
+    def images(self, pos) -> 'List of (index, distance, image) tuples':
+        '''Returns every periodic image of the stored positions near pos.
+
+        Unlike near, this holds for any cutoff, see the module comment.
+
+        Args:
+            pos: Fractional (x, y, z) position.
+
+        Returns:
+            One tuple per image within the cutoff, where image is the
+            integer lattice translation (i, j, k) of the stored position.
+            A stored position equal to pos is listed with image (0, 0, 0),
+            and its other images only if they are within the cutoff.
+        '''
+
+        pos = cell.wrap(pos)
+        start = self.index(pos)
+
+        out = []
+        for step in product(*(range(-n, n + 1) for n in self.reach)):
+            key, image = [], []
+            for i, d, n in zip(start, step, self.shape):
+                shift, index = divmod(i + d, n)
+                key.append(index)
+                image.append(shift)
+
+            for m in self.bins.get(tuple(key), ()):
+                d = [x + s - y for x, s, y in
+                     zip(self.frac_pos[m], image, pos)]
+                v = [cell.dot(d, col) for col in zip(*self.lat_vec)]
+                r = sqrt(cell.dot(v, v))
+                if r <= self.cutoff:
+                    out.append((m, r, tuple(image)))
+
+        return out
+
+    def pairs(self) -> 'Iterator of (i, j, distance) tuples with i < j':
+        '''Yields every pair of stored positions within the cutoff.
+
+        Each occupied bin is compared with itself and its neighbors, so
+        the cost grows with the number of positions rather than with its
+        square.  Pairs of a position with its own periodic images are not
+        included.
+        '''
+
+        na, nb, nc = self.shape
+        pos = self.frac_pos
+
+        for (i, j, k), members in self.bins.items():
+            for di in self.offsets[0]:
+                for dj in self.offsets[1]:
+                    for dk in self.offsets[2]:
+                        key = ((i + di) % na, (j + dj) % nb, (k + dk) % nc)
+                        for m in members:
+                            for n in self.bins.get(key, ()):
+                                if m >= n:
+                                    continue
+                                r = self.distance(pos[m], pos[n])
+                                if r <= self.cutoff:
+                                    yield m, n, r
@@ -0,0 +1,138 @@
+from vaspcat.extend import cell
+
+# Niggli reduction following Krivy & Gruber (1976), with the numerically
+# stable comparisons of Grosse-Kunstleve, Sauter & Adams (2004).  The usual
+# formulation tracks the six metric parameters
+#
+#    A = a.a   B = b.b   C = c.c   xi = 2 b.c   eta = 2 a.c   zeta = 2 a.b
+#
+# and a transformation matrix.  Here every step is applied to the basis
+# vectors themselves and the parameters are recomputed from them, which
+# costs six dot products per step and cannot drift away from the basis.
+# The integer matrix P with new_basis = P . old_basis is updated alongside,
+# so the atoms can be carried over with frac_new = frac_old . P^-1.
+
+MAX_STEPS = 1000
+
+
+def apply(lat_vec, atom_info, frac_pos, info,
+          tol=1e-5) -> '4-tuple like parse()':
+    '''Replaces the cell by its Niggli reduced cell.
+
+    Args:
+        lat_vec, atom_info, frac_pos, info: Output of a posext parse().
+        tol: Relative tolerance, scaled by the cell size, used when
+             comparing metric parameters.
+
+    Returns:
+        The reduced lattice in the standard orientation (a along x), the
+        unchanged atom_info, the fractional coordinates expressed in the
+        reduced cell, in the same order as frac_pos, and info.
+    '''
+
+    reduced, p = reduce(lat_vec, tol)
+    if p == [[1, 0, 0], [0, 1, 0], [0, 0, 1]]:
+        return lat_vec, atom_info, frac_pos, info
+
+    q = [[round(x) for x in row] for row in cell.inv(p)]
+    frac = [cell.wrap(row) for row in cell.matmul(frac_pos, q)]
+
+    # Reorient the reduced basis so it is written like any other cell.
+    # Fractional coordinates do not change under a rotation.
+    reduced = cell.vectors(cell.parameters([reduced]))[0]
+
+    return reduced, atom_info, frac, info
+
+
+def reduce(lat_vec, tol=1e-5) -> '(reduced lattice, integer matrix P)':
+    '''Niggli reduces a lattice.
+
+    Args:
+        lat_vec: List of three lattice vectors.
+        tol: Relative tolerance of the comparisons.
+
+    Returns:
+        The reduced lattice vectors, still in the Cartesian frame of
+        lat_vec, and the unimodular matrix P relating the two bases.
+
+    Exceptions:
+        RuntimeError: Occurs if the reduction does not converge, which
+                      only happens for degenerate cells.
+    '''
+
+    basis = [list(map(float, v)) for v in lat_vec]
+    p = [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    eps = tol*abs(cell.det(basis))**(2/3)
+
+    def lt(x, y):
+        return x < y - eps
+
+    def gt(x, y):
+        return lt(y, x)
+
+    def eq(x, y):
+        return not (lt(x, y) or lt(y, x))
+
+    def sign(x):
+        return 1 if gt(x, 0) else (-1 if lt(x, 0) else 0)
+
+    def step(m):
+        # Apply the row operation m to both the basis and P.
+        basis[:] = cell.matmul(m, basis)
+        p[:] = cell.matmul(m, p)
+
+    for _ in range(MAX_STEPS):
+        a, b, c = basis
+        A, B, C = cell.dot(a, a), cell.dot(b, b), cell.dot(c, c)
+        xi, eta, zeta = (2*cell.dot(b, c), 2*cell.dot(a, c),
+                         2*cell.dot(a, b))
+
+        # Steps 1 and 2: order the vector lengths.
+        if gt(A, B) or (eq(A, B) and gt(abs(xi), abs(eta))):
+            step([[0, -1, 0], [-1, 0, 0], [0, 0, -1]])
+            continue
+
+        if gt(B, C) or (eq(B, C) and gt(abs(eta), abs(zeta))):
+            step([[-1, 0, 0], [0, 0, -1], [0, -1, 0]])
+            continue
+
+        # Steps 3 and 4: make the three angles all acute or all obtuse.
+        l, m, n = sign(xi), sign(eta), sign(zeta)
+
+        if l*m*n == 1:
+            flip = [-1 if s == -1 else 1 for s in (l, m, n)]
+        else:
+            flip = [-1 if s == 1 else 1 for s in (l, m, n)]
+            if flip[0]*flip[1]*flip[2] < 0:
+                flip[(l, m, n).index(0)] = -1
+
+        if flip != [1, 1, 1]:
+            step([[flip[0], 0, 0], [0, flip[1], 0], [0, 0, flip[2]]])
+            continue
+
+        # Steps 5 to 8: shorten vectors by adding or subtracting others.
+        if (gt(abs(xi), B) or (eq(xi, B) and lt(2*eta, zeta))
+                or (eq(xi, -B) and lt(zeta, 0))):
+            step([[1, 0, 0], [0, 1, 0], [0, -sign(xi), 1]])
+            continue
+
+        if (gt(abs(eta), A) or (eq(eta, A) and lt(2*xi, zeta))
+                or (eq(eta, -A) and lt(zeta, 0))):
+            step([[1, 0, 0], [0, 1, 0], [-sign(eta), 0, 1]])
+            continue
+
+        if (gt(abs(zeta), A) or (eq(zeta, A) and lt(2*xi, eta))
+                or (eq(zeta, -A) and lt(eta, 0))):
+            step([[1, 0, 0], [-sign(zeta), 1, 0], [0, 0, 1]])
+            continue
+
+        if (lt(xi + eta + zeta + A + B, 0)
+                or (eq(xi + eta + zeta + A + B, 0)
+                    and gt(2*(A + eta) + zeta, 0))):
+            step([[1, 0, 0], [0, 1, 0], [1, 1, 1]])
+            continue
+
+        return basis, p
+
+    raise RuntimeError('Niggli reduction did not converge in {0} steps.'
+                       .format(MAX_STEPS))
@@ -0,0 +1,418 @@
+import logging
+from collections import OrderedDict
+from itertools import islice, product
+from math import ceil, erfc, factorial, sqrt
+from vaspcat.extend import cell, neighbor, symmetry
+
+logger = logging.getLogger(__name__)
+
+# Ordered configurations of partially occupied cif sites.  A site listed
+# with occupancy 1/2 cannot be written to a POSCAR as is; instead a
+# supercell is chosen in which every partially occupied orbit has a whole
+# number of atoms of each species, and the atoms, plus vacancies, are
+# distributed over its sites.  The number of ways to do that grows
+# combinatorially, e.g. C(32, 16) = 6e8 for 32 sites at half occupancy, so
+#
+# 1. arrangements are generated lazily, one at a time, in lexicographic
+#    order, and never stored;
+# 2. only one arrangement of each symmetry-equivalent set is kept.  The
+#    operations of the space group, from symmetry.group, and the lattice
+#    translations of the supercell are compiled once into permutations of
+#    the sites; an arrangement is kept when no permutation maps it to a
+#    lexicographically smaller one, so no set of seen arrangements is
+#    needed either;
+# 3. each kept arrangement gets a screened Coulomb energy of point charges,
+#
+#       E = sum q_i q_j erfc(ALPHA r_ij) / r_ij     for r_ij < CUTOFF,
+#
+#    from oxidation numbers given in the file or the OXIDATION table.  The
+#    pair sums of the sites are computed once, so the energy of each
+#    arrangement costs O(sites^2) multiplications.  Terms that are the
+#    same for every arrangement are left out, so only differences of E
+#    are meaningful.  This is an estimate for ranking, not an Ewald sum.
+#
+# The order stage writes the lowest-energy arrangement among the first
+# `limit` kept ones; Enumeration.configurations gives the whole stream.
+
+# Largest error accepted for the occupancies of the chosen supercell.
+TOL = 0.01
+
+# Largest supercell, in parent cells, tried when choosing one.
+MAX_CELLS = 8
+
+# Number of symmetry-distinct arrangements examined by the order stage.
+LIMIT = 2000
+
+# Screening parameter in 1/Angstrom and cutoff in Angstrom of the energy.
+ALPHA = 0.3
+CUTOFF = 8.0
+
+# e^2 / (4 pi epsilon_0) in eV Angstrom.
+COULOMB = 14.399645
+
+IDENTITY = ((1, 0, 0), (0, 1, 0), (0, 0, 1))
+
+# Common oxidation numbers, used for species without one in the file.
+OXIDATION = {
+    'H': 1, 'Li': 1, 'Na': 1, 'K': 1, 'Rb': 1, 'Cs': 1, 'Ag': 1, 'Cu': 2,
+    'Be': 2, 'Mg': 2, 'Ca': 2, 'Sr': 2, 'Ba': 2, 'Zn': 2, 'Cd': 2, 'Ni': 2,
+    'Co': 2, 'Fe': 3, 'Mn': 2, 'Pb': 2, 'Sn': 4, 'Al': 3, 'Ga': 3, 'In': 3,
+    'Sc': 3, 'Y': 3, 'La': 3, 'Ce': 3, 'Nd': 3, 'Gd': 3, 'Cr': 3, 'Ti': 4,
+    'Zr': 4, 'Hf': 4, 'Si': 4, 'Ge': 4, 'V': 5, 'Nb': 5, 'Ta': 5, 'Mo': 6,
+    'W': 6, 'B': 3, 'N': -3, 'P': 5, 'O': -2, 'S': -2, 'Se': -2, 'Te': -2,
+    'F': -1, 'Cl': -1, 'Br': -1, 'I': -1,
+}
+
+
+def apply(lat_vec, atom_info, frac_pos, info, supercell=None,
+          limit=LIMIT) -> '4-tuple like parse()':
+    '''Replaces partially occupied sites by an ordered configuration.
+
+    Structures without info['disorder'], see posext.Cif.parse, are
+    returned unchanged.  Otherwise the supercell is returned with the
+    lowest-energy arrangement of the first limit symmetry-distinct ones.
+    info['order'] then holds the supercell, the energy estimate and the
+    number of arrangements examined.  The space group is dropped from
+    info, since an ordering generally lowers the symmetry.
+
+    Args:
+        lat_vec, atom_info, frac_pos, info: Output of a posext parse(),
+                                            in the cell of the file.
+        supercell: Multiples (na, nb, nc) of the cell.  If not given, the
+                   smallest supercell matching the occupancies within TOL
+                   is chosen, see Enumeration.choose.
+        limit: Number of arrangements examined.
+    '''
+
+    if not info.get('disorder'):
+        return lat_vec, atom_info, frac_pos, info
+
+    found = Enumeration(lat_vec, atom_info, frac_pos, info, supercell)
+
+    configurations = found.configurations()
+    best, examined = None, 0
+    for energy, labels in islice(configurations, limit):
+        examined += 1
+        if best is None or energy < best[0]:
+            best = energy, labels
+
+    # Exactly limit orderings is not a truncation; only warn if there
+    # is another one left.
+    if next(configurations, None) is not None:
+        logger.warning('Only the first %d symmetry-distinct orderings were '
+                       'examined.', limit)
+    logger.info('Chose the lowest of %d orderings, %.4f eV.', examined,
+                best[0])
+
+    return found.structure(best[1], energy=round(best[0], 6),
+                           examined=examined)
+
+
+class Enumeration(object):
+    '''Symmetry-distinct arrangements of the partially occupied sites.'''
+
+    def __init__(self, lat_vec, atom_info, frac_pos, info, supercell=None):
+        '''Compile the sites, permutations and pair sums of a supercell.
+
+        Args:
+            lat_vec, atom_info, frac_pos, info: As for apply.
+            supercell: As for apply.
+
+        Exceptions:
+            ValueError: Occurs for a supercell with a non-positive entry.
+        '''
+
+        self.lat_vec = lat_vec
+        self.info = info
+
+        # Orbits of the partially occupied rows, merged when several
+        # species share a site, e.g. 0.5 Fe and 0.5 Co.
+        groups, partial = OrderedDict(), set()
+        for name, occ, orbit in info['disorder']:
+            key = min(orbit)
+            species = groups.setdefault(key, (sorted(orbit),
+                                              OrderedDict()))[1]
+            species[name] = species.get(name, 0) + occ
+            partial.update((name, pos) for pos in orbit)
+
+        names = [name for name, count in atom_info for _ in range(count)]
+        self.fixed = [(name, pos) for name, pos in zip(names, frac_pos)
+                      if (name, symmetry.fixed(pos)) not in partial]
+
+        self.species = list(OrderedDict.fromkeys(
+            names + [name for sites, occ in groups.values() for name in occ]))
+        self.groups = list(groups.values())
+
+        if supercell is None:
+            supercell = self.choose()
+        if min(supercell) < 1:
+            raise ValueError('Supercell {0} needs positive multiples.'
+                             .format(tuple(supercell)))
+        self.shape = tuple(supercell)
+        self.shifts = list(product(*(range(n) for n in self.shape)))
+
+        # Sites in fixed point over the supercell, group by group, and
+        # the codes to distribute over them: 0 is a vacancy, and i + 1
+        # the i-th species.
+        self.sites, self.pools = [], []
+        for sites, occ in self.groups:
+            start = len(self.sites)
+            self.sites.extend(tuple(p + s*symmetry.SCALE
+                                    for p, s in zip(pos, shift))
+                              for pos in sites for shift in self.shifts)
+            counts = Enumeration.counts(len(self.sites) - start, occ)
+            self.pools.append([0]*counts.pop(None) + [
+                self.species.index(name) + 1
+                for name, count in counts.items() for _ in range(count)])
+
+        self.index = {pos: i for i, pos in enumerate(self.sites)}
+        self.permutations = self.compile()
+        self.pairs()
+
+        total = 1
+        for pool in self.pools:
+            total *= factorial(len(pool))
+            for code in set(pool):
+                total //= factorial(pool.count(code))
+        logger.info('Ordering %d sites in a %dx%dx%d supercell: %d '
+                    'arrangements, %d symmetry permutations.',
+                    len(self.sites), *self.shape, total,
+                    len(self.permutations) + 1)
+
+    @staticmethod
+    def counts(n, occ) -> 'Dictionary of atom counts, None for vacancies':
+        '''Rounds occupancies to whole numbers of atoms on n sites.
+
+        Counts are rounded by largest remainder, so they add up to n.
+        Occupancies summing to more than 1 are scaled down first.
+        '''
+
+        total = sum(occ.values())
+        share = OrderedDict((name, value/max(total, 1))
+                            for name, value in occ.items())
+        share[None] = max(0.0, 1 - total)
+
+        raw = OrderedDict((name, n*value) for name, value in share.items())
+        counts = OrderedDict((name, int(value)) for name, value in
+                             raw.items())
+        left = n - sum(counts.values())
+        for name in sorted(raw, key=lambda k: counts[k] - raw[k])[:left]:
+            counts[name] += 1
+
+        return counts
+
+    def choose(self) -> '(na, nb, nc) supercell':
+        '''Returns the smallest supercell fitting the occupancies.
+
+        The number of cells m is the first up to MAX_CELLS for which every
+        occupancy is matched within TOL, or else the one with the smallest
+        error.  Its prime factors are spread over the axes, each going to
+        the axis that is shortest so far, to keep the supercell compact.
+        '''
+
+        best = None
+        for m in range(1, MAX_CELLS + 1):
+            error = 0.0
+            for sites, occ in self.groups:
+                n = len(sites)*m
+                counts = Enumeration.counts(n, occ)
+                error = max([error] + [abs(counts[name]/n - value)
+                                       for name, value in occ.items()])
+            if best is None or error < best[0] - 1e-12:
+                best = error, m
+            if error <= TOL:
+                break
+
+        error, m = best
+        if error > TOL:
+            logger.warning('Occupancies are matched to within %.3f only; '
+                           'pass a larger supercell for a closer match.',
+                           error)
+
+        factors, p = [], 2
+        while m > 1:
+            while m % p == 0:
+                factors.append(p)
+                m //= p
+            p += 1
+
+        shape = [1, 1, 1]
+        lengths = [sqrt(cell.dot(v, v)) for v in self.lat_vec]
+        for p in sorted(factors, reverse=True):
+            axis = min(range(3), key=lambda i: lengths[i]*shape[i])
+            shape[axis] *= p
+
+        return tuple(shape)
+
+    def compile(self) -> 'List of inverse site permutations':
+        '''Turns the space group and supercell translations into
+        permutations of the sites.
+
+        Operations that do not map the supercell lattice onto itself,
+        e.g. a fourfold axis of a 2x1x1 supercell, are left out.  Each
+        permutation is stored inverted, as the site each site is taken
+        from, which is the form canonical compares with.
+        '''
+
+        ops = [(IDENTITY, (0, 0, 0))]
+
+        hall = self.info.get('hall')
+        if hall:
+            from vaspcat.extend import spacegroup as sg
+            keys = {key.lower(): key for key in sg.SymOpsHall}
+            if hall in keys:
+                ops = symmetry.group(keys[hall])[0]
+
+        n, scale = self.shape, symmetry.SCALE
+        mod = [k*scale for k in n]
+        identity = tuple(range(len(self.sites)))
+        found = set()
+
+        for rot, trans in ops:
+            if any(rot[i][j]*n[j] % n[i] for i in range(3) for j in range(3)):
+                continue
+
+            t = [int(x*scale) for x in trans]
+            images = [[sum(r[j]*u[j] for j in range(3)) + t[i]
+                       for i, r in enumerate(rot)] for u in self.sites]
+
+            for shift in self.shifts:
+                perm = [0]*len(self.sites)
+                for k, image in enumerate(images):
+                    key = tuple((x + s*scale) % m
+                                for x, s, m in zip(image, shift, mod))
+                    if key not in self.index:
+                        break
+                    perm[self.index[key]] = k
+                else:
+                    perm = tuple(perm)
+                    if perm != identity:
+                        found.add(perm)
+
+        return list(found)
+
+    def pairs(self):
+        '''Computes the screened Coulomb sums of the sites, see apply.'''
+
+        self.charge = [0.0] + [self.oxidation(name) for name in self.species]
+        self.super_vec = [[x*k for x in v]
+                          for v, k in zip(self.lat_vec, self.shape)]
+
+        mod = [k*symmetry.SCALE for k in self.shape]
+        sites = [[x/m for x, m in zip(u, mod)] for u in self.sites]
+        fixed = [(self.oxidation(name),
+                  [(x + s)/k for x, s, k in zip(pos, shift, self.shape)])
+                 for name, pos in self.fixed for shift in self.shifts]
+
+        reach = [int(ceil(CUTOFF/h + 0.5))
+                 for h in neighbor.CellList.heights(self.super_vec)]
+        images = list(product(*(range(-k, k + 1) for k in reach)))
+
+        def kernel(p, q):
+            d = [y - x - round(y - x) for x, y in zip(p, q)]
+            total = 0.0
+            for image in images:
+                v = [sum((d[i] + image[i])*self.super_vec[i][j]
+                         for i in range(3)) for j in range(3)]
+                r = sqrt(cell.dot(v, v))
+                if 1e-8 < r <= CUTOFF:
+                    total += erfc(ALPHA*r)/r
+            return total
+
+        self.field = [sum(q*kernel(p, pos) for q, pos in fixed)
+                      for p in sites]
+        self.kernel = [[kernel(p, sites[j]) for j in range(i + 1, len(sites))]
+                       for i, p in enumerate(sites)]
+
+    def oxidation(self, name) -> 'Charge of a species':
+        return self.info.get('charges', {}).get(name,
+                                                OXIDATION.get(name, 0.0))
+
+    def canonical(self, labels) -> 'True if no image is smaller':
+        for inverse in self.permutations:
+            for k, source in enumerate(inverse):
+                a, b = labels[source], labels[k]
+                if a != b:
+                    if a < b:
+                        return False
+                    break
+        return True
+
+    def energy(self, labels) -> 'Screened Coulomb energy in eV':
+        q = [self.charge[code] for code in labels]
+        total = sum(qi*f for qi, f in zip(q, self.field))
+        for i, row in enumerate(self.kernel):
+            if q[i]:
+                total += q[i]*sum(qj*k for qj, k in zip(q[i + 1:], row))
+        return COULOMB*total
+
+    def configurations(self) -> 'Iterator of (energy, labels) tuples':
+        '''Yields the symmetry-distinct arrangements one at a time.
+
+        labels holds one code per site, see __init__, and can be passed
+        to structure.
+        '''
+
+        for labels in _product(self.pools):
+            if self.canonical(labels):
+                yield self.energy(labels), labels
+
+    def structure(self, labels, **order) -> '4-tuple like parse()':
+        '''Builds the supercell holding one arrangement.
+
+        Args:
+            labels: Codes from configurations.
+            order: Extra entries for info['order'].
+        '''
+
+        atoms = OrderedDict((name, []) for name in self.species)
+        for name, pos in self.fixed:
+            atoms[name].extend(
+                tuple((x + s)/k for x, s, k in zip(pos, shift, self.shape))
+                for shift in self.shifts)
+
+        mod = [k*symmetry.SCALE for k in self.shape]
+        for u, code in zip(self.sites, labels):
+            if code:
+                atoms[self.species[code - 1]].append(
+                    tuple(x/m for x, m in zip(u, mod)))
+
+        atom_info = [(name, len(pos)) for name, pos in atoms.items() if pos]
+        frac_pos = [pos for name in atoms for pos in atoms[name]]
+
+        info = {key: value for key, value in self.info.items()
+                if key not in ('hall', 'symmetry', 'disorder')}
+        info['order'] = dict(order, supercell=self.shape)
+
+        return self.super_vec, atom_info, frac_pos, info
+
+
+def _arrangements(pool):
+    # Distinct orderings of a multiset in lexicographic order, each step
+    # being the next permutation of the previous one.
+    items = sorted(pool)
+    while True:
+        yield tuple(items)
+
+        i = len(items) - 2
+        while i >= 0 and items[i] >= items[i + 1]:
+            i -= 1
+        if i < 0:
+            return
+
+        j = len(items) - 1
+        while items[j] <= items[i]:
+            j -= 1
+        items[i], items[j] = items[j], items[i]
+        items[i + 1:] = reversed(items[i + 1:])
+
+
+def _product(pools, prefix=()):
+    # Like itertools.product over the arrangements of each pool, which
+    # would store them all first.
+    if not pools:
+        yield prefix
+        return
+
+    for part in _arrangements(pools[0]):
+        yield from _product(pools[1:], prefix + part)
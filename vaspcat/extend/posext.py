@@ -1,19 +1,125 @@
-import ast
-import operator as op
+import logging
+import mmap
+import os
 import re
 import shlex
-from math import sin,cos,radians
-from vaspcat.extend import spacegroup as sg
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+from math import radians
+from vaspcat.extend import cell
+from vaspcat.src import compress, profiler
+
+logger = logging.getLogger(__name__)
+
+# Order of the cell parameters expected by the functions in cell.py.
+CELL_KEYS = ('a', 'b', 'c', 'alpha', 'beta', 'gamma')
+
+# Cif variables used by Cif.parse, and the keys they are renamed to.
+
+CIF_KEYWORD = ['_cell_' + label
+               for label in ('length_a','length_b','length_c',
+                             'angle_alpha', 'angle_beta', 'angle_gamma')]
+
+CIF_KEYWORD += ['_atom_site_' + label
+                for label in ('fract_x','fract_y','fract_z',
+                              'type_symbol','label')]
+
+CIF_KEYWORD += ['_symmetry_space_group_name_' + label
+                for label in ('Hall','H-M')]
+
+CIF_KEYWORD += ['_space_group_name_' + label 
+                for label in ('Hall','H-M_alt')]
+
+CIF_NEW_KEY = ['a', 'b', 'c',
+               'alpha', 'beta', 'gamma',
+               'x', 'y', 'z',
+               'atom_name','atom_label']
+
+CIF_NEW_KEY += ['hall','h-m','hall','h-m']
+
+# Site occupancies, and the oxidation numbers used by extend/order.py.
+
+CIF_KEYWORD += ['_atom_site_occupancy', '_atom_type_symbol',
+                '_atom_type_oxidation_number']
+
+CIF_NEW_KEY += ['occupancy', 'type_symbol', 'oxidation']
+
+# Sites whose occupancy is this far below 1 are partially occupied.
+OCCUPANCY_TOL = 1e-3
+
+# Byte patterns for the memory-mapped readers.  CIF_VALUE matches a used
+# variable with its value on the same line, CIF_LOOP_TAG one line of a loop
+# header, and CIF_LOOP_END the first line after a loop body.
+
+CIF_VALUE = re.compile(
+    rb'^[ \t]*(' + b'|'.join(re.escape(k.encode()) for k in CIF_KEYWORD) +
+    rb')[ \t]+(\S.*?)[ \t]*\r?$', re.M)
+CIF_LOOP = re.compile(rb'^[ \t]*loop_.*\n', re.M)
+CIF_LOOP_TAG = re.compile(rb'[ \t]*(_\S+).*\n')
+CIF_LOOP_END = re.compile(rb'^[ \t]*(?:_|loop_|data_)', re.M)
+CIF_COMMENT = re.compile(rb'^[#;].*$', re.M)
+CIF_TOKEN = re.compile(rb"'[^']*'|\"[^\"]*\"|\S+")
+
+# key=value pairs of an extended xyz comment line.  Values may be quoted.
+XYZ_KEY = re.compile(r'(\w+)\s*=\s*("[^"]*"|\'[^\']*\'|\{[^}]*\}|\S+)')
+
+# Line starting an XDATCAR configuration, with the coordinate type and
+# the configuration number, e.g. 'Direct configuration=     1'.
+XDATCAR_CONFIG = re.compile(r'\s*(Direct|Cartesian)?[a-z]*\s*'
+                            r'(?:configuration|konfig)\s*=?\s*(\d*)', re.I)
+
+# Records used by Pdb.read, matched the same way Pdb.read matches them.
+# PDB_ATOM captures the two atom name characters and the x, y, z columns.
+PDB_CELL = re.compile(rb'^(CRYST1|SCALE[123])', re.M)
+PDB_ATOM = re.compile(rb'^(?:ATOM|HETATOM)[^\n]{8}([^\n]{2})[^\n]{16}'
+                      rb'([^\n]{8})([^\n]{8})([^\n]{8})', re.M)
+
+
+@contextmanager
+def _open(file, mode='r'):
+    '''Opens a path, or passes an open text stream through unchanged.
+
+    Streams are left open, since they belong to the caller.  Compressed
+    files, e.g. .cif.gz, are decompressed while they are read.
+    '''
+
+    if hasattr(file, 'read'):
+        yield file
+        return
+
+    with compress.open(file, mode) as f:
+        yield f
+
+
+@contextmanager
+def _mapped(f):
+    '''Maps an open binary file read-only.  Empty files map to b''.'''
+
+    if not os.fstat(f.fileno()).st_size:
+        yield b''
+        return
+
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield mm
+    finally:
+        mm.close()
 
 class Cif(object):
     '''Read cif files and convert them to other formats.'''
+
+    # Bumped whenever parse() output changes, which invalidates the
+    # structures stored by the parse cache, see src/cache.py.
+    version = 4
     
     @staticmethod
     def read(file) -> 'Dictionary for cif parse()':
         '''Gathers variable info from input cif file.
 
         Args:
-            file: Full path of the .cif file to be read.
+            file: Full path of the .cif file to be read, or an open
+                  text stream.
 
         Returns:
             A dictionary object containing cif file variables as keys and their
@@ -36,7 +142,7 @@ class Cif(object):
         # The argument 'posis = False' ensures that ungrouped quotes and
         # apostrophes within a string are ignored.
     
-        with open(file, 'r+') as f:
+        with _open(file, 'r+') as f:
             lines_read = [shlex.split(line.strip(), posix = False)
                           for line in f
                           if line[:-2] != ''            
@@ -92,51 +198,97 @@ class Cif(object):
                 line_list = []
 
         return output
+
+    @staticmethod
+    def read_mapped(file) -> 'Dictionary for cif parse()':
+        '''Memory-mapped alternative to read for very large cif files.
+
+        Instead of splitting every line into a list, the file is scanned
+        in place.  Variables used by parse are found with a regular
+        expression over the mapped bytes, and loop_ blocks are located by
+        searching for their first and last lines.  Only loops containing
+        a variable used by parse are tokenized, and only the columns
+        parse uses are decoded.
+
+        Args:
+            file: Full path of the .cif file to be read.
+
+        Returns:
+            A dictionary with the same layout as read(), limited to the
+            variables in CIF_KEYWORD.
+        '''
+
+        output = {}
+
+        with open(file, 'rb') as f, _mapped(f) as mm:
+
+            for match in CIF_VALUE.finditer(mm):
+                key = match.group(1).decode('latin-1')
+                output[key] = match.group(2).decode('latin-1')
+
+            for match in CIF_LOOP.finditer(mm):
+
+                # The loop header is the run of lines starting with '_'.
+                keyword, pos = [], match.end()
+                for tag in CIF_LOOP_TAG.finditer(mm, pos):
+                    if tag.start() != pos:
+                        break
+                    keyword.append(tag.group(1).decode('latin-1'))
+                    pos = tag.end()
+
+                used = [(i, key) for i, key in enumerate(keyword)
+                        if key in CIF_KEYWORD]
+                if not used:
+                    continue
+
+                end = CIF_LOOP_END.search(mm, pos)
+                body = mm[pos:end.start() if end else len(mm)]
+                if b'#' in body or b';' in body:
+                    body = CIF_COMMENT.sub(b'', body)
+
+                # Values are read as one token stream, so rows that are
+                # split over several lines are handled like read() does.
+                token = CIF_TOKEN.findall(body)
+                for i, key in used:
+                    output[key] = [t.decode('latin-1')
+                                   for t in token[i::len(keyword)]]
+
+        return output
     
     @staticmethod
-    def parse(data) -> '3-tuple for Convert.output()':
+    def parse(data) -> '4-tuple for Convert.output()':
         '''Takes data from cif read method and returns relevant data.
 
         Args:
             data: Dictionary from cif_read mapping cif variables to values.
 
         Returns:
-            A 3-tuple containng the required information for Convert.output().
+            A 4-tuple containng the required information for Convert.output().
 
-            lat_vec: A list of three strings containing the lattice vectors
+            lat_vec: A list of three [x, y, z] lattice vectors
             atom_info: A list with the following form -
                        [[atom 1 name, # of atom 1], ...]
-            frac_coor: A list of strings, with each string containing the
-                       x, y, and z fractional coordinates of the atom
-                       separated by spaces.
+            frac_coor: A list of (x, y, z) fractional coordinate tuples.
+                       Special positions are exact, see symmetry.fixed.
+            info: A dictionary of extra structure information for the
+                  transform stages.  'hall' holds the resolved Hall symbol
+                  in lower case, e.g. '-f 4 2 3'.  'disorder' lists the
+                  partially occupied sites as (name, occupancy, orbit)
+                  tuples, the orbit in the fixed-point form of
+                  symmetry.orbit, and 'charges' maps species to the
+                  oxidation numbers given in the file.  Both are only
+                  present if the file has them.
+
+        Partially occupied sites are still written as fully occupied
+        atoms; the order stage, see extend/order.py, replaces them with
+        an ordered configuration.
         '''
     
         # Remap keywords in data to new keys.  Choose of the two possible
         # atom labels in the process (either '_atom_site_type symbol'
         # or '_atom_site_label'
         
-        keyword = ['_cell_' + label
-                   for label in ('length_a','length_b','length_c',
-                                 'angle_alpha', 'angle_beta', 'angle_gamma')]
-
-        keyword += ['_atom_site_' + label
-                    for label in ('fract_x','fract_y','fract_z',
-                                  'type_symbol','label')]
-        
-        keyword += ['_symmetry_space_group_name_' + label
-                    for label in ('Hall','H-M')]
-
-        keyword += ['_space_group_name_' + label 
-                    for label in ('Hall','H-M_alt')]
-
-        new_key = ['a', 'b', 'c',
-                   'alpha', 'beta', 'gamma',
-                   'x', 'y', 'z',
-                   'atom_name','atom_label']
-        
-        new_key += ['hall','h-m','hall','h-m']
-
-        keys = zip(keyword, new_key)
+        keys = zip(CIF_KEYWORD, CIF_NEW_KEY)
  
         f = {k[1] : data[k[0]] for k in keys
              if data.get(k[0])}
@@ -181,185 +333,107 @@ class Cif(object):
             
             elif key in ['hall']:
                 f[key] = value.replace("'",'').lower()
+
+            elif key in ['occupancy', 'oxidation']:
+                # Unknown values, '.' or '?', count as full occupancy
+                # and as neutral.
+                value = [value] if isinstance(value, str) else value
+                unknown = 1.0 if key == 'occupancy' else 0.0
+                f[key] = [float(re.sub('[()]','',item))
+                          if item not in ('.', '?') else unknown
+                          for item in value]
+
+            elif key in ['type_symbol']:
+                value = [value] if isinstance(value, str) else value
+                f[key] = [item[0] + re.sub('[^a-z]','',item[1:2].lower())
+                          for item in value]
         
-        # Calculate the lattice vectors, outputting as string list.
-        # v is the unit cell volume.
-        v = (f['a']*f['b']*f['c']*
-             (1 - cos(f['alpha'])**2 - cos(f['beta'])**2 - cos(f['gamma'])**2 +
-              2*cos(f['alpha'])*cos(f['beta'])*cos(f['gamma']))**0.5)
-        
-        lat_vec = [# a vector
-                   [f['a'], 0, 0],
-                   
-                   # b vector
-                   [f['b']*cos(f['gamma']), f['b']*sin(f['gamma']),0],
-                   
-                   # c vector
-                   [f['c']*cos(f['beta']),
-                    f['c']*(cos(f['alpha'])- cos(f['beta'])*cos(f['gamma']))/
-                    sin(f['gamma']), 
-                    v/(f['a']*f['b']*sin(f['gamma']))]
-                  ]
-
-        lat_vec = [' '.join(['{: 5.10f}'.format(i) for i in v])
-                   for v in lat_vec]
+        # Calculate the lattice vectors from the cell parameters.
+        lat_vec = cell.vectors([[f[k] for k in CELL_KEYS]])[0]
  
         # Determine the general position equations associated with
         # the space group of the crystal.  The equations are 
-        # obtained from an external file, spacegroup.py.
+        # obtained from an external file, spacegroup.py.  It is imported
+        # here rather than with the module, since its tables are large
+        # and are not needed to read pdb files.
+        from vaspcat.extend import spacegroup as sg, symmetry
+
         hall_dict = {key.lower():key for key in sg.HM2Hall}
         SymOps_dict = {key.lower():key for key in sg.SymOpsHall}
 
         if f.get('hall'):
-            eq = [eq for eq in sg.SymOpsHall[SymOps_dict[f['hall']]]
-                  if eq != "'x',' y',' z'"]
+            hall = f['hall']
 
-        elif f.get('h-m'):
+        elif f.get('h-m') in hall_dict:
             hall = sg.HM2Hall[hall_dict[f['h-m']]].lower()
-            eq = [eq for eq in sg.SymOpsHall[SymOps_dict[hall]]
-                  if eq != "'x',' y',' z'"]
-
-        # Add * in front of char if prev char is not + or -.
-        for i,expr in enumerate(eq):
-            for j,char  in enumerate(expr):
-                if char in ['x','y','z']:
-                                        
-                    if j-1 > -1:
-                        if expr[j-1] == '*':
-                            continue
-                        elif expr[j-1].isdigit():
-                            eq[i] = expr[:j] + char + expr[j:]
-
-        # Replace x/y/z with fractional coordinates
-        for i,name in zip(range(len(atom)),atom):
-            
-            coor = {var:f[var][i] for var in ('x','y','z')}
-            neweq = [','.join(expr) for j,expr in enumerate(eq)] 
 
-            for var in ('x','y','z'):
-                for j in range(len(neweq)):
-                    neweq[j] = neweq[j].replace(var,str(coor[var]))
-            
-            # Evaluate expr to get new fractional coordinate.
-            neweq = set(neweq)
-            newf = {}
-
-            for expr in neweq:
-                atom.append(name)
-                newf['x'],newf['y'],newf['z'] = expr.split(',')
-                                                
-                for l in ('x','y','z'):
-                    newf[l] = newf[l].strip()
-
-                    # Cif.calc requires a binary expression.        
-                    if newf[l][0] == '-':
-                        newf[l] = '0' + newf[l]  
-                    
-                    tmp = Cif.calc(ast.parse(newf[l]).body[0].value)
-                        
-                    # Make fractional coordinate positive.
-                    if tmp > 1:
-                        tmp -= 1 
-                    elif tmp < 0:
-                        tmp += 1
-                        
-                    f[l].append(tmp)
-        
-        # Combine x, y, and z fractional coordinates in a string.
-    
-        frac_coor = [' '.join(['{: 5.10f}'.format(i) for i in tup]) 
-                     for tup in zip(f['x'], f['y'], f['z'])]
-        
-        # Create the remaining two output lists from the set uniq_atom.
-        # The order of the fractional coordinates now matches the atom
-        # order in atom_info.
-        
-        uniq_atom = set(atom)
-        atom_info = [(a, atom.count(a)) for a in uniq_atom]
-        frac_coor = [f for ua in uniq_atom for a, f in zip(atom, frac_coor)
-                     if ua == a]
-        
-        # Remove duplicate fractional coordinates that may have been
-        # added by the site group code.
-
-        i = 0
-        new_frac, new_count  = [], []
-
-        for value in atom_info:
-            name = value[0]
-            count = int(value[1])
-            
-            iold = i
-            i += count
-         
-            uniq_frac = set(frac_coor[iold:i])
-            
-            new_frac.extend(uniq_frac)
-            new_count.append(len(uniq_frac))
-        
-        # Replace atom_info and frac_coor if duplicates do exist.
-        if len(new_frac) != len(frac_coor):
-            atom_info = [(name,count) for name,count
-                         in zip(uniq_atom,new_count)]
-            frac_coor = new_frac
-        
-        return lat_vec, atom_info, frac_coor
-
-    @staticmethod
-    def calc(node):
-        '''Returns fractional coordinates from space group expression.
-        
-        Args:
-            node: String coordinate expression to be calculated.
-        
-        Returns:
-            Integer fractional coordinate that results from evaluating node.
-        '''
-        
-        # Define the operators that will be used in converting the space
-        # group equation (currently a string) to a new fractional coordinate.
-
-        operators = {ast.Add: op.add, ast.Sub: op.sub, ast.Mult: op.mul,
-                     ast.Div: op.truediv}
-
-
-        if isinstance(node, ast.Num): # If char in node is a number
-            return node.n
-        elif isinstance(node, ast.operator): # If char in node is an operator
-            return operators[type(node)]
-        
-        # After every character in node has been converted to ast objects,
-        # the equation can be evaluated.  The return value is the integer
-        # result of performing the following:
-        #
-        # node =  1 + 2
-        #
-        # calc(node.left)    -> 1       
-        # calc(node.op)      -> op.add, which is an addition method
-        # calc(node.right)   -> 2
-        #
-        # return op.add(1,2) -> 3
-        #
-        # Thus, the return value is the results of evaluating the 
-        # method calc three times
+        elif f.get('h-m'):
+            raise ValueError('Unknown space group {0!r}.'.format(f['h-m']))
 
-        elif isinstance(node, ast.BinOp): 
-            return Cif.calc(node.op)(Cif.calc(node.left), Cif.calc(node.right))
-        
-        # If calc doesn't recognize a char in node, throw exception.
         else:
-            raise TypeError(node)
+            raise ValueError('The file has no Hall or Hermann-Mauguin space '
+                             'group symbol.')
+
+        group, generators = symmetry.group(SymOps_dict[hall])
+
+        with profiler.stage('expand'):
+            # Grow the orbit of every site with the group generators, see
+            # symmetry.py.  A site on a special position has fewer images
+            # than the group has operations; the ratio is the order of its
+            # stabilizer, which must divide the order of the group.
+            sites, partial = {}, []
+            occupancy = f.get('occupancy') or [1.0]*len(atom)
+
+            for name, x, y, z, occ in zip(atom, f['x'], f['y'], f['z'],
+                                          occupancy):
+                orbit = symmetry.orbit((x, y, z), generators)
+                sites.setdefault(name, []).append(orbit)
+                if occ < 1 - OCCUPANCY_TOL:
+                    partial.append((name, occ, orbit))
+
+                if len(group) % len(orbit):
+                    logger.warning('%s site at (%g, %g, %g) has %d images, '
+                                   'which does not divide the %d operations '
+                                   'of %s.  Its coordinates may be rounded '
+                                   'too coarsely.', name, x, y, z,
+                                   len(orbit), len(group), hall)
+
+        # Atoms are grouped by species in order of first appearance, and
+        # each orbit is listed starting with the site given in the file.
+
+        with profiler.stage('dedup'):
+            # Different sites of one species only overlap if the file
+            # lists the same position twice.  Orbits hold exact fixed-point
+            # positions, so duplicates are found by hashing alone.
+            atom_info, frac_coor = [], []
+
+            for name, orbits in sites.items():
+                uniq_frac = dict.fromkeys(pos for orbit in orbits
+                                          for pos in orbit)
+                atom_info.append((name, len(uniq_frac)))
+                frac_coor.extend(symmetry.real(pos) for pos in uniq_frac)
+
+        info = {'hall': hall}
+        if partial:
+            info['disorder'] = partial
+        if f.get('type_symbol') and f.get('oxidation'):
+            info['charges'] = dict(zip(f['type_symbol'], f['oxidation']))
+        
+        return lat_vec, atom_info, frac_coor, info
 
 
 class Pdb(object):
     '''Read pdb files and return their important atomic information.'''
+
+    version = 1
     
     @staticmethod
     def read(file) -> 'Dictionary for pdb parse()':
         '''Gathers variable info from input pdb file.
 
         Args:
-            file: Full path of the .pdb file to be read.
+            file: Full path of the .pdb file to be read, or an open
+                  text stream.
 
         Returns:
             A dictionary object containing pdb file variables as keys and their
@@ -368,7 +442,7 @@ class Pdb(object):
 
         keyword = ('CRYST1', 'SCALE', 'ATOM', 'HETATM')
 
-        with open(file, 'r+') as f:
+        with _open(file, 'r+') as f:
             lines_read = [line for line in f if line.startswith(keyword)]
 
         output = {'x':[], 'y':[], 'z':[], 'atom':[]}
@@ -411,66 +485,111 @@ class Pdb(object):
                 output['z'].append(float(line[46:54].strip()))
 
         return output
+
+    @staticmethod
+    def read_mapped(file) -> 'Dictionary for pdb parse()':
+        '''Memory-mapped alternative to read for very large pdb files.
+
+        Records are found with regular expressions over the mapped bytes,
+        and only the fixed columns parse needs are cut out and converted.
+        No line of the file is decoded as a whole.
+
+        Args:
+            file: Full path of the .pdb file to be read.
+
+        Returns:
+            A dictionary with the same layout as read().
+        '''
+
+        output = {'x':[], 'y':[], 'z':[], 'atom':[]}
+        element = {}
+
+        with open(file, 'rb') as f, _mapped(f) as mm:
+
+            for match in PDB_CELL.finditer(mm):
+                i, record = match.start(), match.group(1)
+
+                if record == b'CRYST1':
+                    output['a'] = float(mm[i+6:i+15])
+                    output['b'] = float(mm[i+15:i+24])
+                    output['c'] = float(mm[i+24:i+33])
+
+                    output['alpha'] = radians(float(mm[i+33:i+40]))
+                    output['beta'] = radians(float(mm[i+40:i+47]))
+                    output['gamma'] = radians(float(mm[i+47:i+54]))
+
+                else:
+                    n = record[5:].decode()
+                    output['s' + n] = [float(mm[i+10:i+20]),
+                                       float(mm[i+20:i+30]),
+                                       float(mm[i+30:i+40])]
+
+                    output['u' + n] = float(mm[i+45:i+55])
+
+            # The atom name and coordinate columns are cut out by the
+            # pattern itself.  Element names are worked out once for each
+            # distinct pair of name characters.
+            for match in PDB_ATOM.finditer(mm):
+                name, x, y, z = match.groups()
+
+                if name not in element:
+                    c = name.decode('latin-1')
+                    if c[0].upper() == 'H':
+                        element[name] = c[0]
+                    elif c[0] == ' ':
+                        element[name] = c[1]
+                    else:
+                        element[name] = c[0] + c[1].lower()
+
+                output['atom'].append(element[name])
+                output['x'].append(float(x))
+                output['y'].append(float(y))
+                output['z'].append(float(z))
+
+        return output
     
     @staticmethod
-    def parse(data) -> '3-Tuple for Convert.Output()':
+    def parse(data) -> '4-Tuple for Convert.Output()':
         '''Takes data from cif read method and returns relevant data.
 
         Args:
             data: Dictionary from cif_read mapping cif variables to values.
 
         Returns:
-            A 3-tuple containing the required information for Convert.output().
+            A 4-tuple containing the required information for Convert.output().
 
-            lat_vec: A list of three strings containing the lattice vectors
+            lat_vec: A list of three [x, y, z] lattice vectors
             atom_info: A list with the following form -
                 [[atom 1 name, # of atom 1], [atom 2 name, # of atom 2], ...]
-            frac_coor: A list of strings, with each string containing the
-                       x, y, and z fractional coordinates of the atom
-                       separated by spaces.
+            frac_coor: A list of (x, y, z) fractional coordinate tuples.
+            info: An empty dictionary, as pdb files are read in P1.
          '''
         f = data
+        lat_vec = cell.vectors([[f[k] for k in CELL_KEYS]])[0]
     
         #Convert the supplied orthogonal coordinates to fractional coordinates.
 
         xyz = list(zip(f['x'], f['y'], f['z']))
         ortho = [vec for vec in xyz]
 
-        key_tup = (('x','1'),('y','2'), ('z','3'))
+        # Files without SCALE records are converted with the inverse of
+        # the lattice matrix, which is equivalent for the standard
+        # PDB orientation.
+        if 's1' not in f:
+            f['x'], f['y'], f['z'] = zip(*cell.to_frac(lat_vec, ortho))
 
-        for key,i in key_tup:
-            s = 's' + i
-            u = 'u' + i
-            f[key] = [f[s][0]*vec[0] + f[s][1]*vec[1] + f[s][2]*vec[2] + f[u]
-                      for vec in ortho]
-    
-        # Calculate the lattice vectors, outputting as string list.
-        # v is the unit cell volume.
-        
-        v = (f['a']*f['b']*f['c']*
-            (1 - cos(f['alpha'])**2 - cos(f['beta'])**2 - cos(f['gamma'])**2 +
-            2*cos(f['alpha'])*cos(f['beta'])*cos(f['gamma']))**0.5)
-        
-        lat_vec = [# a vector
-                   [f['a'], 0, 0],
-                   
-                   # b vector
-                   [f['b']*cos(f['gamma']), f['b']*sin(f['gamma']),0],
-                   
-                   # c vector
-                   [f['c']*cos(f['beta']),
-                    f['c']*(cos(f['alpha'])- cos(f['beta'])*cos(f['gamma']))/
-                    sin(f['gamma']), 
-                    v/(f['a']*f['b']*sin(f['gamma']))]
-                  ]
-
-        lat_vec = [' '.join(['{: 5.10f}'.format(i) for i in v])
-                   for v in lat_vec]
+        else:
+            key_tup = (('x','1'),('y','2'), ('z','3'))
+
+            for key,i in key_tup:
+                s = 's' + i
+                u = 'u' + i
+                f[key] = [f[s][0]*vec[0] + f[s][1]*vec[1] + f[s][2]*vec[2] +
+                          f[u] for vec in ortho]
         
-        #Combine x, y, and z fractional coordinates in a string.
+        #Combine x, y, and z fractional coordinates in a tuple.
     
-        frac_coor = [' '.join(['{: 5.10f}'.format(i) for i in tup]) 
-                     for tup in zip(f['x'], f['y'], f['z'])]
+        frac_coor = list(zip(f['x'], f['y'], f['z']))
 
         # Create the remaining two output lists from the set uniq_atom.
         # The order of the fractional coordinates now matches the atom
@@ -483,7 +602,257 @@ class Pdb(object):
         frac_coor = [f for ua in uniq_atom for a, f in zip(atom, frac_coor)
                      if ua == a]
 
-        return lat_vec, atom_info, frac_coor
+        return lat_vec, atom_info, frac_coor, {}
+
+
+class Xyz(object):
+    '''Read extended xyz trajectories frame by frame.'''
+
+    @staticmethod
+    def frames(file, start=0, stop=None, step=1) -> 'Iterator of frame dicts':
+        '''Streams the frames of an extended xyz file.
+
+        Each frame is an atom count line, a comment line holding the
+        Lattice and Properties keys, and one line per atom.  Only one
+        frame is held in memory at a time.  Frames outside the requested
+        slice are skipped by counting lines, without splitting them or
+        converting any numbers, and reading stops after the last wanted
+        frame.
+
+        Args:
+            file: Full path of the .xyz file to be read, or an open
+                  text stream.
+            start, stop, step: Frame selection, as in a slice.  Negative
+                               values are not supported, since the number
+                               of frames is not known in advance.
+
+        Returns:
+            An iterator of dictionaries for Xyz.parse, one per selected
+            frame, with the keys 'frame', 'comment' and 'lines'.
+        '''
+
+        if start < 0 or (stop is not None and stop < 0) or step < 1:
+            raise ValueError('Frame selection must be a non-negative '
+                             'start:stop:step slice.')
+
+        with _open(file) as f:
+            index = 0
+            while stop is None or index < stop:
+
+                count = f.readline()
+                if not count.strip():
+                    return
+                count = int(count)
+
+                if index < start or (index - start) % step:
+                    deque(islice(f, count + 1), maxlen=0)
+                else:
+                    comment = f.readline()
+                    lines = list(islice(f, count))
+                    if len(lines) != count:
+                        raise ValueError('Frame {0} of {1} is truncated.'
+                                         .format(index, file))
+                    yield {'frame': index, 'comment': comment,
+                           'lines': lines}
+
+                index += 1
+
+    @staticmethod
+    def read(file) -> 'Dictionary for xyz parse()':
+        '''Returns the first frame of the file, see Xyz.frames.'''
+
+        for frame in Xyz.frames(file, 0, 1):
+            return frame
+
+        raise ValueError('{0} contains no frames.'.format(file))
+
+    @staticmethod
+    def parse(data) -> '4-tuple for Convert.output()':
+        '''Converts one frame from Xyz.frames to the parse() 4-tuple.
+
+        The whole coordinate block is split at once, and the species and
+        position columns are taken from the flat token list by striding,
+        rather than splitting and converting the lines one at a time.
+
+        Args:
+            data: Frame dictionary from Xyz.frames or Xyz.read.
+
+        Returns:
+            A 4-tuple like Cif.parse.  Atoms are grouped by species in
+            order of first appearance, and info holds the frame index.
+        '''
+
+        keys = {k.lower(): v.strip('"\'{}')
+                for k, v in XYZ_KEY.findall(data['comment'])}
+
+        if 'lattice' not in keys:
+            raise ValueError('Frame {0} has no Lattice, which is needed '
+                             'for a POSCAR.'.format(data['frame']))
+
+        lattice = [float(x) for x in keys['lattice'].split()]
+        lat_vec = [lattice[0:3], lattice[3:6], lattice[6:9]]
+
+        # Properties lists name:type:columns triples, which give the
+        # offsets of the species and position columns in each row.
+        props = keys.get('properties', 'species:S:1:pos:R:3').split(':')
+        offset, width = {}, 0
+        for name, ncol in zip(props[0::3], props[2::3]):
+            offset[name.lower()] = width
+            width += int(ncol)
+
+        token = ''.join(data['lines']).split()
+        if len(token) != width*len(data['lines']):
+            raise ValueError('Frame {0} does not match its Properties.'
+                             .format(data['frame']))
+
+        species = [s[0].upper() + re.sub('[^a-z]', '', s[1:2].lower())
+                   for s in token[offset['species']::width]]
+        pos = offset['pos']
+        cart = zip(map(float, token[pos::width]),
+                   map(float, token[pos+1::width]),
+                   map(float, token[pos+2::width]))
+
+        frac = [cell.wrap(row) for row in cell.to_frac(lat_vec, cart)]
+
+        # Group the atoms by species, keeping the order of first appearance.
+        group = {}
+        for name, row in zip(species, frac):
+            group.setdefault(name, []).append(row)
+
+        atom_info = [(name, len(rows)) for name, rows in group.items()]
+        frac_coor = [row for rows in group.values() for row in rows]
+
+        return lat_vec, atom_info, frac_coor, {'frame': data['frame']}
+
+
+class Xdatcar(object):
+    '''Read VASP XDATCAR files frame by frame.'''
+
+    @staticmethod
+    def frames(file, start=0, stop=None, step=1) -> 'Iterator of frame dicts':
+        '''Streams the configurations of an XDATCAR file.
+
+        An XDATCAR holds a POSCAR-like header (title, scaling constant,
+        lattice vectors, species and counts) followed by one
+        'Direct configuration=' block per frame.  Variable cell runs
+        repeat the header before every block, and the most recent header
+        applies to the blocks after it.  As in Xyz.frames, unselected
+        blocks are skipped by counting lines.
+
+        Args:
+            file: Full path of the XDATCAR file to be read, or an open
+                  text stream.
+            start, stop, step: Frame selection, as in a slice, counting
+                               the configuration blocks in file order.
+
+        Returns:
+            An iterator of dictionaries for Xdatcar.parse, one per selected
+            frame, with the keys 'frame', 'header' and 'lines'.
+        '''
+
+        if start < 0 or (stop is not None and stop < 0) or step < 1:
+            raise ValueError('Frame selection must be a non-negative '
+                             'start:stop:step slice.')
+
+        with _open(file) as f:
+            header, index = None, 0
+            line = f.readline()
+
+            while line and (stop is None or index < stop):
+                config = XDATCAR_CONFIG.match(line)
+
+                if not line.strip():
+                    pass
+                elif config is None:
+                    header = Xdatcar.header(line, f)
+                elif header is None:
+                    raise ValueError('{0} has a configuration before its '
+                                     'header.'.format(file))
+                elif (config.group(1) or '').lower() == 'cartesian':
+                    raise ValueError('Cartesian XDATCAR files are not '
+                                     'supported.')
+                elif index < start or (index - start) % step:
+                    deque(islice(f, header['count']), maxlen=0)
+                    index += 1
+                else:
+                    lines = list(islice(f, header['count']))
+                    if len(lines) != header['count']:
+                        raise ValueError('Frame {0} of {1} is truncated.'
+                                         .format(index, file))
+                    frame = int(config.group(2)) - 1 if config.group(2) \
+                        else index
+                    yield {'frame': frame, 'header': header, 'lines': lines}
+                    index += 1
+
+                line = f.readline()
+
+    @staticmethod
+    def header(title, f) -> 'Dictionary with lat_vec, atom_info and count':
+        '''Reads the five header lines following the title line.
+
+        A negative scaling constant is the cell volume, as in a POSCAR.
+
+        Exceptions:
+            ValueError: Occurs for VASP 4 files, which have no line of
+                        species names, and for truncated headers.
+        '''
+
+        lines = [f.readline().split() for _ in range(6)]
+        if not all(lines):
+            raise ValueError('XDATCAR header after {0!r} is truncated.'
+                             .format(title.strip()))
+
+        scale = float(lines[0][0])
+        lat_vec = [[float(x) for x in row[:3]] for row in lines[1:4]]
+        if scale < 0:
+            scale = (-scale/abs(cell.det(lat_vec)))**(1/3)
+        lat_vec = [[scale*x for x in row] for row in lat_vec]
+
+        names, counts = lines[4], lines[5]
+        if names[0].lstrip('-').replace('.', '').isdigit():
+            raise ValueError('XDATCAR has no species names line, so the '
+                             'atoms cannot be identified.')
+
+        atom_info = [(name, int(n)) for name, n in zip(names, counts)]
+        return {'lat_vec': lat_vec, 'atom_info': atom_info,
+                'count': sum(n for _, n in atom_info)}
+
+    @staticmethod
+    def read(file) -> 'Dictionary for xdatcar parse()':
+        '''Returns the first frame of the file, see Xdatcar.frames.'''
+
+        for frame in Xdatcar.frames(file, 0, 1):
+            return frame
+
+        raise ValueError('{0} contains no frames.'.format(file))
+
+    @staticmethod
+    def parse(data) -> '4-tuple for Convert.output()':
+        '''Converts one frame from Xdatcar.frames to the parse() 4-tuple.
+
+        Args:
+            data: Frame dictionary from Xdatcar.frames or Xdatcar.read.
+
+        Returns:
+            A 4-tuple like Cif.parse, with the lattice and species of the
+            header in effect for the frame, and info holding the frame
+            number, counted from 0.
+        '''
+
+        header = data['header']
+        token = ''.join(data['lines']).split()
+
+        # Lines normally hold exactly x, y and z, so the block is split at
+        # once; anything after the coordinates forces a per line split.
+        if len(token) != 3*len(data['lines']):
+            token = [x for line in data['lines'] for x in line.split()[:3]]
+
+        frac = zip(map(float, token[0::3]), map(float, token[1::3]),
+                   map(float, token[2::3]))
+        frac_coor = [cell.wrap(row) for row in frac]
+
+        return (header['lat_vec'], header['atom_info'], frac_coor,
+                {'frame': data['frame']})
                 
 
     
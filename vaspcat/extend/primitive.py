@@ -0,0 +1,76 @@
+import logging
+from vaspcat.extend import cell
+
+logger = logging.getLogger(__name__)
+
+# Rows of each matrix are the primitive basis vectors written in terms of
+# the conventional ones, new_basis = P . conventional_basis.  The choices
+# are the usual ones for VASP inputs, e.g. the F matrix gives the familiar
+# fcc vectors (0, a/2, a/2), (a/2, 0, a/2), (a/2, a/2, 0).  R is the
+# obverse rhombohedral centering of the hexagonal setting; rhombohedral
+# space groups given on rhombohedral axes have a P Hall symbol already.
+# The last element is the number of lattice points in the conventional cell.
+
+CENTERING = {
+    'P': ([[1, 0, 0], [0, 1, 0], [0, 0, 1]], 1),
+    'A': ([[1, 0, 0], [0, 1/2, 1/2], [0, -1/2, 1/2]], 2),
+    'B': ([[1/2, 0, 1/2], [0, 1, 0], [-1/2, 0, 1/2]], 2),
+    'C': ([[1/2, 1/2, 0], [-1/2, 1/2, 0], [0, 0, 1]], 2),
+    'I': ([[-1/2, 1/2, 1/2], [1/2, -1/2, 1/2], [1/2, 1/2, -1/2]], 2),
+    'F': ([[0, 1/2, 1/2], [1/2, 0, 1/2], [1/2, 1/2, 0]], 4),
+    'R': ([[2/3, 1/3, 1/3], [-1/3, 1/3, 1/3], [-1/3, -2/3, 1/3]], 3),
+}
+
+
+def centering(hall) -> 'Upper case centering letter':
+    '''Returns the lattice centering letter of a Hall symbol.
+
+    Args:
+        hall: Hall symbol, e.g. '-F 4 2 3' or 'c 2y'.  A leading '-'
+              marks a centrosymmetric group and is skipped.
+    '''
+
+    return hall.lstrip('-').strip()[0].upper()
+
+
+def apply(lat_vec, atom_info, frac_pos, info) -> '4-tuple like parse()':
+    '''Replaces a centered conventional cell by its primitive cell.
+
+    The centering letter is taken from info['hall'], as set by Cif.parse.
+    Structures without one, such as pdb input, are returned unchanged.
+
+    Args:
+        lat_vec, atom_info, frac_pos, info: Output of a posext parse().
+
+    Returns:
+        The primitive lattice, atom_info with the reduced counts, the
+        fractional coordinates folded into the primitive cell with
+        duplicates removed, and info.
+    '''
+
+    letter = centering(info['hall']) if info.get('hall') else 'P'
+    p, points = CENTERING[letter]
+    if points == 1:
+        return lat_vec, atom_info, frac_pos, info
+
+    prim = cell.matmul(p, lat_vec)
+    q = cell.inv(p)
+
+    # Fold every species block separately.  A dict keeps the first
+    # occurrence of each folded position, so the output order is stable.
+    new_info, new_frac, i = [], [], 0
+
+    for name, count in atom_info:
+        block = cell.matmul(frac_pos[i:i + count], q)
+        i += count
+
+        folded = list(dict.fromkeys(cell.wrap(row) for row in block))
+        new_info.append((name, len(folded)))
+        new_frac.extend(folded)
+
+        if len(folded)*points != count:
+            logger.warning('%d %s atoms do not fold evenly into the %s '
+                           'centered primitive cell (%d left).',
+                           count, name, letter, len(folded))
+
+    return prim, new_info, new_frac, info
@@ -0,0 +1,202 @@
+import logging
+from collections import Counter
+from functools import reduce
+from itertools import product
+from math import gcd, sqrt
+from vaspcat.extend import cell
+
+logger = logging.getLogger(__name__)
+
+# Surface slabs cut from a bulk structure.  For a Miller index (h, k, l)
+# the cell is first rewritten in a basis P . lat_vec with
+#
+#    v1, v2   integer vectors spanning the lattice plane, h . v = 0, with
+#             v1 x v2 = (h, k, l), so they are a basis of the plane
+#    w        an integer vector with h . w = 1, as short as possible
+#
+# P = [v1, v2, w] is unimodular, so the new cell holds the same atoms and
+# their fractional coordinates are frac . P^-1.  The third coordinate is
+# then the height of an atom in units of the interplanar spacing, and the
+# atomic planes are the distinct values of it.  Each plane can be put at
+# the bottom of the slab, and two such terminations are the same when the
+# sequence of plane compositions and spacings above them is the same.
+#
+# The slab repeats the surface cell `layers` times along w.  Its c vector
+# is put along the surface normal, which keeps any rotation about the
+# normal a symmetry of the slab, and made longer by the vacuum thickness.
+# The written cell has a and b in the xy-plane and c along z.
+
+# Tolerance in Angstrom for atoms to count as being in one plane.
+PLANE_TOL = 0.01
+
+
+def apply(lat_vec, atom_info, frac_pos, info, miller=(0, 0, 1),
+          layers=1, vacuum=10.0, termination=0) -> '4-tuple like parse()':
+    '''Replaces a bulk structure by a surface slab.
+
+    Args:
+        lat_vec, atom_info, frac_pos, info: Output of a posext parse().
+        miller: Miller index (h, k, l) of the surface, with respect to
+                lat_vec.
+        layers: Number of surface cells stacked along the normal.
+        vacuum: Thickness of the vacuum layer in Angstrom.
+        termination: Index into the distinct terminations, ordered by the
+                     height of their bottom plane in the surface cell.
+
+    Returns:
+        The slab lattice, atom_info with the counts multiplied by layers,
+        the fractional coordinates and info.  The space group of the bulk
+        no longer applies, so 'hall' and 'symmetry' are removed from info
+        and 'slab' is added, holding the options and the number of
+        distinct terminations found.
+
+    Exceptions:
+        ValueError: Occurs for a zero Miller index, fewer than one layer,
+                    negative vacuum or a termination index out of range.
+    '''
+
+    if layers < 1 or vacuum < 0:
+        raise ValueError('A slab needs at least one layer and a vacuum '
+                         'thickness of at least 0.')
+
+    p = basis(lat_vec, miller)
+    surf = cell.matmul(p, lat_vec)
+    q = cell.inv(p)
+    frac = [cell.wrap(row) for row in cell.matmul(frac_pos, q)]
+
+    names = [name for name, count in atom_info for _ in range(count)]
+    shifts = terminations(surf, names, frac)
+    if not 0 <= termination < len(shifts):
+        raise ValueError('Termination {0} requested, but the {1} surface '
+                         'has {2}.'.format(termination, tuple(miller),
+                                           len(shifts)))
+    logger.info('%s surface has %d distinct terminations.',
+                tuple(miller), len(shifts))
+
+    # Stack the layers, with the chosen plane at the bottom.  Atoms of
+    # that plane lying just below it, or folded to the top of the cell,
+    # are kept at the bottom with a slightly negative height.
+    shift, tol = shifts[termination], PLANE_TOL/spacing(surf)
+    stacked = [(x, y, ((z - shift + tol) % 1.0 - tol + n)/layers)
+               for x, y, z in frac for n in range(layers)]
+
+    # The slab cell has c along the surface normal, as long as the
+    # stacked layers plus the vacuum.  Atoms keep their Cartesian
+    # positions, and are wrapped back into the cell along a and b.
+    a, b, w = surf
+    c = [layers*x for x in w]
+    normal = cell.cross(a, b)
+    norm = sqrt(cell.dot(normal, normal))
+    height = layers*spacing(surf) + vacuum
+    slab = [a, b, [height*n/norm for n in normal]]
+
+    # Only a and b are periodic, so heights are not wrapped.  Rounding
+    # leaves -0.0 for tiny negative values, which adding 0.0 turns into
+    # 0.0, so the POSCAR never shows -0.0000000000.
+    cart = cell.to_cart([a, b, c], stacked)
+    new_frac = [cell.wrap(row[:2]) + (round(row[2], 10) + 0.0,)
+                for row in cell.to_frac(slab, cart)]
+
+    # Write the slab with a along x and b in the xy-plane, which puts the
+    # surface normal along z.  Fractional coordinates do not change.
+    slab = [[round(x, 10) + 0.0 for x in v]
+            for v in cell.vectors(cell.parameters([slab]))[0]]
+
+    new_info = [(name, count*layers) for name, count in atom_info]
+    info = {k: v for k, v in info.items() if k not in ('hall', 'symmetry')}
+    info['slab'] = {'miller': tuple(miller), 'layers': layers,
+                    'vacuum': vacuum, 'termination': termination,
+                    'terminations': len(shifts)}
+
+    return slab, new_info, new_frac, info
+
+
+def basis(lat_vec, miller) -> 'Unimodular integer matrix P':
+    '''Returns P = [v1, v2, w], see the module comment.
+
+    Candidates are searched among integer vectors with entries up to
+    max(|h|, |k|, |l|) + 1, which always contains a basis of the plane.
+    Among them the shortest vectors in Cartesian length are chosen.
+    '''
+
+    hkl = [int(i) for i in miller]
+    div = reduce(gcd, hkl)
+    if div == 0:
+        raise ValueError('The Miller index (0, 0, 0) has no surface.')
+    hkl = [i//div for i in hkl]
+
+    reach = max(abs(i) for i in hkl) + 1
+    vectors = [v for v in product(range(-reach, reach + 1), repeat=3)
+               if any(v)]
+
+    def length(v):
+        r = cell.matmul([v], lat_vec)[0]
+        return cell.dot(r, r)
+
+    plane = sorted((v for v in vectors if cell.dot(v, hkl) == 0),
+                   key=length)
+
+    # v1 x v2 must equal the primitive normal, so the pair spans every
+    # lattice point of the plane.  The shortest such pair is taken,
+    # preferring the right-handed sign.
+    v1 = v2 = None
+    for v in plane:
+        for u in plane:
+            if list(cell.cross(v, u)) == hkl:
+                v1, v2 = v, u
+                break
+        if v1 is not None:
+            break
+
+    # Of the vectors one plane up, take the one closest to the normal.
+    up = min((v for v in vectors if cell.dot(v, hkl) == 1), key=length)
+
+    return [list(v1), list(v2), list(up)]
+
+
+def spacing(surf) -> 'Interplanar spacing in Angstrom':
+    '''Returns the height of the surface cell along the normal.'''
+
+    a, b, w = surf
+    normal = cell.cross(a, b)
+    return abs(cell.dot(w, normal))/sqrt(cell.dot(normal, normal))
+
+
+def terminations(surf, names, frac) -> 'List of plane heights':
+    '''Returns the height of the bottom plane of each distinct termination.
+
+    Args:
+        surf: Surface cell from basis.
+        names: Species of each atom.
+        frac: Fractional coordinates in the surface cell.
+    '''
+
+    tol = PLANE_TOL/spacing(surf)
+
+    # Group the atoms into planes by height.  A plane near 1 is the same
+    # as one near 0, which the last check below folds together.
+    planes = []
+    for z, name in sorted(zip((f[2] for f in frac), names)):
+        if planes and z - planes[-1][0] <= tol:
+            planes[-1][1][name] += 1
+        else:
+            planes.append((z, Counter({name: 1})))
+
+    if len(planes) > 1 and planes[0][0] + 1 - planes[-1][0] <= tol:
+        z, last = planes.pop()
+        planes[0][1].update(last)
+
+    heights, d = [z for z, c in planes], spacing(surf)
+    seen, out = set(), []
+
+    for i in range(len(planes)):
+        order = planes[i:] + planes[:i]
+        steps = [round(((order[(j + 1) % len(order)][0] - z) % 1.0)*d, 2)
+                 for j, (z, c) in enumerate(order)]
+        key = tuple((tuple(sorted(c.items())), s)
+                    for (z, c), s in zip(order, steps))
+        if key not in seen:
+            seen.add(key)
+            out.append(heights[i])
+
+    return out
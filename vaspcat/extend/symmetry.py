@@ -0,0 +1,204 @@
+import logging
+import re
+from fractions import Fraction
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Symmetry expansion of cif sites.  Applying all |G| general position
+# operations to every site and dropping duplicates afterwards costs
+# |G| x sites evaluations, e.g. 192 per site in Fm-3m, even when a site on
+# a special position only has 4 images.  By the orbit-stabilizer theorem a
+# site x has |G| / |G_x| distinct images, one per coset of its stabilizer
+# G_x, so instead each orbit is grown from x by applying a small generating
+# set of G to the positions found so far:
+#
+#    orbit = [x]; for p in orbit: for g in generators: add g(p) if new
+#
+# This visits every coset representative once and costs |orbit| x
+# |generators| evaluations, i.e. it scales with the number of atoms
+# written rather than with the order of the group.  The generators of each
+# space group are found once, from the exact (integer rotation, rational
+# translation) form of its operations.
+#
+# Positions are held in fixed point while the orbit is grown: each
+# coordinate is an integer n standing for n / SCALE.  SCALE is a multiple of
+# 12, the largest denominator of the tabulated translations, so applying an
+# operation is exact integer arithmetic modulo SCALE, and equivalent
+# positions such as -x+1/2 of x = 0 and 1/2 hash identically rather than
+# ending up as 0.49999999 and 0.5.  Deduplication is then a plain set
+# lookup.  Coordinates read from the file are snapped to the nearest
+# multiple of 1/24 when within SNAP_TOL of it, so 0.3333 and 0.6667 are
+# taken as 1/3 and 2/3 and their images close up exactly.
+
+# Terms of one coordinate of a general position, e.g. '-x+y+1/3'.
+TERM = re.compile(r'\s*([+-]?)\s*(\d+(?:\.\d*)?(?:/\d+)?|[xyz])')
+
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+# Fixed-point unit, 1/SCALE, below the 10 decimals written to the POSCAR.
+SCALE = 12*10**10
+
+# Special coordinates, i.e. multiples of 1/24, and how far a coordinate
+# from a cif file with 4 decimals may lie from one to be snapped to it.
+SNAP = 24
+SNAP_TOL = 5e-5
+
+
+def operation(op) -> '(rotation, translation) tuple':
+    '''Compiles one general position of spacegroup.SymOpsHall.
+
+    Args:
+        op: List of three coordinate strings, e.g. ['-y', ' x-y', ' z+1/3'].
+
+    Returns:
+        The integer rotation matrix as a tuple of row tuples, and the
+        translation as a tuple of Fractions in [0, 1).
+
+    Exceptions:
+        ValueError: Occurs for strings that are not affine expressions
+                    of x, y and z.
+    '''
+
+    if len(op) != 3:
+        raise ValueError('{0} does not have three coordinates.'.format(op))
+
+    rot, trans = [], []
+    for expr in op:
+        row, shift, end = [0, 0, 0], Fraction(0), 0
+        expr = expr.strip().lower()
+
+        for match in TERM.finditer(expr):
+            if match.start() != end:
+                break
+            sign = -1 if match.group(1) == '-' else 1
+            term = match.group(2)
+            if term in AXES:
+                row[AXES[term]] += sign
+            else:
+                shift += sign*Fraction(term)
+            end = match.end()
+
+        if end != len(expr) or not expr:
+            raise ValueError('Cannot read the operation {0!r}.'.format(expr))
+
+        rot.append(tuple(row))
+        trans.append(shift % 1)
+
+    return tuple(rot), tuple(trans)
+
+
+def compose(g, h) -> '(rotation, translation) of g after h':
+    (rg, tg), (rh, th) = g, h
+    rot = tuple(tuple(sum(rg[i][k]*rh[k][j] for k in range(3))
+                      for j in range(3)) for i in range(3))
+    trans = tuple((sum(rg[i][k]*th[k] for k in range(3)) + tg[i]) % 1
+                  for i in range(3))
+
+    return rot, trans
+
+
+def closure(generators) -> 'Set of all operations generated':
+    identity = (((1, 0, 0), (0, 1, 0), (0, 0, 1)), (Fraction(0),)*3)
+    group, queue = {identity}, [identity]
+
+    for g in queue:
+        for h in generators:
+            new = compose(h, g)
+            if new not in group:
+                group.add(new)
+                queue.append(new)
+
+    return group
+
+
+@lru_cache(maxsize=None)
+def group(hall) -> '(operations, generators) of a space group':
+    '''Returns the operations of a space group and a generating set.
+
+    Args:
+        hall: Hall symbol exactly as keyed in spacegroup.SymOpsHall.
+
+    Returns:
+        The frozen set of all operations, and a short list of them that
+        generates the whole group.  Malformed table entries are skipped;
+        the operations they stand for are recovered by the closure.
+    '''
+
+    from vaspcat.extend import spacegroup as sg
+
+    ops = []
+    for op in sg.SymOpsHall[hall]:
+        try:
+            ops.append(operation(op))
+        except ValueError as err:
+            logger.debug('Skipping operation of %s: %s', hall, err)
+
+    # Pick operations not yet generated by the earlier picks.  Space
+    # groups need at most a handful, e.g. 4 for Fm-3m.
+    generators, generated = [], closure([])
+    for op in ops:
+        if op not in generated:
+            generators.append(op)
+            generated = closure(generators)
+
+    return frozenset(generated), generators
+
+
+def fixed(site) -> 'Tuple of fixed-point integers in [0, SCALE)':
+    '''Converts fractional coordinates to fixed point, see SCALE.
+
+    Coordinates within SNAP_TOL of a multiple of 1/SNAP are snapped to it
+    first, so the values written with limited precision in cif files map
+    onto the exact special positions.
+    '''
+
+    out = []
+    for x in site:
+        special = round(x*SNAP)
+        if abs(x*SNAP - special) <= SNAP_TOL*SNAP:
+            n = special*(SCALE//SNAP)
+        else:
+            n = round(x*SCALE)
+        out.append(n % SCALE)
+
+    return tuple(out)
+
+
+def real(pos) -> 'Tuple of fractional coordinates':
+    '''Converts a fixed-point position back to floats in [0, 1).'''
+
+    return tuple(n/SCALE for n in pos)
+
+
+def orbit(site, generators) -> 'List of fixed-point positions':
+    '''Returns the distinct images of a site, starting with the site.
+
+    Args:
+        site: Fractional (x, y, z) coordinates, snapped by fixed.
+        generators: Operations from group.
+
+    Returns:
+        Positions in the fixed-point form of fixed.  Being integer tuples,
+        equal positions compare and hash equal, so images of different
+        sites can be merged with a set or dictionary.  Use real to get
+        the fractional coordinates.
+    '''
+
+    # Translations have denominators dividing 12, so they are integers
+    # in units of 1/SCALE.
+    gens = [(rot, [int(t*SCALE) for t in trans])
+            for rot, trans in generators]
+
+    start = fixed(site)
+    seen, queue = {start: None}, [start]
+
+    for p in queue:
+        for rot, trans in gens:
+            image = tuple((r[0]*p[0] + r[1]*p[1] + r[2]*p[2] + t) % SCALE
+                          for r, t in zip(rot, trans))
+            if image not in seen:
+                seen[image] = None
+                queue.append(image)
+
+    return list(seen)
@@ -0,0 +1,131 @@
+import logging
+from vaspcat.extend import neighbor
+
+logger = logging.getLogger(__name__)
+
+# Overlap check run on the converted structure before it is written.  Bad
+# cif files, e.g. with disordered sites listed at full occupancy or
+# coordinates given in another setting than the space group, still parse,
+# but leave atoms on top of each other.  Two atoms are flagged when they
+# are closer than
+#
+#    factor * (r_a + r_b)
+#
+# where r are the covalent radii below.  With the default factor of 0.5
+# this is about a third of the shortest real bond between the two
+# elements, so only clearly unphysical pairs are reported.  Pairs are found
+# with the cell list of neighbor.py in O(N).
+
+FACTOR = 0.5
+
+# Covalent radii in Angstrom, from Cordero et al., Dalton Trans. (2008).
+RADIUS = {
+    'H': 0.31, 'He': 0.28, 'Li': 1.28, 'Be': 0.96, 'B': 0.84, 'C': 0.76,
+    'N': 0.71, 'O': 0.66, 'F': 0.57, 'Ne': 0.58, 'Na': 1.66, 'Mg': 1.41,
+    'Al': 1.21, 'Si': 1.11, 'P': 1.07, 'S': 1.05, 'Cl': 1.02, 'Ar': 1.06,
+    'K': 2.03, 'Ca': 1.76, 'Sc': 1.70, 'Ti': 1.60, 'V': 1.53, 'Cr': 1.39,
+    'Mn': 1.39, 'Fe': 1.32, 'Co': 1.26, 'Ni': 1.24, 'Cu': 1.32, 'Zn': 1.22,
+    'Ga': 1.22, 'Ge': 1.20, 'As': 1.19, 'Se': 1.20, 'Br': 1.20, 'Kr': 1.16,
+    'Rb': 2.20, 'Sr': 1.95, 'Y': 1.90, 'Zr': 1.75, 'Nb': 1.64, 'Mo': 1.54,
+    'Tc': 1.47, 'Ru': 1.46, 'Rh': 1.42, 'Pd': 1.39, 'Ag': 1.45, 'Cd': 1.44,
+    'In': 1.42, 'Sn': 1.39, 'Sb': 1.39, 'Te': 1.38, 'I': 1.39, 'Xe': 1.40,
+    'Cs': 2.44, 'Ba': 2.15, 'La': 2.07, 'Ce': 2.04, 'Pr': 2.03, 'Nd': 2.01,
+    'Pm': 1.99, 'Sm': 1.98, 'Eu': 1.98, 'Gd': 1.96, 'Tb': 1.94, 'Dy': 1.92,
+    'Ho': 1.92, 'Er': 1.89, 'Tm': 1.90, 'Yb': 1.87, 'Lu': 1.87, 'Hf': 1.75,
+    'Ta': 1.70, 'W': 1.62, 'Re': 1.51, 'Os': 1.44, 'Ir': 1.41, 'Pt': 1.36,
+    'Au': 1.36, 'Hg': 1.32, 'Tl': 1.45, 'Pb': 1.46, 'Bi': 1.48, 'Po': 1.40,
+    'At': 1.50, 'Rn': 1.50, 'Fr': 2.60, 'Ra': 2.21, 'Ac': 2.15, 'Th': 2.06,
+    'Pa': 2.00, 'U': 1.96, 'Np': 1.90, 'Pu': 1.87, 'Am': 1.80, 'Cm': 1.69,
+}
+
+# Used for labels that are not element symbols, e.g. from pdb files.
+DEFAULT_RADIUS = 0.7
+
+# Number of overlapping pairs listed in the error message.
+SHOWN = 5
+
+
+def apply(lat_vec, atom_info, frac_pos, info,
+          factor=FACTOR) -> '4-tuple like parse()':
+    '''Checks a structure for overlapping atoms.
+
+    The structure is unchanged.  info['min_distance'] is set to the
+    shortest distance found within the search cutoff, or None if every
+    pair is further apart.
+
+    Exceptions:
+        ValueError: Occurs when any pair of atoms is closer than its
+                    threshold.  The conversion of the file then fails
+                    instead of writing a POSCAR that VASP would run.
+    '''
+
+    found = overlaps(lat_vec, atom_info, frac_pos, factor)
+    bad = [pair for pair in found if pair[2] < pair[3]]
+
+    shortest = min((pair[2] for pair in found), default=None)
+    if shortest is not None:
+        logger.debug('Shortest interatomic distance %.4f A.', shortest)
+
+    if bad:
+        names = [name for name, count in atom_info for _ in range(count)]
+        shown = ', '.join('{0}{1}-{2}{3} {4:.3f} A'.format(
+                              names[i], i + 1, names[j], j + 1, r)
+                          for i, j, r, limit in bad[:SHOWN])
+        raise ValueError('{0} pairs of atoms overlap ({1}{2}).'.format(
+            len(bad), shown, ', ...' if len(bad) > SHOWN else ''))
+
+    return lat_vec, atom_info, frac_pos, dict(info, min_distance=shortest)
+
+
+def radius(name) -> 'Covalent radius in Angstrom':
+    return RADIUS.get(name, DEFAULT_RADIUS)
+
+
+def overlaps(lat_vec, atom_info, frac_pos,
+             factor=FACTOR) -> 'List of (i, j, distance, limit) tuples':
+    '''Returns the pairs of atoms within the largest overlap threshold.
+
+    Args:
+        lat_vec, atom_info, frac_pos: Output of a posext parse().
+        factor: Multiple of the summed covalent radii below which two
+                atoms overlap.
+
+    Returns:
+        Every pair closer than the largest threshold of any two species
+        in the structure, sorted by distance.  Atom indices follow the
+        POSCAR order; the pair overlaps if distance < limit.  A pair
+        with i == j is an atom too close to its own periodic image.
+    '''
+
+    radii = [radius(name) for name, count in atom_info
+             for _ in range(count)]
+    if not radii:
+        return []
+
+    cutoff = 2*factor*max(radii)
+
+    if 2*cutoff < min(neighbor.CellList.heights(lat_vec)):
+        pairs = neighbor.CellList(lat_vec, frac_pos, cutoff).pairs()
+    else:
+        pairs = _small_cell_pairs(lat_vec, frac_pos, cutoff)
+
+    found = [(i, j, r, factor*(radii[i] + radii[j])) for i, j, r in pairs]
+    return sorted(found, key=lambda pair: pair[2])
+
+
+def _small_cell_pairs(lat_vec, frac_pos, cutoff):
+    # The minimum image of CellList.pairs misses neighbors when the cell
+    # is thinner than twice the cutoff, so the shortest image of each pair
+    # is taken from the image-aware query instead.
+    found = neighbor.CellList(lat_vec, frac_pos, cutoff)
+
+    for i, pos in enumerate(found.frac_pos):
+        best = {}
+        for j, r, image in found.images(pos):
+            if j < i or (j == i and not any(image)):
+                continue
+            if j not in best or r < best[j]:
+                best[j] = r
+
+        for j in sorted(best):
+            yield i, j, best[j]
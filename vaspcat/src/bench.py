@@ -0,0 +1,353 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from vaspcat.src import formats, poscar, potcar, profiler
+
+# Performance regression gate, the `vaspcat-bench` command.  It converts a
+# fixed set of generated input files, see CASES, and times each step of
+# the conversion:
+#
+#    Cif.read, Cif.parse, Pdb.read, Pdb.parse   format class methods
+#    Convert.output                             read, parse and POSCAR
+#    Convert.output/expand, .../format, ...     profiler stages inside it
+#    potcar.main                                POTCAR assembly
+#
+# The POTCAR files are stubs of a typical size written next to the inputs,
+# see potcar.use, so potcar.main is timed without the licensed files.
+#
+# Every case is run once to warm up imports and caches, then `repeat`
+# times.  The timed runs go round the cases in turn, so a slow spell of the
+# machine is spread over all cases and shows up in their scatter instead
+# of slowing down one case.  A step is summarized by the median of its
+# times and their median absolute deviation (MAD), which unlike the mean
+# and standard deviation are not thrown off by a single run that was
+# descheduled.  Results can be saved as a baseline JSON file and later runs
+# compared with it:
+#
+#    {"version": 1, "python": "3.11.4", "machine": "x86_64", "repeat": 7,
+#     "cases": {"cif_small": {"Cif.read": {"median": 0.00021,
+#                                          "mad": 0.00001, "min": ...}}}}
+#
+# A step is slower when its median grew by more than the largest of
+#
+#    threshold * baseline median     relative change that matters
+#    noise * larger of the two MADs  run-to-run scatter on this machine
+#    MIN_TIME                        timer resolution and scheduling
+#
+# and faster when it shrank by as much.  The command exits with status 1
+# if any step is slower, or missing from a run that has its case, so it
+# can guard a CI job.  Baselines are only comparable on the machine and
+# Python version they were measured with; benchmarks/baseline.json is one
+# for the reference machine, refreshed with --save.
+
+REPEAT = 7
+THRESHOLD = 0.25
+NOISE = 3.0
+
+# Differences in seconds below which a step is never flagged.
+MIN_TIME = 1e-3
+
+VERSION = 1
+
+
+def _cif(symbol, a, sites) -> 'Text of a cubic cif file':
+    lines = ['data_bench',
+             '_cell_length_a {0}'.format(a),
+             '_cell_length_b {0}'.format(a),
+             '_cell_length_c {0}'.format(a),
+             '_cell_angle_alpha 90',
+             '_cell_angle_beta 90',
+             '_cell_angle_gamma 90',
+             "_symmetry_space_group_name_H-M '{0}'".format(symbol),
+             'loop_',
+             '_atom_site_label',
+             '_atom_site_type_symbol',
+             '_atom_site_fract_x',
+             '_atom_site_fract_y',
+             '_atom_site_fract_z']
+    lines.extend('{0}{1} {0} {2:.6f} {3:.6f} {4:.6f}'.format(name, i + 1,
+                                                          *pos)
+                 for i, (name, pos) in enumerate(sites))
+    return '\n'.join(lines) + '\n'
+
+
+def _random_sites(names, count, seed) -> 'List of (name, position)':
+    rng = random.Random(seed)
+    return [(names[i % len(names)], [rng.random() for _ in range(3)])
+            for i in range(count)]
+
+
+def _pdb(count, a, seed) -> 'Text of a pdb file of water-like atoms':
+    rng = random.Random(seed)
+    lines = ['CRYST1{0:9.3f}{0:9.3f}{0:9.3f}{1:7.2f}{1:7.2f}{1:7.2f} P 1'
+             .format(a, 90)]
+    for i in range(count):
+        name = ' O  ' if i % 3 == 0 else ' H  '
+        x, y, z = (rng.random()*a for _ in range(3))
+        lines.append('ATOM  {0:5d} {1} HOH A{2:4d}    {3:8.3f}{4:8.3f}'
+                     '{5:8.3f}  1.00  0.00'.format(i % 100000, name,
+                                                   i//3 % 10000, x, y, z))
+    return '\n'.join(lines) + '\nEND\n'
+
+
+def _potcar(name, lines=2500) -> 'Text of a stub atomic POTCAR file':
+    # About the size of a real PAW POTCAR, which is what the copy costs.
+    rng = random.Random(name)
+    out = ['  PAW_PBE {0} 00Jan0000'.format(name)]
+    out.extend('  ' + '  '.join('{0:.8E}'.format(rng.uniform(-1, 1))
+                                for _ in range(5)) for _ in range(lines))
+    out.append(' End of Dataset')
+    return '\n'.join(out) + '\n'
+
+
+# Species of the cases below, which get stub POTCAR files.
+SPECIES = ('Na', 'Cl', 'Si', 'O', 'H')
+
+# The benchmark set: file name and a function returning its content.
+CASES = OrderedDict([
+    ('cif_small', ('nacl.cif', lambda: _cif(
+        'F m -3 m', 5.64, [('Na', [0, 0, 0]), ('Cl', [0.5, 0.5, 0.5])]))),
+    ('cif_symmetry', ('general.cif', lambda: _cif(
+        'F m -3 m', 12.0, _random_sites(['Si', 'O', 'O'], 6, 1)))),
+    ('cif_large', ('p1.cif', lambda: _cif(
+        'P 1', 30.0, _random_sites(['Si', 'O', 'O'], 3000, 2)))),
+    ('pdb_large', ('water.pdb', lambda: _pdb(6000, 40.0, 3))),
+])
+
+
+def run_case(path, ext, outdir) -> 'Dictionary of step times in seconds':
+    '''Converts one file, timing each step, see the module comment.'''
+
+    fmt = formats.load(ext)
+    times = OrderedDict()
+
+    def timed(name, func, *args):
+        start = time.perf_counter()
+        out = func(*args)
+        times[name] = time.perf_counter() - start
+        return out
+
+    data = timed(fmt.__name__ + '.read', fmt.read, path)
+    timed(fmt.__name__ + '.parse', fmt.parse, data)
+
+    profiler.reset()
+    profiler.enable()
+    try:
+        atom_list = timed('Convert.output',
+                          poscar.Convert(path, ext).output, outdir)
+    finally:
+        profiler.disable()
+
+    for name, record in sorted(profiler.report()['stages'].items()):
+        times['Convert.output/' + name] = record['wall']
+
+    timed('potcar.main', potcar.main, outdir, atom_list)
+
+    return times
+
+
+def measure(names=None, repeat=REPEAT) -> 'Results dictionary':
+    '''Runs the benchmark cases and summarizes their step times.
+
+    Args:
+        names: Cases to run, default all of CASES.
+        repeat: Number of timed runs per case, after one warm-up run.
+
+    Returns:
+        A dictionary in the baseline form of the module comment.
+    '''
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in SPECIES:
+            folder = os.path.join(tmp, 'potext', name)
+            os.makedirs(folder)
+            with open(os.path.join(folder, 'POTCAR'), 'w') as f:
+                f.write(_potcar(name))
+
+        previous = potcar.use(os.path.join(tmp, 'potext'))
+        try:
+            samples = _measure(tmp, names, repeat)
+        finally:
+            potcar.use(previous)
+
+    cases = OrderedDict(
+        (name, OrderedDict((step, summary(walls))
+                           for step, walls in steps.items()))
+        for name, steps in samples.items())
+
+    return {'version': VERSION, 'python': platform.python_version(),
+            'machine': platform.machine(), 'repeat': repeat, 'cases': cases}
+
+
+def _measure(tmp, names, repeat) -> 'Step times by case and step':
+    jobs, samples = OrderedDict(), OrderedDict()
+
+    for name in names or CASES:
+        filename, content = CASES[name]
+        path = os.path.join(tmp, filename)
+        with open(path, 'w') as f:
+            f.write(content())
+
+        outdir = os.path.join(tmp, name)
+        os.makedirs(outdir)
+        jobs[name] = path, os.path.splitext(filename)[1][1:], outdir
+        samples[name] = OrderedDict()
+        run_case(*jobs[name])
+
+    for _ in range(repeat):
+        for name, job in jobs.items():
+            for step, wall in run_case(*job).items():
+                samples[name].setdefault(step, []).append(wall)
+
+    return samples
+
+
+def summary(walls) -> 'Dictionary of median, MAD and minimum':
+    median = statistics.median(walls)
+    mad = statistics.median(abs(wall - median) for wall in walls)
+    return {'median': round(median, 7), 'mad': round(mad, 7),
+            'min': round(min(walls), 7)}
+
+
+def compare(baseline, current, threshold=THRESHOLD,
+            noise=NOISE) -> 'List of (case, step, old, new, status)':
+    '''Compares the step medians of two results dictionaries.
+
+    Returns:
+        One row per step of the current results.  old is None for steps
+        that are not in the baseline, and status is 'slower', 'faster',
+        'ok' or 'new'.  Steps only in the baseline are listed with new
+        None and status 'missing'.
+    '''
+
+    rows = []
+    for case, steps in current['cases'].items():
+        base = baseline['cases'].get(case, {})
+
+        for step, now in steps.items():
+            old = base.get(step)
+            if old is None:
+                rows.append((case, step, None, now['median'], 'new'))
+                continue
+
+            change = now['median'] - old['median']
+            margin = max(threshold*old['median'],
+                         noise*max(old['mad'], now['mad']), MIN_TIME)
+            status = ('slower' if change > margin else
+                      'faster' if -change > margin else 'ok')
+            rows.append((case, step, old['median'], now['median'], status))
+
+        rows.extend((case, step, old['median'], None, 'missing')
+                    for step, old in base.items() if step not in steps)
+
+    return rows
+
+
+def table(rows, stream=sys.stdout):
+    '''Prints compare rows as an aligned table.'''
+
+    def ms(value):
+        return '-' if value is None else '{0:.3f} ms'.format(value*1000)
+
+    stream.write('{0:<14}{1:<30}{2:>13}{3:>13}{4:>9}  {5}\n'.format(
+        'case', 'step', 'baseline', 'current', 'change', 'status'))
+
+    for case, step, old, new, status in rows:
+        change = ''
+        if old and new is not None:
+            change = '{0:+.1f}%'.format(100*(new - old)/old)
+        stream.write('{0:<14}{1:<30}{2:>13}{3:>13}{4:>9}  {5}\n'.format(
+            case, step, ms(old), ms(new), change, status))
+
+
+def main(argv=None):
+    '''Entry point of the vaspcat-bench command.'''
+
+    parser = argparse.ArgumentParser(
+        prog='vaspcat-bench',
+        description='Time the vaspcat benchmark set, and compare it with '
+                    'a stored baseline.  Exits with status 1 if any step '
+                    'became slower or was not run.'
+    )
+    parser.add_argument(
+        '--compare', metavar='FILE',
+        help='baseline JSON file to compare the results with'
+    )
+    parser.add_argument(
+        '--save', metavar='FILE',
+        help='write the results as a baseline JSON file'
+    )
+    parser.add_argument(
+        '--case', action='append', choices=list(CASES), dest='cases',
+        help='only run this case (repeatable, default: all)'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=REPEAT, metavar='N',
+        help='timed runs per case (default: %(default)d)'
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=100*THRESHOLD, metavar='PERCENT',
+        help='smallest relative change of a median that counts '
+             '(default: %(default)g)'
+    )
+    parser.add_argument(
+        '--noise', type=float, default=NOISE, metavar='K',
+        help='smallest change that counts, in median absolute deviations '
+             'of the step times (default: %(default)g)'
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR, format='%(message)s')
+
+    baseline = None
+    if args.compare:
+        try:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            if baseline.get('version') != VERSION:
+                raise ValueError('unknown version {0!r}'.format(
+                    baseline.get('version')))
+        except (OSError, ValueError) as err:
+            sys.stderr.write('Cannot read the baseline {0} ({1}).\n'
+                             .format(args.compare, err))
+            sys.exit(2)
+
+    current = measure(args.cases, max(args.repeat, 1))
+
+    if baseline is None:
+        baseline = {'cases': {}}
+    elif (baseline.get('python'), baseline.get('machine')) != \
+            (current['python'], current['machine']):
+        sys.stderr.write('Warning: the baseline was measured with Python '
+                         '{0} on {1}, this run uses Python {2} on {3}.\n'
+                         .format(baseline.get('python'),
+                                 baseline.get('machine'),
+                                 current['python'], current['machine']))
+
+    rows = compare(baseline, current, args.threshold/100, args.noise)
+    table(rows)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=1)
+            f.write('\n')
+
+    failed = False
+    for status, text in (('slower', 'are slower than the baseline'),
+                         ('missing', 'of the baseline were not run')):
+        found = [row for row in rows if row[4] == status]
+        if found:
+            failed = True
+            sys.stderr.write('{0} steps {1}: {2}\n'.format(
+                len(found), text, ', '.join('{0} {1}'.format(*row[:2])
+                                            for row in found)))
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,209 @@
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Persistent cache of parsed structures.  Parameter sweeps convert the same
+# structure library over and over, and for cif files most of the time goes
+# into reading the file and expanding the symmetry operations.  The cache
+# stores the parse() 4-tuple of each file in an SQLite database, keyed by
+#
+#    sha256(file bytes) : format class : format version
+#
+# so an edited file, a different parser or a parser whose output changed
+# (signalled by bumping the 'version' attribute of its class) all miss.
+# Only parse output is stored; transforms such as --primitive run on every
+# conversion, so one cache entry serves any combination of them.
+#
+# The database is capped at a size in bytes of stored data.  When a new
+# entry pushes it over the limit, the least recently used entries are
+# removed until it is back under 90% of the limit.  The running total of
+# the sizes is kept in the meta table by triggers, so every process writing
+# to the database sees the same total without summing the entries.
+
+SCHEMA = ['''CREATE TABLE IF NOT EXISTS structure (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+)''', '''CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+)''', '''CREATE TRIGGER IF NOT EXISTS structure_insert
+AFTER INSERT ON structure BEGIN
+    UPDATE meta SET value = value + NEW.size WHERE name = 'size';
+END''', '''CREATE TRIGGER IF NOT EXISTS structure_delete
+AFTER DELETE ON structure BEGIN
+    UPDATE meta SET value = value - OLD.size WHERE name = 'size';
+END''']
+
+# Default location, following the XDG base directory convention.
+DEFAULT_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'vaspcat', 'parse.sqlite')
+
+DEFAULT_SIZE = 512*1024**2
+
+# Size of the blocks read when hashing a file.
+BLOCK_SIZE = 1024**2
+
+# SQLite connections must not be used by two threads at once, nor after a
+# fork, so each thread keeps its own, keyed by process id, thread id and
+# database file.  A forked child never finds the connections of its parent
+# under its own process id.  They are left alone rather than closed, since
+# closing them there would drop the parent's locks on the database.
+# Cache.close closes all the connections of the calling process once its
+# threads are done with them.
+_connections = {}
+_lock = threading.Lock()
+
+
+class Cache(object):
+    '''SQLite store of parsed structures, see the module comment.'''
+
+    def __init__(self, path=DEFAULT_PATH, max_size=DEFAULT_SIZE):
+        '''Initialize the cache.  The database is opened on first use.
+
+        Args:
+            path: Database file.  Missing folders are created.
+            max_size: Limit in bytes of the stored data.
+        '''
+
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+
+    @property
+    def db(self) -> 'sqlite3 connection of the calling thread':
+        key = os.getpid(), threading.get_ident(), self.path
+        db = _connections.get(key)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            # Each connection is only used by its own thread, but close
+            # may be called from another one.
+            db = sqlite3.connect(self.path, timeout=30,
+                                 isolation_level=None,
+                                 check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+
+            # INSERT OR REPLACE deletes the old row of a key, which only
+            # fires the delete trigger with recursive triggers on.
+            db.execute('PRAGMA recursive_triggers=ON')
+
+            # The total is seeded once, for databases made before the
+            # meta table existed.
+            with db:
+                db.execute('BEGIN IMMEDIATE')
+                for statement in SCHEMA:
+                    db.execute(statement)
+                db.execute("INSERT OR IGNORE INTO meta "
+                           "SELECT 'size', TOTAL(size) FROM structure "
+                           "WHERE NOT EXISTS "
+                           "(SELECT 1 FROM meta WHERE name = 'size')")
+            with _lock:
+                _connections[key] = db
+
+        return db
+
+    @staticmethod
+    def key(path, fmt) -> 'Cache key string':
+        '''Returns the key of a file read by the format class fmt.'''
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                digest.update(block)
+
+        return '{0}:{1}.{2}:{3}'.format(digest.hexdigest(), fmt.__module__,
+                                        fmt.__qualname__,
+                                        getattr(fmt, 'version', 0))
+
+    def get(self, key) -> 'Cached parse() 4-tuple, or None':
+        try:
+            row = self.db.execute('SELECT data FROM structure WHERE key = ?',
+                                  (key,)).fetchone()
+            if row is None:
+                return None
+
+            self.db.execute('UPDATE structure SET used = ? WHERE key = ?',
+                            (time.time(), key))
+            return pickle.loads(row[0])
+
+        except (sqlite3.Error, pickle.UnpicklingError) as err:
+            # A broken cache only costs the time of parsing the file.
+            logger.warning('Parse cache lookup failed (%s).', err)
+            return None
+
+    def put(self, key, structure):
+        '''Stores a parse() 4-tuple and evicts old entries if needed.'''
+
+        data = pickle.dumps(structure, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_size:
+            return
+
+        try:
+            self.db.execute('INSERT OR REPLACE INTO structure '
+                            'VALUES (?, ?, ?, ?)',
+                            (key, data, len(data), time.time()))
+            self.evict()
+
+        except sqlite3.Error as err:
+            logger.warning('Could not store %s in the parse cache (%s).',
+                           key, err)
+
+    def evict(self):
+        '''Removes least recently used entries while over max_size.'''
+
+        total = self.db.execute("SELECT value FROM meta "
+                                "WHERE name = 'size'").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        target, removed = total - 0.9*self.max_size, 0
+        rows = self.db.execute('SELECT key, size FROM structure '
+                               'ORDER BY used').fetchall()
+        stale = []
+        for key, size in rows:
+            if removed >= target:
+                break
+            stale.append((key,))
+            removed += size
+
+        self.db.executemany('DELETE FROM structure WHERE key = ?', stale)
+        logger.debug('Evicted %d entries from the parse cache.', len(stale))
+
+    def check(self):
+        '''Opens the database and closes it again.
+
+        Reports a database that cannot be opened before any file is
+        converted, without leaving a connection open for worker processes
+        to inherit.
+
+        Exceptions:
+            OSError, sqlite3.Error: Occur when the database cannot be
+                                    created or opened.
+        '''
+
+        self.db
+        self.close()
+
+    def close(self):
+        '''Closes the connections of every thread of this process.
+
+        Call it once the threads using the cache are done, e.g. after a
+        thread pool has been shut down.
+        '''
+
+        pid = os.getpid()
+        with _lock:
+            keys = [key for key in _connections
+                    if key[0] == pid and key[2] == self.path]
+            found = [_connections.pop(key) for key in keys]
+
+        for db in found:
+            db.close()
@@ -0,0 +1,49 @@
+import builtins
+import bz2
+import gzip
+import lzma
+import os
+
+# Compressed input files, e.g. NaCl.cif.gz.  The compression suffix is
+# dropped when a file is matched to a format, so NaCl.cif.gz is read as a
+# cif file, and open() decompresses while the file is being read, so the
+# inflated content never goes to disk and is never held in memory as a
+# whole by the streaming readers.
+
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+
+def split(path) -> '(path without compression suffix, suffix or "")':
+    '''Separates a compression suffix from a file name.'''
+
+    root, suffix = os.path.splitext(path)
+    if suffix.lower() in OPENERS:
+        return root, suffix.lower()
+
+    return path, ''
+
+
+def extension(path) -> 'Lower case format extension, without the dot':
+    '''Returns the extension of path, ignoring a compression suffix.'''
+
+    return os.path.splitext(split(path)[0])[1][1:].lower()
+
+
+def compressed(path) -> 'True if path has a compression suffix':
+    return bool(split(path)[1])
+
+
+def open(path, mode='r'):
+    '''Opens a file, decompressing it on the fly if it is compressed.
+
+    Args:
+        path: File to open.
+        mode: 'r' or 'r+' for text, 'rb' for bytes.  Compressed files are
+              always opened read-only.
+    '''
+
+    suffix = split(path)[1]
+    if not suffix:
+        return builtins.open(path, mode)
+
+    return OPENERS[suffix](path, 'rb' if 'b' in mode else 'rt')
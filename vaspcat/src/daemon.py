@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import socket
+import sys
+
+# Long-running conversion server.  A command line run spends most of its
+# time on Python startup and on importing pkg_resources and the space group
+# tables before it converts a single file.  `vaspcat --serve` pays that once:
+# it imports everything, starts a pool of worker processes that do the same,
+# and keeps the POTCAR files and symmetry tables in memory.  Conversion
+# requests then arrive over a Unix domain socket, one JSON object per line:
+#
+#    {"directory": "/work/run1", "path": "/work/run1/NaCl.cif",
+#     "args": ["--primitive"], "batch": false}
+#
+# 'args' are vaspcat command line options, applied to this request only.
+# Without 'path' the first convertable file in 'directory' is used, as in
+# a plain vaspcat run.  With 'batch', the files go to a folder named after
+# the input, as with --batch.  Every request gets one JSON line back:
+#
+#    {"status": "ok", "path": ..., "output": ..., "species": ["Na", "Cl"],
+#     "error": null, "wall": 0.004}
+#
+# With --duplicates and a --fingerprints file shared by the requests, a
+# structure converted before gets "status": "duplicate" and "duplicate_of".
+#
+# {"command": "ping"} and {"command": "shutdown"} are also understood.
+#
+# This module is also the `vaspcat-client` command, so it only imports the
+# standard library at module level; the client starts in milliseconds.
+
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+    'vaspcat-{0}.sock'.format(os.getuid() if hasattr(os, 'getuid') else 0))
+
+
+def serve(path=DEFAULT_SOCKET, workers=None):
+    '''Accepts conversion requests on the Unix socket path until shutdown.
+
+    Args:
+        path: Socket file.  A stale file left by an earlier server is
+              replaced, but not the socket of a server still running;
+              the socket is only accessible to the current user.
+        workers: Number of conversion processes.  Defaults to the CPU
+                 count.  With 1, conversions run in threads of the server.
+    '''
+
+    import logging
+    import socketserver
+    import threading
+    from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, \
+        ThreadPoolExecutor
+
+    logger = logging.getLogger(__name__)
+
+    if os.path.exists(path):
+        try:
+            request({'command': 'ping'}, path)
+        except OSError:
+            # Nothing accepts connections, so the file is left over from
+            # a server that did not shut down cleanly.
+            os.unlink(path)
+        else:
+            logger.error('A vaspcat server is already listening on %s.',
+                         path)
+            sys.exit(1)
+
+    _warm()
+    workers = workers or os.cpu_count() or 1
+
+    def start():
+        if workers == 1:
+            return ThreadPoolExecutor(1)
+        return ProcessPoolExecutor(workers, initializer=_warm)
+
+    # A worker that dies, e.g. killed for running out of memory, breaks
+    # the whole process pool.  The requests it held fail, and the first
+    # handler to notice replaces the pool for the requests that follow.
+    pools, lock = [start()], threading.Lock()
+
+    def run(request):
+        pool = pools[0]
+        try:
+            return pool.submit(convert, request).result()
+        except BrokenExecutor as err:
+            with lock:
+                if pools[0] is pool:
+                    logger.warning('A conversion worker died (%s); '
+                                   'restarting the workers.', err)
+                    pool.shutdown(wait=False)
+                    pools[0] = start()
+            return {'status': 'error', 'path': request.get('path'),
+                    'output': None, 'species': [], 'error':
+                    'The conversion worker died: {0}'.format(err)}
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                except ValueError as err:
+                    reply = {'status': 'error', 'error':
+                             'Bad request: {0}'.format(err)}
+                else:
+                    command = request.get('command', 'convert')
+                    if command == 'shutdown':
+                        self.reply({'status': 'ok'})
+                        # shutdown() waits for serve_forever to return,
+                        # so it cannot be called from this thread.
+                        threading.Thread(target=server.shutdown).start()
+                        return
+                    elif command == 'ping':
+                        reply = {'status': 'ok', 'pid': os.getpid()}
+                    else:
+                        reply = run(request)
+                self.reply(reply)
+
+        def reply(self, fields):
+            self.wfile.write(json.dumps(fields).encode() + b'\n')
+            self.wfile.flush()
+
+    # The socket file is created with mode 0600, so there is no moment
+    # at which other users could connect to it.
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+
+    logger.info('Listening on %s with %d workers.', path, workers)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        pools[0].shutdown()
+        if os.path.exists(path):
+            os.unlink(path)
+    logger.info('Server stopped.')
+
+
+def _warm():
+    # Imports and caches that a command line run pays on every call.
+    from vaspcat import application
+    from vaspcat.extend import posext, spacegroup
+    from vaspcat.src import formats, potcar
+
+    potcar.keep()
+    for ext in formats.extensions():
+        formats.load(ext)
+
+
+def convert(request) -> 'Reply dictionary':
+    '''Converts the file of one request, see the module comment.
+
+    Errors, including invalid options, are returned in the reply rather
+    than raised, so one bad request does not affect the server.
+    '''
+
+    from vaspcat import application
+    from vaspcat.src import compress, duplicates, formats, log, poscar, \
+        potcar
+
+    reply = {'status': 'ok', 'path': request.get('path'), 'output': None,
+             'species': [], 'error': None}
+    opts = None
+
+    with log.Timer() as timer:
+        try:
+            args = _parse_args(request.get('args', []))
+            opts = application.options(args)
+            directory = request['directory']
+
+            path = request.get('path')
+            if path is None:
+                try:
+                    source = poscar.find(directory, poscar.supported())
+                except SystemExit:
+                    # poscar.find logs the error and exits.
+                    raise ValueError('No convertable files were found in '
+                                     '{0}.'.format(directory))
+            else:
+                ext = compress.extension(path)
+                if ext not in poscar.supported():
+                    ext = formats.sniff(path)
+                    if ext is None:
+                        raise ValueError('{0} is not in a supported format.'
+                                         .format(path))
+                source = (path, ext)
+
+            outdir = directory
+            if request.get('batch'):
+                outdir = application.output_dir(directory, source[0])
+                os.makedirs(outdir, exist_ok=True)
+
+            reply['path'], reply['output'] = source[0], outdir
+            reply['species'] = poscar.main(outdir, source, **opts)
+            potcar.main(outdir, reply['species'])
+
+        except duplicates.Duplicate as dup:
+            reply['status'] = 'duplicate'
+            reply['duplicate_of'] = dup.original
+        except Exception as err:
+            reply['status'] = 'error'
+            reply['error'] = '{0}: {1}'.format(type(err).__name__, err)
+        finally:
+            if opts is not None and opts['duplicates'] is not None:
+                opts['duplicates'].close()
+            if opts is not None and opts['cache'] is not None:
+                opts['cache'].close()
+
+    reply['wall'] = round(timer.wall, 6)
+    return reply
+
+
+def _parse_args(argv) -> 'argparse.Namespace of vaspcat options':
+    # argparse prints its error to stderr and exits, which would leave the
+    # client without the reason.  The message is returned as a ValueError.
+    import contextlib
+    import io
+    from vaspcat import application
+
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(stderr):
+            return application.parse_args(argv)
+    except SystemExit:
+        lines = stderr.getvalue().strip().splitlines()
+        raise ValueError(lines[-1] if lines else 'Invalid options.')
+
+
+def request(fields, path=DEFAULT_SOCKET) -> 'Reply dictionary':
+    '''Sends one request to a running server and returns its reply.'''
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        f = sock.makefile('rwb')
+        f.write(json.dumps(fields).encode() + b'\n')
+        f.flush()
+        line = f.readline()
+
+    # A server that stops while handling the request closes the socket
+    # without replying.  This is reported like a server that is not
+    # running at all.
+    if not line:
+        raise ConnectionError('The server closed the connection without '
+                              'a reply.')
+    return json.loads(line)
+
+
+def client(argv=None):
+    '''Entry point of the vaspcat-client command.'''
+
+    parser = argparse.ArgumentParser(
+        prog='vaspcat-client',
+        description='Convert files with a running vaspcat --serve process. '
+                    'Options not listed here are passed on as vaspcat '
+                    'options, e.g. --primitive.'
+    )
+    parser.add_argument(
+        'files', nargs='*', metavar='FILE',
+        help='files to convert; several files are written to one folder '
+             'each, as with --batch (default: first file found here)'
+    )
+    parser.add_argument(
+        '--socket', default=DEFAULT_SOCKET,
+        help='socket of the server (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--shutdown', action='store_true',
+        help='stop the server'
+    )
+    args, options = parser.parse_known_args(argv)
+
+    try:
+        if args.shutdown:
+            request({'command': 'shutdown'}, args.socket)
+            return
+
+        directory, failed = os.getcwd(), 0
+        for path in args.files or [None]:
+            reply = request({'directory': directory, 'args': options,
+                             'path': path and os.path.abspath(path),
+                             'batch': len(args.files) > 1}, args.socket)
+            if reply['status'] not in ('ok', 'duplicate'):
+                failed += 1
+                sys.stderr.write('Could not convert {0} ({1})\n'.format(
+                    reply.get('path') or directory, reply['error']))
+
+    except OSError as err:
+        sys.stderr.write('Cannot reach the vaspcat server at {0} ({1}).  '
+                         'Start it with vaspcat --serve.\n'
+                         .format(args.socket, err))
+        sys.exit(2)
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl.  Saves are still atomic there, but runs that
+    # close at the same moment can drop each other's new entries.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Index of the structures converted in a batch, keyed by the fingerprints
+# of extend/fingerprint.py.  Before a structure is written, its fingerprint
+# is looked up; if an earlier file of the batch had the same one, the
+# structure is not written again and Duplicate is raised instead.  With the
+# 'link' mode, its output folder is first made a link to the folder of the
+# earlier file, so every input still has a folder to run VASP from.
+#
+# The index can be saved as a JSON object mapping each fingerprint to the
+# output folder it was first written to, and loaded again by later runs:
+#
+#    {"Cl1Na1:9f2c...": "/work/run1/NaCl", ...}
+#
+# Several runs may share one file.  Saving takes an exclusive lock on a
+# '.lock' file next to it, loads the entries other runs saved in the
+# meantime, adds the new ones and replaces the file in one rename, so a
+# reader never sees a partly written index and no run loses entries.
+#
+# Only single structures are checked; the frames of trajectories are always
+# written.
+
+MODES = ('skip', 'link')
+
+
+class Duplicate(Exception):
+    '''Raised in place of writing a structure that was converted before.'''
+
+    def __init__(self, outdir, original):
+        super().__init__('{0} is a duplicate of {1}.'.format(outdir,
+                                                            original))
+        self.outdir = outdir
+        self.original = original
+
+
+class Index(object):
+    '''Fingerprints of converted structures, see the module comment.'''
+
+    def __init__(self, mode='skip', path=None):
+        '''Initialize the index, loading path if it exists.
+
+        Args:
+            mode: 'skip' to leave duplicates out, or 'link' to link their
+                  output folder to the one written first.
+            path: Optional JSON file the index is loaded from and saved to
+                  by close.
+        '''
+
+        if mode not in MODES:
+            raise ValueError('Unknown duplicate mode {0!r}.'.format(mode))
+
+        self.mode = mode
+        self.path = path
+        self.seen = {}
+        self.found = 0
+        self.lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.seen = json.load(f)
+            logger.debug('Loaded %d fingerprints from %s.', len(self.seen),
+                         path)
+
+    def check(self, outdir, structure, sink):
+        '''Records the structure for outdir, unless it is a duplicate.
+
+        Args:
+            outdir: Folder the structure is about to be written to.
+            structure: 4-tuple from Convert.build.  Structures without
+                       info['fingerprint'] are never duplicates.
+            sink: Sink the files are written to, see sink.py.
+
+        Exceptions:
+            Duplicate: Occurs when another folder holds the structure.
+        '''
+
+        key = structure[3].get('fingerprint')
+        if key is None:
+            return
+
+        with self.lock:
+            original = self.seen.setdefault(key, outdir)
+            if original == outdir:
+                return
+            self.found += 1
+
+        if self.mode == 'link':
+            sink.link(outdir, original)
+        raise Duplicate(outdir, original)
+
+    def close(self):
+        '''Saves the index to its file, if it has one.
+
+        Entries saved by other runs since this one started are kept; if
+        both found the same structure, the folder saved first is kept.
+        '''
+
+        if self.path is None:
+            return
+
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+
+        with self.lock, _locked(self.path + '.lock'):
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    saved = json.load(f)
+                for key, outdir in self.seen.items():
+                    saved.setdefault(key, outdir)
+                self.seen = saved
+
+            fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.seen, f, indent=1, sort_keys=True)
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+
+@contextmanager
+def _locked(path):
+    # Holds an exclusive lock on path, which is created if needed.  The
+    # lock is released when the file is closed.
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
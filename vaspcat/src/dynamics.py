@@ -0,0 +1,78 @@
+from vaspcat.extend import neighbor
+
+# Selective dynamics flags for the POSCAR.  A rule is a tuple naming the
+# atoms it fixes:
+#
+#    ('all',)                       every atom
+#    ('below', z)                   fractional height below z
+#    ('species', 'O', 'H', ...)     atoms of the listed species
+#    ('near', (x, y, z), r)         within r Angstrom of the fractional
+#                                   point (x, y, z), periodic
+#
+# For 'near', rounding the fractional difference to the nearest integer
+# only gives the nearest image in orthogonal cells; in a skewed cell, such
+# as a slab with a tilted c axis, another image can be closer.  The images
+# within r are instead searched with a cell list, see neighbor.py, which
+# finds all of them for any radius and cell shape.
+#
+# Each rule is evaluated over the whole coordinate list into a mask of
+# booleans, and an atom is fixed (F F F) if any mask selects it; all other
+# atoms relax (T T T).  Rules are plain tuples so they can be sent to the
+# parsing processes of the batch pipeline.
+#
+# The default keeps the behavior of earlier versions, which fixed every
+# atom.  None instead of a list of rules leaves out the Selective Dynamics
+# block, so VASP relaxes every atom.
+
+DEFAULT = [('all',)]
+
+FIXED, FREE = 'F F F', 'T T T'
+
+
+def mask(rule, lat_vec, atom_info, frac_pos) -> 'List of booleans':
+    '''Returns True for every atom fixed by one rule.
+
+    Exceptions:
+        ValueError: Occurs for an unknown rule name.
+    '''
+
+    kind, args = rule[0], rule[1:]
+
+    if kind == 'all':
+        return [True]*len(frac_pos)
+
+    if kind == 'below':
+        return [pos[2] < args[0] for pos in frac_pos]
+
+    if kind == 'species':
+        return [name in args for name, count in atom_info
+                for _ in range(count)]
+
+    if kind == 'near':
+        point, radius = args
+        grid = neighbor.CellList(lat_vec, frac_pos, radius)
+        near = {n for n, r, image in grid.images(point)}
+        return [n in near for n in range(len(frac_pos))]
+
+    raise ValueError('Unknown selective dynamics rule {0!r}.'.format(kind))
+
+
+def flags(rules, lat_vec, atom_info,
+          frac_pos) -> 'List of flag strings, or None':
+    '''Returns the selective dynamics flags of every atom.
+
+    Args:
+        rules: List of rules, see the module comment, or None to leave
+               out the Selective Dynamics block.
+        lat_vec, atom_info, frac_pos: Structure being written.
+    '''
+
+    if rules is None:
+        return None
+
+    fixed = [False]*len(frac_pos)
+    for rule in rules:
+        fixed = [a or b for a, b in
+                 zip(fixed, mask(rule, lat_vec, atom_info, frac_pos))]
+
+    return [FIXED if f else FREE for f in fixed]
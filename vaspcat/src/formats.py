@@ -0,0 +1,167 @@
+import importlib
+import re
+from vaspcat.src import compress
+
+# Registry of the input formats vaspcat can convert.  A format is a class
+# with static read(file) and parse(data) methods, like those in posext.py,
+# registered under the file extension it handles.  Formats are listed by
+# name only; the module defining a format is imported the first time a
+# file of that format is converted, so a run over pdb files never loads
+# the cif space group tables.
+#
+# Other packages add formats through the 'vaspcat.formats' entry point
+# group, e.g. in their setup.py:
+#
+#    entry_points = {
+#        'vaspcat.formats': ['xsf = mypackage.readers:Xsf']
+#    }
+#
+# A format class may define a 'signature' attribute, a bytes regular
+# expression matched against the start of a file, so files without a
+# known extension can still be recognised by their content.
+
+GROUP = 'vaspcat.formats'
+
+# Formats shipped with vaspcat, with the content signatures used for files
+# whose extension is not registered.  Entry points of the same name take
+# precedence.
+BUILTIN = {
+    'cif': ('vaspcat.extend.posext:Cif', rb'(?:#\\#CIF|data_)'),
+    'pdb': ('vaspcat.extend.posext:Pdb',
+            rb'(?:HEADER|CRYST1|REMARK|ATOM  |HETATM)'),
+    'xyz': ('vaspcat.extend.posext:Xyz', rb'\d+[ \t]*\r?\n[^\n]*Lattice='),
+    'extxyz': ('vaspcat.extend.posext:Xyz',
+               rb'\d+[ \t]*\r?\n[^\n]*Lattice='),
+    'xdatcar': ('vaspcat.extend.posext:Xdatcar',
+                rb'[^\n]*\n\s*[-+.\deE]+\s*\n(?:[^\n]*\n){3}\s*[A-Za-z]'
+                rb'[^\n]*\n[\d \t]+\r?\n\s*Direct configuration'),
+}
+
+# Number of bytes read from a file when matching content signatures.
+SNIFF_SIZE = 4096
+
+_registry = None
+
+
+class Format(object):
+    '''A registered format whose class is imported on first use.'''
+
+    def __init__(self, name, target, signature=None):
+        '''Initialize the registry entry.
+
+        Args:
+            name: Lower case file extension handled by the format.
+            target: 'module:Class' string, or the class itself.
+            signature: Optional bytes regular expression matched at the
+                       start of a file.  If not given, the class attribute
+                       of the same name is used once the class is loaded.
+        '''
+
+        self.name = name
+        self.target = target
+        self.signature = signature
+
+    def load(self) -> 'Format class with read and parse methods':
+        if isinstance(self.target, str):
+            module, attr = self.target.split(':')
+            self.target = getattr(importlib.import_module(module), attr)
+
+        return self.target
+
+    def matches(self, head) -> 'True if head looks like this format':
+        signature = self.signature
+        if signature is None:
+            signature = getattr(self.load(), 'signature', None)
+        if signature is None:
+            return False
+
+        return re.match(rb'\s*' + signature, head) is not None
+
+
+def registry() -> 'Dictionary of extension to Format':
+    '''Returns the registry, reading the entry points on first call.'''
+
+    global _registry
+    if _registry is not None:
+        return _registry
+
+    _registry = {name: Format(name, target, signature)
+                 for name, (target, signature) in BUILTIN.items()}
+
+    for entry in _entry_points():
+        if entry.name.lower() in BUILTIN:
+            # Keep the builtin signature for vaspcat's own entry points.
+            _registry[entry.name.lower()].target = entry.value
+        else:
+            _registry[entry.name.lower()] = Format(entry.name.lower(),
+                                                   entry.value)
+
+    return _registry
+
+
+def register(name, target, signature=None):
+    '''Adds a format at run time, e.g. from a script or a test.
+
+    Args:
+        name: File extension handled by the format, without the dot.
+        target: The format class, or a 'module:Class' string.
+        signature: Optional bytes regular expression, see Format.
+    '''
+
+    registry()[name.lower()] = Format(name.lower(), target, signature)
+
+
+def extensions() -> 'Sorted list of supported extensions':
+    return sorted(registry())
+
+
+def load(ext) -> 'Format class with read and parse methods':
+    '''Returns the class handling files with extension ext.
+
+    Exceptions:
+        KeyError: Occurs when no format is registered for ext.
+    '''
+
+    return registry()[ext.lower()].load()
+
+
+def sniff(path) -> 'Extension of the matching format, or None':
+    '''Identifies a file by matching the format signatures to its start.
+
+    Builtin formats are tried first, so plugin modules are only imported
+    when none of the builtin signatures match.
+    '''
+
+    with compress.open(path, 'rb') as f:
+        return match(f.read(SNIFF_SIZE))
+
+
+def match(head) -> 'Extension of the matching format, or None':
+    '''Identifies data by matching the format signatures, see sniff.
+
+    Args:
+        head: Bytes from the start of the file or buffer, up to
+              SNIFF_SIZE of them.
+    '''
+
+    formats = sorted(registry().values(),
+                     key=lambda fmt: fmt.name not in BUILTIN)
+
+    for fmt in formats:
+        if fmt.matches(head):
+            return fmt.name
+
+    return None
+
+
+def _entry_points() -> 'Iterable of entry points in GROUP':
+    try:
+        from importlib import metadata
+    except ImportError:
+        return []
+
+    entries = metadata.entry_points()
+    if hasattr(entries, 'select'):
+        return entries.select(group=GROUP)
+
+    return entries.get(GROUP, [])
@@ -0,0 +1,83 @@
+import json
+import logging
+import sys
+import time
+
+# Progress and error messages go through the 'vaspcat' logger hierarchy
+# (vaspcat.src.poscar, vaspcat.src.potcar, ...), which setup() points at
+# stderr.  Machine-readable events go through the separate 'vaspcat.events'
+# logger, which does not propagate, so orchestration tools reading the
+# JSON-lines stream never see the human-readable messages and vice versa.
+
+events = logging.getLogger('vaspcat.events')
+events.propagate = False
+events.setLevel(logging.INFO)
+
+
+class JsonLinesHandler(logging.StreamHandler):
+    '''Writes each event record as one JSON object per line.'''
+
+    def format(self, record):
+        fields = {'event': record.getMessage(),
+                  'time': round(record.created, 6)}
+        fields.update(getattr(record, 'fields', {}))
+        return json.dumps(fields, sort_keys=True)
+
+
+def setup(level=logging.INFO, stream=None, event_path=None):
+    '''Configures vaspcat logging for a command line run.
+
+    Args:
+        level: Level of the human-readable messages written to stream.
+        stream: Where messages are written.  Defaults to stderr, which
+                keeps stdout free for reports such as --profile output.
+        event_path: Optional path of the JSON-lines event stream, or '-'
+                    for stdout.  No events are written if not given.
+
+    Returns:
+        The opened event file, or None.  The caller closes it at exit.
+    '''
+
+    root = logging.getLogger('vaspcat')
+    root.setLevel(level)
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    root.handlers = [handler]
+
+    events.handlers = []
+    if event_path is None:
+        return None
+
+    if event_path == '-':
+        events.addHandler(JsonLinesHandler(sys.stdout))
+        return None
+
+    f = open(event_path, 'a')
+    events.addHandler(JsonLinesHandler(f))
+    return f
+
+
+def event(name, **fields):
+    '''Emits an event on the JSON-lines stream, if one is configured.
+
+    Args:
+        name: Event type, e.g. 'file' or 'run_end'.
+        fields: JSON serializable values stored alongside the event name.
+    '''
+
+    if events.handlers:
+        events.info(name, extra={'fields': fields})
+
+
+class Timer(object):
+    '''Measures wall and CPU time of a block for event reporting.'''
+
+    def __enter__(self):
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.process_time() - self.cpu
+        return False
@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from vaspcat.src import duplicates, log, poscar, potcar, profiler
+
+logger = logging.getLogger(__name__)
+
+# Batch conversion as three overlapping stages:
+#
+#    read  (thread pool)  ->  parse (process pool)  ->  write (thread pool)
+#
+# connected by bounded asyncio queues.  While one file is being parsed the
+# next ones are already being read and earlier ones are being written, so on
+# slow storage the throughput is set by the slowest stage rather than by the
+# sum of all three.  A full queue blocks the stage feeding it, which keeps
+# at most 'depth' files in memory between any two stages.
+
+
+class Job(object):
+    '''State of one input file as it moves through the pipeline.'''
+
+    def __init__(self, source, outdir):
+        self.source = source
+        self.outdir = outdir
+        self.convert = None
+        self.data = self.structure = self.parsed = None
+        self.times = {}
+        self.cpu = 0.0
+        self.start = time.perf_counter()
+
+
+def run(jobs, options=None, workers=None, io_threads=4,
+        depth=8) -> 'Number of files that could not be converted':
+    '''Converts jobs with overlapping reads, parsing and writes.
+
+    Args:
+        jobs: Iterable of ((path, extension), output folder) tuples.  It
+              is consumed lazily, so a generator can still be producing
+              jobs while the first ones are converted.
+        options: Dictionary of keyword arguments for poscar.Convert.
+        workers: Number of parsing processes.  Defaults to the CPU count.
+                 With 1, parsing runs in a thread of this process.  The
+                 profiler stages of worker processes are sent back with
+                 each structure and added to the --profile report.
+        io_threads: Number of concurrent reads and of concurrent writes.
+        depth: Size of the queues between the stages.
+    '''
+
+    return asyncio.run(_run(jobs, options or {}, workers, io_threads, depth))
+
+
+async def _run(jobs, options, workers, io_threads, depth):
+    loop = asyncio.get_running_loop()
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        cpu = ThreadPoolExecutor(1)
+    else:
+        cpu = ProcessPoolExecutor(workers)
+
+    # Reads and writes get separate pools so a burst of slow writes can
+    # never starve the readers, or the other way round.
+    read_io = ThreadPoolExecutor(io_threads)
+    write_io = ThreadPoolExecutor(io_threads)
+    to_parse, to_write = asyncio.Queue(depth), asyncio.Queue(depth)
+    failed = [0]
+
+    def elapsed(job):
+        return {'wall': round(time.perf_counter() - job.start, 6),
+                'cpu': round(job.cpu, 6)}
+
+    def fail(job, stage, err):
+        failed[0] += 1
+        error = '{0}: {1}'.format(type(err).__name__, err)
+        logger.error('Could not convert %s (%s)', job.source[0], error)
+        profiler.count_file()
+        log.event('file', path=job.source[0], format=job.source[1],
+                  output=job.outdir, status='error', error=error,
+                  duplicate_of=None, stage=stage, species=[],
+                  stages=job.times, **elapsed(job))
+
+    async def timed(job, name, pool, func, *args):
+        # Worker processes keep their own profiler table, so they are
+        # told whether to record stages and return what they recorded.
+        profile = None
+        if pool is cpu and workers > 1:
+            profile = profiler.enabled()
+        start = time.perf_counter()
+        try:
+            out, used, records = await loop.run_in_executor(
+                pool, _call, func, args, profile)
+        finally:
+            job.times[name] = round(time.perf_counter() - start, 6)
+
+        job.cpu += used
+        if records:
+            profiler.merge(records)
+        return out
+
+    async def read(job):
+        # Trajectories are streamed frame by frame by Convert.output, so
+        # the whole file is handled in the write stage.
+        if job.convert.frames is not None:
+            return await to_write.put(job)
+
+        try:
+            job.data = await timed(job, 'read', read_io, job.convert.fetch)
+        except Exception as err:
+            return fail(job, 'read', err)
+        await to_parse.put(job)
+
+    async def parse(job):
+        try:
+            job.structure, job.parsed = await timed(job, 'parse', cpu,
+                                                    _build, job.convert,
+                                                    job.data)
+        except Exception as err:
+            return fail(job, 'parse', err)
+        job.data = None
+        await to_write.put(job)
+
+    async def write(job):
+        try:
+            if job.structure is None:
+                atom_list = await timed(job, 'write', write_io,
+                                        _write_frames, job)
+            else:
+                if job.parsed is not None:
+                    await timed(job, 'cache', write_io,
+                                job.convert.cache.put, job.convert.key,
+                                job.parsed)
+                    job.parsed = None
+                atom_list = await timed(job, 'write', write_io, _write,
+                                        job.outdir, job.structure,
+                                        job.convert.selective,
+                                        job.convert.sink,
+                                        job.convert.duplicates)
+        except duplicates.Duplicate as dup:
+            profiler.count_file()
+            logger.info('Skipped %s, a duplicate of %s.', job.source[0],
+                        dup.original)
+            return log.event('file', path=job.source[0],
+                             format=job.source[1], output=job.outdir,
+                             status='duplicate', error=None,
+                             duplicate_of=dup.original, species=[],
+                             stages=job.times, **elapsed(job))
+        except Exception as err:
+            return fail(job, 'write', err)
+
+        profiler.count_file()
+        log.event('file', path=job.source[0], format=job.source[1],
+                  output=job.outdir, status='ok', error=None,
+                  duplicate_of=None, species=atom_list, stages=job.times,
+                  **elapsed(job))
+
+    async def feed():
+        # The reads themselves are the bounded part: at most io_threads
+        # of them are in flight, and each waits for room in to_parse.
+        pending = set()
+        for source, outdir in jobs:
+            # A format that cannot be loaded fails this file only, as in
+            # a sequential batch.
+            job = Job(source, outdir)
+            try:
+                job.convert = poscar.Convert(*source, **options)
+            except Exception as err:
+                fail(job, 'read', err)
+                continue
+
+            pending.add(asyncio.ensure_future(read(job)))
+            if len(pending) >= io_threads:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+        await asyncio.gather(*pending)
+
+    async def drain(queue, func, count):
+        async def worker():
+            while True:
+                job = await queue.get()
+                if job is None:
+                    return
+                await func(job)
+        await asyncio.gather(*(worker() for _ in range(count)))
+
+    async def parse_all():
+        await drain(to_parse, parse, workers)
+        for _ in range(io_threads):
+            await to_write.put(None)
+
+    try:
+        parsing = asyncio.ensure_future(parse_all())
+        writing = asyncio.ensure_future(drain(to_write, write, io_threads))
+
+        await feed()
+        for _ in range(workers):
+            await to_parse.put(None)
+        await asyncio.gather(parsing, writing)
+
+    finally:
+        for pool in (cpu, read_io, write_io):
+            pool.shutdown()
+
+    return failed[0]
+
+
+def _call(func, args,
+          profile=None) -> '(result, CPU seconds, stage records) tuple':
+    '''Runs func(*args) in a pool worker, measuring its CPU time.
+
+    Args:
+        profile: None in the thread pools, whose stages go straight into
+                 the shared profiler table.  In a worker process, whether
+                 the parent records stages; the records of this call are
+                 then returned for profiler.merge.
+    '''
+
+    if profile is not None:
+        profiler.reset()
+        if profile:
+            profiler.enable()
+        else:
+            profiler.disable()
+
+    start = time.thread_time()
+    out = func(*args)
+    used = time.thread_time() - start
+
+    return out, used, profiler.take() if profile else None
+
+
+def _build(convert, data) -> '(structure, parse() output to cache or None)':
+    '''Runs Convert.build in a parsing worker.
+
+    The workers never touch the parse cache, whose connections must stay
+    in this process.  A structure that was not found in the cache is
+    returned as parsed as well, and stored by the write stage.
+    '''
+
+    parsed = None
+    if convert.parsed is None and convert.key is not None:
+        with profiler.stage('parse'):
+            parsed = convert.parsed = convert.parse(data)
+
+    return convert.build(data), parsed
+
+
+def _write(outdir, structure, selective, sink,
+           index=None) -> 'Atom list with same order as POSCAR':
+    '''Writes the POSCAR and POTCAR files of a parsed structure.
+
+    Raises duplicates.Duplicate instead if index holds the structure.
+    '''
+
+    if index is not None:
+        index.check(outdir, structure, sink)
+
+    sink.makedirs(outdir)
+    atom_list = poscar.Convert.write(outdir, structure, selective=selective,
+                                     sink=sink)
+    potcar.main(outdir, atom_list, sink)
+    return atom_list
+
+
+def _write_frames(job) -> 'Atom list shared by all frames':
+    '''Converts a whole trajectory file, see poscar.Convert.output.'''
+
+    job.convert.sink.makedirs(job.outdir)
+    atom_list = job.convert.output(job.outdir)
+    potcar.main(job.outdir, atom_list, job.convert.sink)
+    return atom_list
@@ -1,79 +1,208 @@
-import inspect
+import fnmatch
+import io
+import logging
 import os
 import sys
-from vaspcat.extend import posext
+from vaspcat.src import compress, dynamics, formats, profiler, \
+    sink as sinks
 
+logger = logging.getLogger(__name__)
 
-def main(directory) -> 'Atom list with same order as POSCAR':
-    '''Calls methods which generate a POSCAR file for VASP usage.'''
-    
-    # Get list of file types that can be parsed.  This is accomplished
-    # by grabbing class names in posext.py named after file extensions
-    supported = [name.lower() for name, obj in inspect.getmembers(posext)
-                 if inspect.isclass(obj)]
+
+def main(directory, source=None,
+         **options) -> 'Atom list with same order as POSCAR':
+    '''Calls methods which generate a POSCAR file for VASP usage.
+
+    Args:
+        directory: Folder the POSCAR file is saved in.  If source is not
+                   given, it is also scanned for a file to convert.
+        source: Optional (path, extension) tuple of the file to convert.
+                Used by batch mode, where the input files are found once
+                and each one is written to its own directory.
+        options: Keyword arguments passed on to Convert, such as the
+                 transforms applied before the POSCAR is written.
+    '''
     
-    print('Scanning for convertable files in {0}.'.format(directory),'\n')
-    poscar = Convert(*find(directory, supported))
+    if source is None:
+        logger.info('Scanning for convertable files in %s.', directory)
+        source = find(directory, supported())
+
+    poscar = Convert(*source, **options)
 
-    print('Saving POSCAR file...')
+    logger.info('Saving POSCAR file for %s...', source[0])
     atom_list = poscar.output(directory)
 
-    print('COMPLETE!','\n')
+    logger.debug('POSCAR saved in %s.', directory)
     return atom_list
 
 
+def supported() -> 'List of convertable file extensions':
+    '''Returns the file types that can be parsed.
+
+    The extensions come from the format registry in formats.py, which
+    lists the builtin and plugin formats without importing them.
+    '''
+
+    return formats.extensions()
+
+
+def find_all(directory, supported, sniff=False, recursive=False,
+             include=(), exclude=()) -> 'Iterator of path/extension tuples':
+    '''Lazily finds every file with a supported extension in directory.
+
+    The folder is listed with a single os.scandir pass per directory, and
+    matches are yielded as they are found, so a batch conversion can start
+    before the listing of a huge folder has finished.  Files are yielded in
+    directory order, not sorted.
+
+    Args:
+        directory: Folder to be scanned for convertable files.
+        supported: List of file types which can be converted by
+                   the program, obtained from the format registry.
+        sniff: If True, files with other extensions are identified by
+               their content, see formats.sniff.  The extension in the
+               returned tuple is then the name of the matching format.
+        recursive: If True, sub-folders are scanned as well.
+        include: Glob patterns; if given, only files matching one of them
+                 are yielded.
+        exclude: Glob patterns of files, and with recursive of folders,
+                 to skip.  Patterns are matched against both the name and
+                 the path relative to directory, e.g. '*.pdb' or 'old/*'.
+    '''
+
+    # Set lookup of the lower case suffix replaces one directory listing
+    # and comparison per supported extension.
+    supported = set(supported)
+    pending = [directory]
+
+    while pending:
+        folder = pending.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                rel = os.path.relpath(entry.path, directory)
+                rel = rel.replace(os.sep, '/')
+
+                if _matches(entry.name, rel, exclude):
+                    continue
+
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(entry.path)
+                    continue
+
+                if include and not _matches(entry.name, rel, include):
+                    continue
+
+                # A compression suffix is skipped, so a.cif.gz is a cif.
+                ext = compress.extension(entry.name)
+
+                if ext not in supported:
+                    if not sniff or not entry.is_file():
+                        continue
+                    ext = formats.sniff(entry.path)
+                    if ext is None:
+                        continue
+
+                yield entry.path, ext
+
+
+def _matches(name, rel, patterns) -> 'True if name or rel matches a glob':
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(rel, p)
+               for p in patterns)
+
+
 def find(directory, supported) -> 'File path/extension tuple': 
-    '''Finds files with supported extensions from directory.
+    '''Finds the first file with a supported extension in directory.
     
     Args: 
         directory: Folder which vaspcat is run from, containing the 
                    files to be converted by the program.
         supported: List of file types which can be converted by
-                   the program, obtained from class names in posext.py 
+                   the program, obtained from the format registry.
     '''
 
-    # The use of slices is meant to remove the dot from the file extension.
-
-    path = [os.path.join(directory, file)
-            for ext in supported
-            for file in os.listdir(directory)
-            if file[-len(ext):] in supported]
-
-    # Try to get the extension from the supported files, if files were found
+    # Only the first match is needed, so the scan stops there.
 
     try: 
-        file_ext = os.path.splitext(path[0])[1]
+        return next(find_all(directory, supported))
 
-    except IndexError: 
+    except StopIteration: 
 
-        print('No convertable files were found in {0}.'.format(directory))
-        print('Choose another directory and rerun vaspcat.','\n')
-        print('Supported file formats: ' + ', '.join(supported))
-        sys.exit()      
-
-    return path[0], file_ext[-len(file_ext)+1:]
+        logger.error('No convertable files were found in %s.', directory)
+        logger.error('Choose another directory and rerun vaspcat.')
+        logger.error('Supported file formats: %s', ', '.join(supported))
+        sys.exit(1)
 
     
 class Convert(object):
     '''Converts input files to POSCAR file'''
 
-    def __init__(self, path, ext):
+    def __init__(self, path, ext, transforms=(), mapped=False,
+                 frames=(0, None, 1), xdatcar=False, cache=None,
+                 selective=dynamics.DEFAULT, sink=None, duplicates=None):
         '''Initialize the methods and functions output requires.
 
         Args:
             path: Location of file that will be converted.
             ext: The extension of the file which will be converted.
                  It is used to define read and parse methods for
-                 the Convert class.  These methods are located in the
-                 external file posext.py.
+                 the Convert class.  These methods belong to the class
+                 registered for ext in formats.py, e.g. posext.Cif.
+            transforms: Sequence of (name, function) tuples applied in
+                        order between parse and output.  Each function
+                        takes and returns the 4-tuple produced by parse,
+                        e.g. ('niggli', niggli.apply).  The name is used
+                        as the profiler stage.
+            mapped: If True, use the memory-mapped read_mapped method of
+                    the format class when it has one.
+            frames: (start, stop, step) selection of frames for formats
+                    holding several structures, i.e. classes with a
+                    frames method such as posext.Xyz.
+            xdatcar: If True, the frames of such formats are written to
+                     a single XDATCAR file instead of one POSCAR_<frame>
+                     file each.
+            cache: Optional cache.Cache of parsed structures.  On a hit,
+                   reading and parsing the file are skipped.  Frames of
+                   trajectories are not cached.
+            selective: Selective dynamics rules for the POSCAR, see
+                       dynamics.py, or None to leave the block out.
+            sink: Where the output files go, see sink.py.  Defaults to
+                  a sink.Directory, which writes plain files.
+            duplicates: Optional duplicates.Index.  Structures whose
+                        fingerprint it already holds are not written,
+                        see Convert.output.
         '''
         
-        #Account for the fact that classes are capitalized in posext.py        
-        ext = ext.capitalize()
+        # Importing the format class is deferred to this point, so only
+        # the modules of formats that are actually converted get loaded.
+        fmt = formats.load(ext)
         
         self.path = path
-        self.read = getattr(posext,ext).read
-        self.parse = getattr(posext,ext).parse
+        self.format = fmt
+        self.read = fmt.read
+        # Compressed files cannot be mapped, and are streamed instead.
+        if mapped and hasattr(fmt, 'read_mapped') and \
+                not compress.compressed(path):
+            self.read = fmt.read_mapped
+        self.parse = fmt.parse
+        self.transforms = transforms
+        self.frames = getattr(fmt, 'frames', None)
+        self.select = frames
+        self.xdatcar = xdatcar
+        self.cache = cache
+        self.selective = selective
+        self.sink = sink or sinks.Directory()
+        self.duplicates = duplicates
+        self.key = self.parsed = None
+
+    def __getstate__(self):
+        # Archive sinks, the duplicate index and the parse cache hold open
+        # files, locks and database connections.  Copies sent to the
+        # parsing processes of the pipeline never write, so they go
+        # without them; the pipeline caches their results itself.
+        state = dict(self.__dict__)
+        state['sink'] = state['duplicates'] = state['cache'] = None
+        return state
     
     def output(self, directory) -> 'Atom list with same order as POSCAR':
         '''Saves POSCAR file in directory
@@ -87,35 +216,244 @@ class Convert(object):
             having the following form:
 
             [[atom 1 name, # of atom 1], [atom 2 name, # of atom 2], ...]
+
+        Exceptions:
+            duplicates.Duplicate: Occurs instead of writing when the
+                                  duplicates index holds the structure.
+                                  directory is then not created, or with
+                                  the 'link' mode, linked to the folder
+                                  holding the structure.
         '''
         
-        lat_vec, atom_info, frac_pos = self.parse(self.read(self.path))
- 
-        with open(os.path.join(directory, 'POSCAR'), mode='w') as f:
-            #Line 1: System Name
-            f.write('POSCAR\n') 
-
-            #Line 2: Scaling Constant
-            f.write('1.00'.rjust(7) + '\n')
-
-            #Line 3: Lattice Vectors
-            for line in lat_vec:
-                f.write(' ' + line + '\n')
-
-            #Line 4: Atoms per Species
-            atom_count = ' '.join([str(count[1]) for count in atom_info])
-            f.write(''.rjust(3))
-            f.write(' '.join([atom[0] for atom in atom_info]) + '\n')
-            f.write(''.rjust(3) + atom_count + '\n')
-
-            #Lines 5/6: Allow cell relaxation and specify direct coordinates
+        if self.frames is not None:
+            self.sink.makedirs(directory)
+            return self.output_frames(directory)
+
+        structure = self.build(self.fetch())
+        if self.duplicates is not None:
+            self.duplicates.check(directory, structure, self.sink)
+
+        self.sink.makedirs(directory)
+        return Convert.write(directory, structure,
+                             selective=self.selective, sink=self.sink)
+
+    def fetch(self) -> 'Data for build, or None on a cache hit':
+        '''Reads the input file, unless its parsed structure is cached.
+
+        On a hit the cached structure is kept in self.parsed, where build
+        picks it up in place of parsing.
+        '''
+
+        if self.cache is not None:
+            with profiler.stage('cache'):
+                self.key = self.cache.key(self.path, self.format)
+                self.parsed = self.cache.get(self.key)
+            if self.parsed is not None:
+                logger.debug('Using cached structure of %s.', self.path)
+                return None
+
+        with profiler.stage('read'):
+            return self.read(self.path)
+
+    def output_frames(self, directory) -> 'Atom list shared by all frames':
+        '''Saves one POSCAR_<frame> file per selected frame in directory.
+
+        Frames are streamed from the format's frames method, so only one
+        is held in memory at a time.  With the xdatcar option, the frames
+        are appended to one XDATCAR file instead, see Convert.append.
+
+        Exceptions:
+            ValueError: Occurs when no frame is selected, or when frames
+                        differ in species order, since they share one
+                        POTCAR file.
+        '''
+
+        frames = self.frames(self.path, *self.select)
+        atom_list = last = None
+
+        # Archive sinks take whole files, so the XDATCAR is collected in
+        # memory for them.
+        xdatcar = None
+        if self.xdatcar and isinstance(self.sink, sinks.Directory):
+            xdatcar = open(os.path.join(directory, 'XDATCAR'), mode='w')
+        elif self.xdatcar:
+            xdatcar = io.StringIO()
+
+        try:
+            while True:
+                with profiler.stage('read'):
+                    data = next(frames, None)
+                if data is None:
+                    break
+
+                structure = self.build(data)
+
+                if xdatcar:
+                    species = Convert.append(xdatcar, structure, last)
+                    last = structure
+                else:
+                    name = 'POSCAR_{0:05d}'.format(structure[3]['frame'])
+                    species = Convert.write(directory, structure, name,
+                                            self.selective, self.sink)
+
+                if atom_list is None:
+                    atom_list = species
+                elif species != atom_list:
+                    raise ValueError('Frame {0} has species {1}, but '
+                                     'earlier frames have {2}.'.format(
+                                         structure[3]['frame'], species,
+                                         atom_list))
+            if isinstance(xdatcar, io.StringIO):
+                self.sink.write(os.path.join(directory, 'XDATCAR'),
+                                xdatcar.getvalue())
+        finally:
+            if xdatcar:
+                xdatcar.close()
+
+        if atom_list is None:
+            raise ValueError('No frames of {0} were selected.'
+                             .format(self.path))
+        return atom_list
+
+    def build(self, data) -> '4-tuple from parse() after the transforms':
+        '''Parses the data returned by read and applies the transforms.
+
+        Separated from output so that reading, parsing and writing can
+        be scheduled independently, e.g. by the batch pipeline.
+        '''
+
+        structure = self.parsed
+        if structure is None:
+            with profiler.stage('parse'):
+                structure = self.parse(data)
+            if self.key is not None and self.cache is not None:
+                self.cache.put(self.key, structure)
+
+        # The order stage replaces partially occupied sites, see
+        # extend/order.py; without it they are written as they are.
+        disorder = structure[3].get('disorder')
+        if disorder and 'order' not in dict(self.transforms):
+            logger.warning('%d sites are partially occupied.  Without '
+                           '--order they are written as fully occupied.',
+                           len(disorder))
+
+        for name, transform in self.transforms:
+            with profiler.stage(name):
+                structure = transform(*structure)
+
+        return structure
+
+    @staticmethod
+    def write(directory, structure, name='POSCAR', selective=dynamics.DEFAULT,
+              sink=None) -> 'Atom list with same order as POSCAR':
+        '''Saves the POSCAR file of a parsed structure in directory.
+
+        Args:
+            directory: Folder the file is saved in.
+            structure: 4-tuple from Convert.build.
+            name: File name.
+            selective: Selective dynamics rules, see dynamics.py, or None
+                       to leave the Selective Dynamics block out.
+            sink: Optional archive sink, see sink.py, to write to instead
+                  of the file.
+        '''
+
+        path = os.path.join(directory, name)
+
+        with profiler.stage('format'):
+            if sink is None or isinstance(sink, sinks.Directory):
+                with open(path, mode='w') as f:
+                    return Convert.render(f, structure, selective)
+
+            f = io.StringIO()
+            species = Convert.render(f, structure, selective)
+            sink.write(path, f.getvalue())
+            return species
+
+    @staticmethod
+    def render(f, structure, selective=dynamics.DEFAULT
+               ) -> 'Atom list with same order as POSCAR':
+        '''Writes the POSCAR of a parsed structure to a text stream.
+
+        Args:
+            f: Open text file or buffer, e.g. io.StringIO.
+            structure, selective: As for Convert.write.
+        '''
+
+        lat_vec, atom_info, frac_pos, info = structure
+        flags = dynamics.flags(selective, lat_vec, atom_info, frac_pos)
+
+        #Lines 1-4: System Name, Scaling Constant, Lattice Vectors
+        #and Atoms per Species
+        Convert.header(f, 'POSCAR', lat_vec, atom_info)
+
+        #Lines 5/6: Allow cell relaxation and specify direct coordinates
+        if flags is None:
+            f.write('Direct\n')
+            f.writelines(' ' + Convert.format(pos) + '\n'
+                         for pos in frac_pos)
+        else:
             f.write('Selective Dynamics\nDirect\n')
 
-            #Lines 7-End: Cell Coordinates
-            for line in frac_pos:
-                f.write(' ' + line + ' F F F\n')
+            #Lines 7-End: Cell Coordinates and their flags
+            f.writelines(' ' + Convert.format(pos) + ' ' + flag + '\n'
+                         for pos, flag in zip(frac_pos, flags))
+
+        return [atom[0] for atom in atom_info]
+
+    @staticmethod
+    def append(f, structure,
+               last=None) -> 'Atom list with same order as XDATCAR':
+        '''Appends one frame of a parsed structure to an open XDATCAR.
+
+        The header is only written for the first frame, and again when
+        the lattice changes, which is how VASP writes variable cell runs.
+        Frames are numbered from 1 as in VASP, i.e. info['frame'] + 1.
+
+        Args:
+            f: XDATCAR file opened for writing.
+            structure: 4-tuple from Convert.build.
+            last: Structure of the previous frame, or None for the first.
+        '''
+
+        lat_vec, atom_info, frac_pos, info = structure
+
+        with profiler.stage('format'):
+            if last is None or last[0] != lat_vec or last[1] != atom_info:
+                Convert.header(f, 'XDATCAR', lat_vec, atom_info)
+
+            f.write('Direct configuration= {0:5d}\n'
+                    .format(info.get('frame', 0) + 1))
+            f.writelines(' ' + Convert.format(pos) + '\n'
+                         for pos in frac_pos)
+
+        return [atom[0] for atom in atom_info]
+
+    @staticmethod
+    def header(f, title, lat_vec, atom_info):
+        '''Writes the lines shared by the POSCAR and XDATCAR formats.'''
+
+        #Line 1: System Name
+        f.write(title + '\n')
+
+        #Line 2: Scaling Constant
+        f.write('1.00'.rjust(7) + '\n')
+
+        #Line 3: Lattice Vectors
+        for vec in lat_vec:
+            f.write(' ' + Convert.format(vec) + '\n')
+
+        #Line 4: Atoms per Species
+        atom_count = ' '.join([str(count[1]) for count in atom_info])
+        f.write(''.rjust(3))
+        f.write(' '.join([atom[0] for atom in atom_info]) + '\n')
+        f.write(''.rjust(3) + atom_count + '\n')
+
+    @staticmethod
+    def format(vec) -> 'String of space separated numbers':
+        '''Formats a lattice vector or fractional coordinate for POSCAR.'''
 
-        return [atom[0] for atom in atom_info]  
+        return ' '.join(['{: 5.10f}'.format(i) for i in vec])  
 
 
 
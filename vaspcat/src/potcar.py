@@ -1,58 +1,133 @@
+import io
+import logging
 import os
-import pkg_resources as pkg
 import shutil
-import sys
+from vaspcat.src import profiler, sink as sinks
 
-def main(directory, atom_list):
+logger = logging.getLogger(__name__)
+
+# Contents of the atomic POTCAR files by path, kept by long-running
+# processes such as the daemon, see keep().  None disables the cache, so
+# a command line run always copies the files as they are on disk.
+_contents = None
+
+# Folder the atomic POTCAR files are read from instead of potext, see use().
+_directory = None
+
+
+def keep():
+    '''Keeps atomic POTCAR files in memory once they have been read.
+
+    Files changed in potext afterwards are not picked up until the
+    process is restarted.
+    '''
+
+    global _contents
+    if _contents is None:
+        _contents = {}
+
+
+def use(directory) -> 'Folder used before, or None for potext':
+    '''Reads the atomic POTCAR files from directory instead of potext.
+
+    Args:
+        directory: Folder laid out like potext, with one sub-folder per
+                   species holding its POTCAR, or None for potext.
+    '''
+
+    global _directory
+    previous, _directory = _directory, directory
+    return previous
+
+
+def main(directory, atom_list, sink=None):
     '''Combines POTCAR files from potext in POSCAR order
 
     Args:
         directory: Directory vaspcat is run from, used for POSCAR output path.
         atom_list: List of atom names with same order as in POSCAR file.
                    Used to get atomic POSCAR files stored in /potext/atom_name
+        sink: Optional archive sink, see sink.py, to write to instead of
+              the POTCAR file.
 
     Exceptions:
         IOError: Occurs when POTCAR file for a particular atom is not found
-                 in the potext directory.  
+                 in the potext directory.  The error is logged and raised
+                 again, so batch runs can record it and move on.
 
     Returns:
         String indicating that POTCAR generation has completed.
 
     '''
     
+    logger.info('Saving POTCAR file...')
+    path = os.path.join(directory,'POTCAR')
+
+    with profiler.stage('potcar'):
+        if sink is None or isinstance(sink, sinks.Directory):
+            with open(path,'w') as outfile:
+                write(outfile, atom_list)
+        else:
+            outfile = io.StringIO()
+            write(outfile, atom_list)
+            sink.write(path, outfile.getvalue())
+
+    return 'COMPLETE!\n'
+
+
+def write(outfile, atom_list):
+    '''Writes the combined POTCAR to an open text stream.
+
+    Args:
+        outfile: Open text file or buffer, e.g. io.StringIO.
+        atom_list: List of atom names with same order as in POSCAR file.
+
+    Exceptions:
+        IOError: As for main.
+    '''
+
     # Use the pkg_resources module to get the path of the atomic POTCAR file
     # stored in potext/atom.  Add this path to the pkgfile list.
 
-    print('Scanning for atom POTCAR files to combine','\n') 
-    pkgfile = []
-    for atom in atom_list:
-
-        infile = pkg.resource_filename(
-		    'vaspcat', 'extend/potext/' + atom + '/POTCAR'
-        )
-        pkgfile.append(infile)
+    logger.debug('Scanning for atom POTCAR files to combine') 
+    pkgfile = [location(atom) for atom in atom_list]
     
-    # Create an output file named POSCAR.  Use the shutil module to bring
-    # the contents of the pkgfile files into the output POTCAR.
+    # Use the shutil module to bring the contents of the pkgfile files
+    # into the output POTCAR.
 
-    print('Saving POTCAR file...')
-    with open(os.path.join(directory,'POTCAR'),'w') as outfile:
-        
-        try:
+    try:
+
+        for file in pkgfile:
+            if _contents is not None and file in _contents:
+                outfile.write(_contents[file])
+                continue
 
-            for file in pkgfile:
-                with open(file, 'r') as infile:
+            with open(file, 'r') as infile:
+                if _contents is None:
                     shutil.copyfileobj(infile, outfile)
-	
-        except IOError:
-            
-            # Indicate to the user where the missing POTCAR file should go.
-            
-            errfile = os.path.basename(os.path.dirname(file))
-            print("{0} was not found in the "
-                  "'potext' directory.".format(errfile))
-            print("Add {0}/POTCAR to the 'potext' folder, and "
-                  "run vaspcat again.".format(errfile))
-            sys.exit()
+                else:
+                    _contents[file] = infile.read()
+                    outfile.write(_contents[file])
 
-    return 'COMPLETE!\n'
+    except IOError:
+        
+        # Indicate to the user where the missing POTCAR file should go.
+        
+        errfile = os.path.basename(os.path.dirname(file))
+        logger.error("%s was not found in the 'potext' directory.",
+                     errfile)
+        logger.error("Add %s/POTCAR to the 'potext' folder, and "
+                     "run vaspcat again.", errfile)
+        raise
+
+
+def location(atom) -> 'Path of the atomic POTCAR file in potext':
+    if _directory is not None:
+        return os.path.join(_directory, atom, 'POTCAR')
+
+    # pkg_resources takes longer to import than the rest of vaspcat, so
+    # it is only loaded once a POTCAR is actually needed.
+    import pkg_resources as pkg
+
+    return pkg.resource_filename('vaspcat',
+                                 'extend/potext/' + atom + '/POTCAR')
@@ -0,0 +1,159 @@
+import cProfile
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+# Stage records are stored at module level so that poscar.py, potcar.py
+# and posext.py can all report into the same table without a profiler
+# object being passed through every call.  Each record has the form
+#
+#    {'calls': 2, 'wall': 0.013, 'cpu': 0.012, 'blocks': 1530}
+#
+# 'wall' and 'cpu' are seconds spent inside the stage, and 'blocks' is the
+# net number of memory blocks allocated by the interpreter while the stage
+# was running (sys.getallocatedblocks).  Records accumulate over every file
+# converted in a run, so a batch conversion yields one aggregated table.
+
+_enabled = False
+_records = {}
+_files = 0
+
+
+def enable():
+    '''Start recording stage timings.'''
+
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    '''Stop recording stage timings.  Existing records are kept.'''
+
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    '''Discard all stage records and the file counter.'''
+
+    global _files
+    _records.clear()
+    _files = 0
+
+
+def enabled() -> 'True if stages are being recorded':
+    return _enabled
+
+
+@contextmanager
+def stage(name):
+    '''Record wall time, CPU time and allocations for a block of code.
+
+    Args:
+        name: Stage name used as the key in the report, e.g. 'read'.
+              Stages may be nested, in which case the outer stage also
+              includes the cost of the inner one.
+    '''
+
+    if not _enabled:
+        yield
+        return
+
+    blocks = sys.getallocatedblocks()
+    wall, cpu = time.perf_counter(), time.process_time()
+
+    try:
+        yield
+    finally:
+        record = _records.setdefault(
+            name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'blocks': 0}
+        )
+        record['calls'] += 1
+        record['wall'] += time.perf_counter() - wall
+        record['cpu'] += time.process_time() - cpu
+        record['blocks'] += sys.getallocatedblocks() - blocks
+
+
+def count_file():
+    '''Increment the number of files covered by the report.'''
+
+    global _files
+    if _enabled:
+        _files += 1
+
+
+def take() -> 'Dictionary of stage records, which are then cleared':
+    '''Returns the raw stage records and starts a new table.
+
+    Used in worker processes, whose records are sent back to the parent
+    and added to its table with merge.
+    '''
+
+    records = dict(_records)
+    _records.clear()
+    return records
+
+
+def merge(records):
+    '''Adds stage records returned by take to the table.'''
+
+    for name, other in records.items():
+        record = _records.setdefault(
+            name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'blocks': 0}
+        )
+        for key in record:
+            record[key] += other[key]
+
+
+def report() -> 'Dictionary of aggregated stage records':
+    '''Returns the stage table in a JSON serializable form.
+
+    Returns:
+        A dictionary with the following form -
+
+        {'files': 3,
+         'stages': {'read': {'calls': 3, 'wall': ..., 'cpu': ...,
+                             'blocks': ..., 'wall_per_file': ...}, ...}}
+    '''
+
+    stages = {}
+    for name, record in _records.items():
+        stages[name] = dict(record)
+        stages[name]['wall_per_file'] = record['wall']/max(_files, 1)
+
+    return {'files': _files, 'stages': stages}
+
+
+def save(path):
+    '''Writes the JSON report to path, or to stdout if path is '-'.'''
+
+    text = json.dumps(report(), indent=2, sort_keys=True)
+
+    if path == '-':
+        print(text)
+    else:
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+
+
+def run(func, *args, cprofile=None):
+    '''Calls func(*args), optionally under cProfile.
+
+    Args:
+        func: Function to be called.
+        cprofile: If given, path where the cProfile statistics are dumped.
+                  The file can be inspected with the pstats module.
+
+    Returns:
+        The return value of func.
+    '''
+
+    if cprofile is None:
+        return func(*args)
+
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(func, *args)
+    finally:
+        prof.dump_stats(cprofile)
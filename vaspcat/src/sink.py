@@ -0,0 +1,168 @@
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+import zipfile
+
+# Destinations for the files written by a conversion.  By default every
+# POSCAR, POTCAR and XDATCAR is its own file, which for a large batch means
+# hundreds of thousands of small files and a matching load on the metadata
+# servers of a parallel filesystem.  An archive sink instead streams all of
+# them into one tar, zip or HDF5 file.  Members are named by their path
+# relative to the batch directory, e.g. 'NaCl/POSCAR', and an index of the
+# members is added as INDEX when the archive is closed:
+#
+#    {"members": [{"name": "NaCl/POSCAR", "size": 512, "offset": 0}, ...]}
+#
+# 'offset' is the position of the tar header of a member in an
+# uncompressed tar file, so a single member can be read by seeking to it.
+# Folders linked to another one, see duplicates.py, are listed in the index
+# as {"name": "NaCl_2", "link": "NaCl"} and hold no members.
+#
+# Sinks are shared by the writer threads of the batch pipeline, so the
+# archive sinks serialize their writes with a lock.
+
+INDEX = 'index.json'
+
+
+def open_sink(path, root) -> 'Archive sink for path':
+    '''Opens the archive sink matching the extension of path.
+
+    Args:
+        path: Archive file: .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz, .zip,
+              .h5 or .hdf5.
+        root: Directory that member names are made relative to.
+
+    Exceptions:
+        ValueError: Occurs for any other extension.
+    '''
+
+    lower = path.lower()
+    for ext, mode in (('.tar', 'w'), ('.tar.gz', 'w:gz'), ('.tgz', 'w:gz'),
+                      ('.tar.bz2', 'w:bz2'), ('.tar.xz', 'w:xz')):
+        if lower.endswith(ext):
+            return Tar(path, root, mode)
+
+    if lower.endswith('.zip'):
+        return Zip(path, root)
+    if lower.endswith(('.h5', '.hdf5')):
+        return Hdf5(path, root)
+
+    raise ValueError('Unknown archive type of {0}.  Use .tar, .tar.gz, '
+                     '.zip or .h5.'.format(path))
+
+
+class Directory(object):
+    '''Default sink, writing each file to its own path.'''
+
+    def write(self, path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def makedirs(self, path):
+        os.makedirs(path, exist_ok=True)
+
+    def link(self, path, target):
+        '''Makes the folder path a relative symbolic link to target.'''
+
+        if os.path.lexists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.symlink(os.path.relpath(target, os.path.dirname(path)), path)
+
+    def close(self):
+        pass
+
+
+class Archive(object):
+    '''Base of the sinks writing into a single file.'''
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        self.index = []
+        self.lock = threading.Lock()
+
+    def name(self, path) -> 'Member name':
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def makedirs(self, path):
+        # Folders are implied by the member names.
+        pass
+
+    def link(self, path, target):
+        with self.lock:
+            self.index.append({'name': self.name(path),
+                               'link': self.name(target)})
+
+    def write(self, path, text):
+        data = text.encode()
+        with self.lock:
+            entry = {'name': self.name(path), 'size': len(data)}
+            self.add(entry, data)
+            self.index.append(entry)
+
+    def close(self):
+        with self.lock:
+            data = json.dumps({'members': self.index}, indent=1).encode()
+            self.add({'name': INDEX, 'size': len(data)}, data)
+            self.finish()
+
+
+class Tar(Archive):
+    '''Sink writing a tar file, optionally compressed.'''
+
+    def __init__(self, path, root, mode='w'):
+        super().__init__(path, root)
+        self.tar = tarfile.open(path, mode)
+        self.compressed = mode != 'w'
+
+    def add(self, entry, data):
+        info = tarfile.TarInfo(entry['name'])
+        info.size, info.mtime, info.mode = len(data), int(time.time()), 0o644
+        if not self.compressed:
+            entry['offset'] = self.tar.offset
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def finish(self):
+        self.tar.close()
+
+
+class Zip(Archive):
+    '''Sink writing a deflate compressed zip file.'''
+
+    def __init__(self, path, root):
+        super().__init__(path, root)
+        self.zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+
+    def add(self, entry, data):
+        self.zip.writestr(entry['name'], data)
+
+    def finish(self):
+        self.zip.close()
+
+
+class Hdf5(Archive):
+    '''Sink writing each file as a byte string dataset of an HDF5 file.
+
+    Needs the optional h5py package.
+    '''
+
+    def __init__(self, path, root):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('HDF5 archives need the h5py package.')
+
+        super().__init__(path, root)
+        self.h5 = h5py.File(path, 'w')
+
+    def add(self, entry, data):
+        import numpy
+
+        self.h5.create_dataset(entry['name'], data=numpy.void(data))
+
+    def finish(self):
+        self.h5.close()
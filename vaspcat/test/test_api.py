@@ -0,0 +1,46 @@
+import io
+import unittest
+from vaspcat import api
+
+NACL = '''data_NaCl
+_cell_length_a 5.64
+_cell_length_b 5.64
+_cell_length_c 5.64
+_cell_angle_alpha 90
+_cell_angle_beta 90
+_cell_angle_gamma 90
+_symmetry_space_group_name_H-M 'F m -3 m'
+loop_
+_atom_site_label
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+Na1 0 0 0
+Cl1 0.5 0.5 0.5
+'''
+
+
+class ReadTest(unittest.TestCase):
+
+    def test_stream(self):
+        structure = api.read(io.StringIO(NACL), format='cif')
+        self.assertEqual(structure.atom_info, [('Na', 4), ('Cl', 4)])
+        self.assertEqual(structure.info['hall'], '-f 4 2 3')
+
+    def test_missing_cell(self):
+        with self.assertRaises(ValueError):
+            api.read(io.StringIO('data_x\n_cell_length_a 5\n'), format='cif')
+
+    def test_missing_space_group(self):
+        text = NACL.replace("_symmetry_space_group_name_H-M 'F m -3 m'\n",
+                            '')
+        with self.assertRaisesRegex(ValueError, 'space group'):
+            api.read(io.StringIO(text), format='cif')
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            api.read(io.StringIO(NACL), format='nope')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from vaspcat.extend import findsym
+
+A = 4.0
+CUBIC = [[A, 0, 0], [0, A, 0], [0, 0, A]]
+PRIMITIVE = [[0, A/2, A/2], [A/2, 0, A/2], [A/2, A/2, 0]]
+FCC_SITES = [(0, 0, 0), (0, 0.5, 0.5), (0.5, 0, 0.5), (0.5, 0.5, 0)]
+
+
+class DetectTest(unittest.TestCase):
+
+    def test_simple_cubic(self):
+        found = findsym.detect(CUBIC, [('Po', 1)], [(0, 0, 0)])
+        self.assertEqual(found['symbol'], 'Pm-3m')
+        self.assertEqual(len(found['operations']), 48)
+        self.assertEqual(found['lattice_points'], 1)
+
+    def test_rock_salt(self):
+        cl = [tuple((x + 0.5) % 1 for x in site) for site in FCC_SITES]
+        found = findsym.detect(CUBIC, [('Na', 4), ('Cl', 4)],
+                               FCC_SITES + cl)
+        self.assertEqual(found['symbol'], 'Fm-3m')
+        self.assertEqual(found['point_group'], 48)
+        self.assertEqual(found['lattice_points'], 4)
+
+    def test_primitive_cell(self):
+        # Not a tabulated setting: the conventional cubic cell is found
+        # from the four-fold axes, and the origin from the inversion.
+        found = findsym.detect(PRIMITIVE, [('Na', 1), ('Cl', 1)],
+                               [(0.1, 0.2, 0.3), (0.6, 0.7, 0.8)])
+        self.assertEqual(found['symbol'], 'Fm-3m')
+        self.assertEqual(len(found['operations']), 48)
+
+    def test_skewed_basis(self):
+        # Entries of the rotations reach 8 in this basis.
+        a, b, c = PRIMITIVE
+        lat_vec = [a, [x + y for x, y in zip(a, b)],
+                   [x + 2*y for x, y in zip(c, a)]]
+        found = findsym.detect(lat_vec, [('Cu', 1)], [(0, 0, 0)])
+        self.assertEqual(found['point_group'], 48)
+        self.assertEqual(found['symbol'], 'Fm-3m')
+
+    def test_broken_symmetry(self):
+        # Moving one atom off its site leaves a tetragonal group.
+        sites = [(0, 0, 0.02)] + FCC_SITES[1:]
+        found = findsym.detect(CUBIC, [('Cu', 4)], sites)
+        self.assertLess(found['point_group'], 48)
+
+
+class KpointTest(unittest.TestCase):
+
+    def test_fcc_mesh(self):
+        found = findsym.detect(PRIMITIVE, [('Cu', 1)], [(0, 0, 0)])
+        points = findsym.irreducible(
+            (4, 4, 4), findsym.kpoint_rotations(found['operations']))
+        self.assertEqual(len(points), 8)
+        self.assertEqual(sum(weight for point, weight in points), 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
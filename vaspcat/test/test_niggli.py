@@ -0,0 +1,45 @@
+import unittest
+from math import degrees, sqrt
+from vaspcat.extend import cell, niggli
+
+A = 4.0
+
+# Primitive basis of an fcc lattice with cubic cell A, whose Niggli cell
+# has three edges of A/sqrt(2) at 60 degrees.
+FCC = [[0, A/2, A/2], [A/2, 0, A/2], [A/2, A/2, 0]]
+
+
+def shear(lat_vec) -> 'Same lattice in a skewed basis a, a + b, 2a + b + c':
+    a, b, c = lat_vec
+    return [a, [x + y for x, y in zip(a, b)],
+            [2*x + y + z for x, y, z in zip(a, b, c)]]
+
+
+class ReduceTest(unittest.TestCase):
+
+    def assertFcc(self, lat_vec):
+        a, b, c, alpha, beta, gamma = cell.parameters([lat_vec])[0]
+        for length in (a, b, c):
+            self.assertAlmostEqual(length, A/sqrt(2))
+        for angle in (alpha, beta, gamma):
+            self.assertAlmostEqual(degrees(angle), 60)
+
+    def test_sheared_fcc(self):
+        reduced, p = niggli.reduce(shear(FCC))
+        self.assertFcc(reduced)
+        self.assertEqual(abs(round(cell.det(p))), 1)
+
+    def test_reduced_cell_is_kept(self):
+        reduced, p = niggli.reduce(FCC)
+        self.assertFcc(reduced)
+
+    def test_apply_keeps_atoms(self):
+        lat_vec, atom_info, frac_pos, info = niggli.apply(
+            shear(FCC), [('Cu', 1)], [(0.0, 0.0, 0.0)], {})
+        self.assertFcc(lat_vec)
+        self.assertEqual(atom_info, [('Cu', 1)])
+        self.assertEqual(frac_pos, [(0.0, 0.0, 0.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
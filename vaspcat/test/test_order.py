@@ -0,0 +1,76 @@
+import io
+import unittest
+from vaspcat import api
+from vaspcat.extend import order
+
+HEADER = '''data_test
+_cell_length_a {a}
+_cell_length_b {a}
+_cell_length_c {a}
+_cell_angle_alpha 90
+_cell_angle_beta 90
+_cell_angle_gamma 90
+_symmetry_space_group_name_H-M '{symbol}'
+loop_
+_atom_site_label
+_atom_site_type_symbol
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+_atom_site_occupancy
+'''
+
+# Fe and Co sharing the cation site of rock salt FeO.
+FECOO = HEADER.format(a=4.2, symbol='F m -3 m') + '''Fe1 Fe 0 0 0 0.5
+Co1 Co 0 0 0 0.5
+O1 O 0.5 0.5 0.5 1
+'''
+
+# Li at half occupancy on the 3c site of Pm-3m.
+LIO = HEADER.format(a=5.0, symbol='P m -3 m') + '''Li1 Li 0.5 0 0 0.5
+O1 O 0 0 0 1.0(0)
+'''
+
+
+def distinct(text, supercell) -> 'Number of symmetry-distinct orderings':
+    structure = api.read(io.StringIO(text), format='cif')
+    found = order.Enumeration(*structure, supercell=supercell)
+    return sum(1 for _ in found.configurations())
+
+
+class EnumerationTest(unittest.TestCase):
+
+    def test_counts(self):
+        # Fe and Co on the 4 sites of the conventional cell: the 6
+        # arrangements are all equivalent under the face centering.
+        self.assertEqual(distinct(FECOO, (1, 1, 1)), 1)
+
+        # 3 Li on 6 sites, 20 arrangements, and 6 Li on 12 sites, 924.
+        self.assertEqual(distinct(LIO, (2, 1, 1)), 5)
+        self.assertEqual(distinct(LIO, (2, 2, 1)), 56)
+
+    def test_occupancy_counts(self):
+        counts = order.Enumeration.counts(6, {'Li': 0.5})
+        self.assertEqual(dict(counts), {'Li': 3, None: 3})
+
+    def test_apply(self):
+        structure = api.read(io.StringIO(LIO), format='cif')
+        lat_vec, atom_info, frac_pos, info = order.apply(
+            *structure, supercell=(2, 1, 1))
+        self.assertEqual(dict(atom_info), {'Li': 3, 'O': 2})
+        self.assertEqual(len(frac_pos), 5)
+        self.assertNotIn('disorder', info)
+        self.assertEqual(info['order']['examined'], 5)
+
+    def test_limit(self):
+        # A limit equal to the number of orderings truncates nothing.
+        structure = api.read(io.StringIO(LIO), format='cif')
+        for limit, truncated in ((5, False), (4, True)):
+            with self.assertLogs(order.logger, 'INFO') as logs:
+                order.apply(*structure, supercell=(2, 1, 1), limit=limit)
+            warned = any(r.levelname == 'WARNING' for r in logs.records)
+            self.assertEqual(warned, truncated)
+
+
+if __name__ == '__main__':
+    unittest.main()
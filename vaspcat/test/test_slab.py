@@ -0,0 +1,49 @@
+import unittest
+from math import sqrt
+from vaspcat.extend import cell, slab
+
+A = 5.64
+CUBIC = [[A, 0, 0], [0, A, 0], [0, 0, A]]
+NA = [(0, 0, 0), (0, 0.5, 0.5), (0.5, 0, 0.5), (0.5, 0.5, 0)]
+CL = [tuple((x + 0.5) % 1 for x in site) for site in NA]
+
+
+def rock_salt(miller, **options):
+    return slab.apply(CUBIC, [('Na', 4), ('Cl', 4)], NA + CL,
+                      {'hall': '-f 4 2 3'}, miller=miller, **options)
+
+
+class SlabTest(unittest.TestCase):
+
+    def test_terminations(self):
+        # (111) planes alternate between Na and Cl; (100) and (110)
+        # planes hold both.
+        for miller, count in (((1, 1, 1), 2), ((1, 0, 0), 1),
+                              ((1, 1, 0), 1)):
+            info = rock_salt(miller)[3]
+            self.assertEqual(info['slab']['terminations'], count, miller)
+
+    def test_height(self):
+        # The (111) cell of the cubic lattice is a/sqrt(3) thick and
+        # holds the 4 NaCl units of the conventional cell.
+        lat_vec, atom_info, frac_pos, info = rock_salt(
+            (1, 1, 1), layers=2, vacuum=10.0)
+        c = lat_vec[2]
+        self.assertAlmostEqual(sqrt(cell.dot(c, c)), 2*A/sqrt(3) + 10.0)
+        self.assertEqual(sum(count for name, count in atom_info), 16)
+        self.assertNotIn('hall', info)
+
+    def test_no_negative_zero(self):
+        lat_vec, atom_info, frac_pos, info = rock_salt((1, 1, 1))
+        values = [x for v in lat_vec for x in v]
+        values += [x for pos in frac_pos for x in pos]
+        self.assertFalse(any(x == 0 and str(x).startswith('-')
+                             for x in values))
+
+    def test_bad_termination(self):
+        with self.assertRaises(ValueError):
+            rock_salt((1, 1, 1), termination=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from vaspcat.extend import symmetry
+
+
+class OrbitTest(unittest.TestCase):
+
+    def orbits(self, hall, sites):
+        group, generators = symmetry.group(hall)
+        return len(group), [len(symmetry.orbit(site, generators))
+                            for site in sites]
+
+    def test_fm3m(self):
+        # NaCl: Na on 4a and Cl on 4b, the 8c site of the fluorite anion
+        # and a general position.
+        order, counts = self.orbits('-F 4 2 3', [
+            (0, 0, 0), (0.5, 0.5, 0.5), (0.25, 0.25, 0.25),
+            (0.11, 0.23, 0.37)])
+        self.assertEqual(order, 192)
+        self.assertEqual(counts, [4, 4, 8, 192])
+
+    def test_pm3m(self):
+        order, counts = self.orbits('-P 4 2 3', [
+            (0, 0, 0), (0.5, 0, 0), (0.5, 0.5, 0), (0.11, 0.23, 0.37)])
+        self.assertEqual(order, 48)
+        self.assertEqual(counts, [1, 3, 3, 48])
+
+    def test_rounded_special_position(self):
+        # Coordinates written with few digits still land on the site.
+        group, generators = symmetry.group('-F 4 2 3')
+        self.assertEqual(
+            len(symmetry.orbit((0.25, 0.2500001, 0.249999), generators)), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()